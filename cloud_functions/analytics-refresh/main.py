@@ -0,0 +1,314 @@
+import datetime
+import os
+import functions_framework
+
+from shared import clients, envelope, telemetry
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "data-app-dev-2")
+BQ_DATASET_ID = os.getenv("BQ_DATASET", "insightiq_data")
+ANALYTICS_DATASET_ID = os.getenv("ANALYTICS_DATASET", "processed_data")
+ANALYTICS_TABLE_NAME = os.getenv("ANALYTICS_TABLE", "campaign_analytics")
+
+CAMPAIGNS_TABLE_ID = f"{GCP_PROJECT_ID}.{BQ_DATASET_ID}.mailchimp_campaigns"
+REPORTS_TABLE_ID = f"{GCP_PROJECT_ID}.{BQ_DATASET_ID}.mailchimp_reports"
+ANALYTICS_TABLE_ID = f"{GCP_PROJECT_ID}.{ANALYTICS_DATASET_ID}.{ANALYTICS_TABLE_NAME}"
+
+# The loader may still be writing a sync's rows when its sync-completed event
+# arrives. Until this much time has passed the event is retried (the function
+# is deployed with --retry) rather than merged with rows missing.
+MAX_WAIT_SECONDS = int(os.getenv("REFRESH_MAX_WAIT_SECONDS", "1800"))
+
+# One table for every tenant, laid out like the loader's campaigns table so a
+# tenant's dashboards only read that tenant's clustered blocks.
+CREATE_TABLE_SQL = f"""
+CREATE TABLE IF NOT EXISTS `{ANALYTICS_TABLE_ID}` (
+  user_id STRING,
+  campaign_id STRING,
+  subject_line STRING,
+  send_time TIMESTAMP,
+  opens_total INT64,
+  clicks_total INT64,
+  open_rate FLOAT64,
+  subject_line_length INT64,
+  has_personalization BOOL,
+  has_question BOOL,
+  has_number BOOL,
+  has_promo_word BOOL,
+  send_day_of_week INT64,
+  send_hour_of_day INT64,
+  click_through_open_rate FLOAT64,
+  sync_id STRING,
+  refreshed_at TIMESTAMP
+)
+PARTITION BY TIMESTAMP_TRUNC(send_time, MONTH)
+CLUSTER BY user_id, campaign_id
+"""
+
+# Same features as 02-data-analysis.ipynb, computed only for the campaigns a
+# sync changed: campaigns it loaded, and campaigns whose report it refreshed.
+# Opens, clicks and open rate come from the latest report when there is one,
+# since a campaign's own report_summary is only read when it is first synced.
+# @user_id / @sync_id NULL widen the refresh to every tenant / every sync,
+# which is how the table is backfilled. {{report_stats}} is REPORT_STATS_SQL,
+# or NO_REPORT_STATS_SQL until the first reports have been loaded.
+# sync_id is not part of the tables' layout, so without {{window}} every scan
+# reads the tenant's whole history; the sync's changed_since turns it into a
+# send_time filter that prunes the partitions the sync cannot have touched.
+MERGE_SQL = f"""
+MERGE `{ANALYTICS_TABLE_ID}` T
+USING (
+  WITH reports AS ({{report_stats}}),
+  changed AS (
+    SELECT user_id, campaign_id FROM `{CAMPAIGNS_TABLE_ID}`
+    WHERE (@user_id IS NULL OR user_id = @user_id) AND (@sync_id IS NULL OR sync_id = @sync_id) {{window}}
+    UNION DISTINCT
+    SELECT user_id, campaign_id FROM reports
+    WHERE (@user_id IS NULL OR user_id = @user_id) AND (@sync_id IS NULL OR sync_id = @sync_id) {{window}}
+  ),
+  latest_campaigns AS (
+    SELECT c.*
+    FROM `{CAMPAIGNS_TABLE_ID}` c JOIN changed USING (user_id, campaign_id)
+    WHERE (@user_id IS NULL OR c.user_id = @user_id) {{window}}
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY user_id, campaign_id ORDER BY synced_at DESC) = 1
+  ),
+  latest_reports AS (
+    SELECT r.*
+    FROM reports r JOIN changed USING (user_id, campaign_id)
+    WHERE (@user_id IS NULL OR r.user_id = @user_id) {{window}}
+    QUALIFY ROW_NUMBER() OVER (PARTITION BY user_id, campaign_id ORDER BY synced_at DESC) = 1
+  ),
+  stats AS (
+    SELECT
+      c.user_id,
+      c.campaign_id,
+      c.subject_line,
+      c.send_time,
+      COALESCE(r.opens, c.opens) AS opens,
+      COALESCE(r.clicks, c.clicks) AS clicks,
+      COALESCE(r.open_rate, c.open_rate) AS open_rate,
+      COALESCE(@sync_id, r.sync_id, c.sync_id) AS sync_id
+    FROM latest_campaigns c LEFT JOIN latest_reports r USING (user_id, campaign_id)
+  )
+  SELECT
+    user_id,
+    campaign_id,
+    subject_line,
+    send_time,
+    opens AS opens_total,
+    clicks AS clicks_total,
+    open_rate,
+    CHAR_LENGTH(subject_line) AS subject_line_length,
+    STRPOS(LOWER(subject_line), '*|fname|*') > 0 AS has_personalization,
+    STRPOS(subject_line, '?') > 0 AS has_question,
+    REGEXP_CONTAINS(subject_line, r'\\d') AS has_number,
+    REGEXP_CONTAINS(LOWER(subject_line), r'sale|free|% off|discount|save') AS has_promo_word,
+    EXTRACT(DAYOFWEEK FROM send_time) AS send_day_of_week,
+    EXTRACT(HOUR FROM send_time) AS send_hour_of_day,
+    SAFE_DIVIDE(clicks, opens) AS click_through_open_rate,
+    sync_id
+  FROM stats
+) S
+ON T.user_id = S.user_id AND T.campaign_id = S.campaign_id
+WHEN MATCHED THEN UPDATE SET
+  subject_line = S.subject_line,
+  send_time = S.send_time,
+  opens_total = S.opens_total,
+  clicks_total = S.clicks_total,
+  open_rate = S.open_rate,
+  subject_line_length = S.subject_line_length,
+  has_personalization = S.has_personalization,
+  has_question = S.has_question,
+  has_number = S.has_number,
+  has_promo_word = S.has_promo_word,
+  send_day_of_week = S.send_day_of_week,
+  send_hour_of_day = S.send_hour_of_day,
+  click_through_open_rate = S.click_through_open_rate,
+  sync_id = S.sync_id,
+  refreshed_at = CURRENT_TIMESTAMP()
+WHEN NOT MATCHED THEN INSERT (
+  user_id, campaign_id, subject_line, send_time, opens_total, clicks_total, open_rate,
+  subject_line_length, has_personalization, has_question, has_number, has_promo_word,
+  send_day_of_week, send_hour_of_day, click_through_open_rate, sync_id, refreshed_at
+) VALUES (
+  S.user_id, S.campaign_id, S.subject_line, S.send_time, S.opens_total, S.clicks_total, S.open_rate,
+  S.subject_line_length, S.has_personalization, S.has_question, S.has_number, S.has_promo_word,
+  S.send_day_of_week, S.send_hour_of_day, S.click_through_open_rate, S.sync_id, CURRENT_TIMESTAMP()
+)
+"""
+
+REPORT_STATS_SQL = f"""
+SELECT user_id, campaign_id, send_time, opens, clicks, open_rate, sync_id, synced_at FROM `{REPORTS_TABLE_ID}`
+"""
+
+NO_REPORT_STATS_SQL = """
+SELECT CAST(NULL AS STRING) AS user_id, CAST(NULL AS STRING) AS campaign_id,
+  CAST(NULL AS TIMESTAMP) AS send_time, CAST(NULL AS INT64) AS opens,
+  CAST(NULL AS INT64) AS clicks, CAST(NULL AS FLOAT64) AS open_rate, CAST(NULL AS STRING) AS sync_id,
+  CAST(NULL AS TIMESTAMP) AS synced_at
+LIMIT 0
+"""
+
+# Every campaign and report a sync changed was sent at or after changed_since.
+WINDOW_SQL = "AND send_time >= @changed_since"
+
+# Tables whose rows the refresh waits for, by the record_counts key the extractor reports.
+WAIT_FOR_TABLES = {
+    "mailchimp_campaigns": CAMPAIGNS_TABLE_ID,
+    "mailchimp_reports": REPORTS_TABLE_ID,
+}
+
+LOADED_ROWS_SQL = """
+SELECT COUNT(DISTINCT campaign_id) AS loaded
+FROM `{table_id}`
+WHERE user_id = @user_id AND sync_id = @sync_id {window}
+"""
+
+# --- Client ---
+# The BigQuery client is created on first use (clients.bigquery_client()).
+
+
+class SyncNotLoadedError(Exception):
+    """Raised so Pub/Sub redelivers the event once the loader has caught up."""
+
+
+# ===================================================================
+#           2. REFRESH STAGE
+# ===================================================================
+
+def query_parameters(user_id, sync_id, changed_since=None):
+    from google.cloud import bigquery
+    parameters = [
+        bigquery.ScalarQueryParameter("user_id", "STRING", user_id),
+        bigquery.ScalarQueryParameter("sync_id", "STRING", sync_id),
+    ]
+    if changed_since:
+        parameters.append(bigquery.ScalarQueryParameter("changed_since", "TIMESTAMP", parse_time(changed_since)))
+    return parameters
+
+
+def window_sql(changed_since):
+    """The partition filter for a sync's send_time window; empty when it covers everything."""
+    return WINDOW_SQL if changed_since else ""
+
+
+def loaded_campaigns(table_id, user_id, sync_id, changed_since=None):
+    """Returns how many distinct campaigns of the sync are already in table_id."""
+    from google.cloud import bigquery
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters(user_id, sync_id, changed_since))
+    sql = LOADED_ROWS_SQL.format(table_id=table_id, window=window_sql(changed_since))
+    rows = clients.bigquery_client().query(sql, job_config=job_config).result()
+    return next(iter(rows)).loaded
+
+
+_reports_loaded = False
+_analytics_table_created = False
+
+
+def report_stats_sql():
+    """Reads report stats once the loader has created the reports table."""
+    global _reports_loaded
+    from google.api_core.exceptions import NotFound
+    if not _reports_loaded:
+        try:
+            clients.bigquery_client().get_table(REPORTS_TABLE_ID)
+            _reports_loaded = True
+        except NotFound:
+            return NO_REPORT_STATS_SQL
+    return REPORT_STATS_SQL
+
+
+def ensure_analytics_table():
+    """Runs CREATE_TABLE_SQL once per instance; later refreshes skip the DDL job."""
+    global _analytics_table_created
+    if not _analytics_table_created:
+        clients.bigquery_client().query(CREATE_TABLE_SQL).result()
+        _analytics_table_created = True
+
+
+def refresh_campaign_analytics(user_id=None, sync_id=None, changed_since=None):
+    """
+    MERGEs the campaigns written by one sync into the analytics table.
+    Leaving user_id and sync_id unset refreshes every tenant's full history;
+    changed_since limits the scans to campaigns sent from then on.
+    Returns the number of analytics rows inserted or updated.
+    """
+    from google.cloud import bigquery
+    ensure_analytics_table()
+    bq_client = clients.bigquery_client()
+    job_config = bigquery.QueryJobConfig(query_parameters=query_parameters(user_id, sync_id, changed_since))
+    sql = MERGE_SQL.format(report_stats=report_stats_sql(), window=window_sql(changed_since))
+    job = bq_client.query(sql, job_config=job_config)
+    job.result()
+    return job.num_dml_affected_rows or 0
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def event_age_seconds(cloud_event):
+    published = parse_time(cloud_event["time"])
+    return (datetime.datetime.now(datetime.timezone.utc) - published).total_seconds()
+
+
+# ===================================================================
+#           3. MAIN CLOUD FUNCTION (PUBSUB TRIGGER)
+# ===================================================================
+
+@functions_framework.cloud_event
+def analytics_refresh(cloud_event):
+    """
+    Incrementally refreshes the multi-tenant campaign analytics table.
+    1. Triggered by a message on the 'sync-completed' topic.
+    2. Waits (by failing and being redelivered) until the loader has written
+       every campaign and report the sync published.
+    3. MERGEs only the campaigns that sync changed into the analytics table,
+       reading only the partitions sent within the sync's window.
+    A message without user_id/sync_id backfills the table for every tenant.
+    """
+    # 1. Decode the incoming message
+    try:
+        payload = envelope.decode_event(cloud_event)
+        user_id = payload.get("user_id")
+        sync_id = payload.get("sync_id")
+        record_counts = payload.get("record_counts") or {}
+        changed_since = payload.get("changed_since")
+        expected = {table: record_counts.get(table, 0) for table in WAIT_FOR_TABLES}
+    except Exception as e:
+        print(f"!!! Error decoding Pub/Sub message: {e}")
+        return
+
+    if payload.get("record_counts") is not None and not any(expected.values()):
+        print(f"Sync {sync_id} changed no campaigns or reports; nothing to refresh.")
+        return
+
+    # 2. Make sure the loader has caught up with the sync
+    if user_id and sync_id:
+        for table, count in expected.items():
+            if not count:
+                continue
+            loaded = loaded_campaigns(WAIT_FOR_TABLES[table], user_id, sync_id, changed_since)
+            if loaded < count:
+                if event_age_seconds(cloud_event) < MAX_WAIT_SECONDS:
+                    raise SyncNotLoadedError(f"Sync {sync_id}: {loaded}/{count} {table} rows loaded so far.")
+                print(f"!!! Sync {sync_id}: only {loaded}/{count} {table} rows loaded after "
+                      f"{MAX_WAIT_SECONDS}s; refreshing with what is there.")
+
+    # 3. Merge the changed campaigns
+    scope = f"user {user_id}, sync {sync_id}" if user_id else "all tenants"
+    if changed_since:
+        scope += f", campaigns sent since {changed_since}"
+    print(f"--- Refreshing {ANALYTICS_TABLE_ID} for {scope} ---")
+    try:
+        with telemetry.trace(cloud_event, sync_id=sync_id), \
+                telemetry.span("analytics_refresh", user_id=user_id) as span:
+            changed = refresh_campaign_analytics(user_id, sync_id, changed_since)
+            span.add(records=changed)
+        print(f"Successfully merged {changed} campaign analytics rows.")
+    except Exception as e:
+        print(f"!!! Error refreshing campaign analytics: {e}")
+        raise
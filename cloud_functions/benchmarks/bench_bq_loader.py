@@ -0,0 +1,72 @@
+"""
+Throughput of the bq-loader insert paths against a local BigQuery stand-in.
+
+    python cloud_functions/benchmarks/bench_bq_loader.py --rows 5000
+
+"stream" is the original path: one insert_rows_json call per message.
+"batch" pushes the same rows through RowBatcher.
+"""
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, os.path.join(HERE, "..", "bq-loader"))
+
+from batching import RowBatcher  # noqa: E402
+from fakes import FakeBigQueryClient  # noqa: E402
+
+TABLE_ID = "bench-project.bench_dataset.mailchimp_campaigns"
+
+
+def make_row(i):
+    return {
+        "id": f"campaign-{i}",
+        "type": "regular",
+        "status": "sent",
+        "settings": {"subject_line": f"Spring sale {i}% off", "title": f"Campaign {i}"},
+        "report_summary": {"opens": i % 977, "open_rate": (i % 100) / 100},
+    }
+
+
+def run_stream(client, rows):
+    for row in rows:
+        client.insert_rows_json(TABLE_ID, [row])
+
+
+def run_batch(client, rows, max_rows):
+    batcher = RowBatcher(client.insert_rows_json, max_rows=max_rows)
+    for row in rows:
+        batcher.add(TABLE_ID, row)
+    batcher.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-rows", type=int, default=500)
+    parser.add_argument("--call-latency", type=float, default=0.02,
+                        help="Simulated round trip per insert request, in seconds.")
+    args = parser.parse_args()
+
+    rows = [make_row(i) for i in range(args.rows)]
+    print(f"{'mode':<8}{'rows':>10}{'calls':>10}{'seconds':>10}{'rows/sec':>12}")
+
+    for mode in ("stream", "batch"):
+        client = FakeBigQueryClient(call_latency=args.call_latency)
+        started = time.perf_counter()
+        if mode == "stream":
+            run_stream(client, rows)
+        else:
+            run_batch(client, rows, args.batch_rows)
+        elapsed = time.perf_counter() - started
+
+        assert client.row_count() == len(rows)
+        print(f"{mode:<8}{len(rows):>10}{client.insert_calls:>10}"
+              f"{elapsed:>10.2f}{len(rows) / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Nightly refresh of many tenants: one start_bulk_sync request against one
+start_data_sync request per tenant, through the same pipeline as
+bench_pipeline.py (router -> mailchimp_sync -> bq_loader on the fakes,
+Mailchimp served by fake_mailchimp.py).
+
+    python cloud_functions/benchmarks/bench_bulk_sync.py --tenants 200 --max-concurrency 5,20
+
+Reported per run: HTTP requests made, wall time, records loaded, the most
+Mailchimp syncs that ran at once, and, for bulk jobs, what get_sync_job
+reports once the job is done (status, per-status counts and its record
+totals against the rows that reached BigQuery).
+
+A finished sync dispatches the job's next one before its invocation
+returns, so "peak syncs" can read one above the cap while the two overlap.
+All synthetic tenants share the API's per-host rate limits here, which
+bound the wall time of every run alike.
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import bench_pipeline  # noqa: E402
+import fake_mailchimp  # noqa: E402
+from bench_pipeline import FakeRequest, load_function, topic  # noqa: E402
+
+
+class InFlight:
+    """Wraps a handler and records how many invocations of it overlapped."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, cloud_event):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            return self.handler(cloud_event)
+        finally:
+            with self._lock:
+                self.current -= 1
+
+    def reset(self):
+        self.peak = 0
+
+
+def add_tenants(backends, prefix, count, records):
+    """Stores Mailchimp credentials for count synthetic tenants of the given size."""
+    campaigns = max(1, records // 50)
+    users = [f"{prefix}-{i}" for i in range(count)]
+    for user_id in users:
+        backends.firestore.collection("user_credentials").document(user_id).set({
+            "mailchimp_access_token": f"bench:{campaigns}:{records - campaigns}",
+            "mailchimp_server_prefix": "bench",
+        })
+    return users
+
+
+def run(label, start, backends, extractor_calls, requests_made):
+    backends.bigquery.tables.clear()
+    extractor_calls.reset()
+    errors_before = len(backends.pubsub.errors)
+    started = time.perf_counter()
+    response = start()
+    backends.pubsub.wait_idle()
+    return {
+        "label": label,
+        "requests": requests_made,
+        "seconds": round(time.perf_counter() - started, 2),
+        "records_loaded": backends.bigquery.row_count(),
+        "peak_syncs": extractor_calls.peak,
+        "errors": len(backends.pubsub.errors) - errors_before,
+        "response": response,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--records", type=int, default=500, help="Records per tenant.")
+    parser.add_argument("--max-concurrency", default="5,20",
+                        help="Comma-separated per-source caps to run bulk jobs with.")
+    parser.add_argument("--concurrency", type=int, default=64, help="Concurrent function invocations.")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds per Mailchimp request.")
+    parser.add_argument("--bq-latency", type=float, default=0.02, help="Seconds per BigQuery call.")
+    parser.add_argument("--verbose", action="store_true", help="Show the functions' log output.")
+    args = parser.parse_args()
+
+    server, base_url = fake_mailchimp.start_server(args.api_latency)
+    pipeline_args = types.SimpleNamespace(
+        loader_mode="stream", load_mode="stream", page_workers=4, time_budget=None, bq_latency=args.bq_latency,
+        pubsub_latency=0.0, concurrency=args.concurrency, page_size=1000, unthrottled=False)
+    backends, start_data_sync, _, _ = bench_pipeline.build_pipeline(pipeline_args, base_url)
+    start = load_function("http-start-sync", "bench_start_bulk_sync")
+
+    trigger_topic = topic("trigger-mailchimp-sync")
+    extractor_calls = InFlight(backends.pubsub.subscribers[trigger_topic])
+    backends.pubsub.subscribe(trigger_topic, extractor_calls)
+
+    results = []
+    with open(os.devnull, "w") as devnull:
+        logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+        with logs:
+            users = add_tenants(backends, "single", args.tenants, args.records)
+            results.append(run("one request per tenant", lambda: [
+                start_data_sync(FakeRequest({"user": user_id, "source": "mailchimp"})) for user_id in users
+            ], backends, extractor_calls, len(users)))
+
+            for cap in (int(c) for c in args.max_concurrency.split(",")):
+                users = add_tenants(backends, f"bulk{cap}", args.tenants, args.records)
+                request = FakeRequest({"users": users, "sources": ["mailchimp"], "max_concurrency": cap})
+                result = run(f"bulk, max_concurrency={cap}", lambda: start.start_bulk_sync(request),
+                             backends, extractor_calls, 1)
+                body, status = result["response"]
+                poll = FakeRequest(None)
+                poll.args = {"job_id": body["job_id"]}
+                job, _ = start.get_sync_job(poll)
+                result["job"] = {"http_status": status, "status": job["status"], "counts": job["counts"],
+                                 "records": job["records"]}
+                results.append(result)
+    server.terminate()
+
+    print(f"{args.tenants} tenants x {args.records} records")
+    print(f"{'run':<28}{'requests':>9}{'seconds':>9}{'loaded':>9}{'peak syncs':>12}{'errors':>8}")
+    for result in results:
+        print(f"{result['label']:<28}{result['requests']:>9}{result['seconds']:>9.2f}"
+              f"{result['records_loaded']:>9}{result['peak_syncs']:>12}{result['errors']:>8}")
+        if "job" in result:
+            job = result["job"]
+            print(f"{'':<4}job: {job['status']}, counts {job['counts']}, records {job['records']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Cold-start benchmark: module import time plus the first request of every
+function, each measured in a fresh interpreter.
+
+    python cloud_functions/benchmarks/bench_cold_start.py
+    python cloud_functions/benchmarks/bench_cold_start.py --compare-ref HEAD~1 --runs 7
+    python cloud_functions/benchmarks/bench_cold_start.py --fakes
+
+The first request is one that needs no Google Cloud backend (a request or
+message with fields missing), which is exactly the path that should not pay
+for client construction.
+
+Without --fakes the functions import the real Google Cloud libraries, so run
+it where the functions' requirements and application default credentials are
+available (constructing a client reads credentials but makes no API calls).
+--fakes swaps in fakes.py instead: that isolates the repo's own import work
+but hides the cost of the libraries themselves.
+
+--compare-ref also measures the functions as they were at a git revision
+(exported with `git archive`), e.g. the commit before clients became lazy.
+"""
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.dirname(HERE)
+REPO_DIR = os.path.dirname(FUNCTIONS_DIR)
+
+# (directory, entry point, trigger, first request)
+FUNCTIONS = [
+    ("http-start-sync", "start_data_sync", "http", {}),
+    ("pubsub-data-sync", "process_data_sync", "pubsub", {}),
+    ("extractors/mailchimp-sync", "mailchimp_sync", "pubsub", {}),
+    ("extractors/constant-contact-sync", "constant_contact_sync", "pubsub", {}),
+    ("bq-loader", "bq_loader", "pubsub", {}),
+    ("analytics-refresh", "analytics_refresh", "pubsub", {"record_counts": {}}),
+    ("oauth/mailchimp-callback", "mailchimp_oauth_callback", "http", {}),
+    ("oauth/constant-contact-callback", "constant_contact_oauth_callback", "http", {}),
+]
+
+
+class FakeRequest:
+    """A Flask request carrying the given JSON body and query arguments."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.method = "POST"
+        self.headers = {}
+        self.args = dict(payload)
+        self.base_url = "http://localhost/"
+
+    def get_json(self, silent=False):
+        return self.payload
+
+
+class CloudEvent:
+    """A Pub/Sub CloudEvent carrying the given JSON payload."""
+
+    def __init__(self, payload):
+        self.data = {"message": {
+            "data": base64.b64encode(json.dumps(payload).encode("utf-8")).decode("ascii"),
+            "attributes": {},
+            "messageId": "cold-start",
+            "publishTime": "2024-01-01T00:00:00Z",
+        }}
+
+    def __getitem__(self, key):
+        return {"id": "cold-start", "time": "2024-01-01T00:00:00Z"}[key]
+
+
+# ===================================================================
+#           CHILD: ONE COLD START
+# ===================================================================
+
+def cold_start(functions_dir, directory, use_fakes):
+    """Imports one function and serves its first request; runs in a fresh interpreter."""
+    entry = next(f for f in FUNCTIONS if f[0] == directory)
+    _, entry_point, trigger, payload = entry
+    if use_fakes:
+        sys.path.insert(0, HERE)
+        import fakes
+        fakes.install_fake_modules()
+
+    function_dir = os.path.join(functions_dir, directory)
+    sys.path[:0] = [function_dir, functions_dir]
+    os.environ.setdefault("GCP_PROJECT", "cold-start-bench")
+
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("main", os.path.join(function_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    imported = time.perf_counter()
+
+    request = FakeRequest(payload) if trigger == "http" else CloudEvent(payload)
+    getattr(module, entry_point)(request)
+    served = time.perf_counter()
+
+    return {"import_ms": (imported - started) * 1000, "first_request_ms": (served - imported) * 1000}
+
+
+def run_child(functions_dir, directory, use_fakes, python):
+    """Runs one cold start in a subprocess; returns its timings or the error it hit."""
+    command = [python, os.path.abspath(__file__), "--child", directory, "--functions-dir", functions_dir]
+    if use_fakes:
+        command.append("--fakes")
+    result = subprocess.run(command, capture_output=True, text=True)
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"error": (result.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+
+# ===================================================================
+#           PARENT: MEDIANS PER FUNCTION AND TREE
+# ===================================================================
+
+def export_ref(ref):
+    """Exports cloud_functions/ at a git revision into a temporary directory."""
+    target = tempfile.mkdtemp(prefix="cold-start-")
+    archive = subprocess.run(["git", "-C", REPO_DIR, "archive", ref, "cloud_functions"],
+                             capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return target, os.path.join(target, "cloud_functions")
+
+
+def measure(functions_dir, runs, use_fakes, python):
+    results = {}
+    for directory, *_ in FUNCTIONS:
+        if not os.path.exists(os.path.join(functions_dir, directory, "main.py")):
+            continue
+        samples = [run_child(functions_dir, directory, use_fakes, python) for _ in range(runs)]
+        errors = [s["error"] for s in samples if "error" in s]
+        if errors:
+            results[directory] = {"error": errors[0]}
+            continue
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        request_ms = statistics.median(s["first_request_ms"] for s in samples)
+        results[directory] = {"import_ms": round(import_ms, 1), "first_request_ms": round(request_ms, 1),
+                              "total_ms": round(import_ms + request_ms, 1)}
+    return results
+
+
+def print_results(label, results):
+    print(f"\n{label}")
+    print(f"{'function':<34}{'import ms':>11}{'1st req ms':>12}{'total ms':>10}")
+    for directory, stats in results.items():
+        if "error" in stats:
+            print(f"{directory:<34}  !!! {stats['error']}")
+        else:
+            print(f"{directory:<34}{stats['import_ms']:>11.1f}{stats['first_request_ms']:>12.1f}"
+                  f"{stats['total_ms']:>10.1f}")
+
+
+def print_comparison(before, after):
+    print(f"\n{'function':<34}{'before ms':>11}{'after ms':>10}{'speedup':>9}")
+    for directory, stats in after.items():
+        old = before.get(directory, {})
+        if "total_ms" in stats and "total_ms" in old:
+            print(f"{directory:<34}{old['total_ms']:>11.1f}{stats['total_ms']:>10.1f}"
+                  f"{old['total_ms'] / stats['total_ms']:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per function (the median is reported).")
+    parser.add_argument("--fakes", action="store_true", help="Use fakes.py instead of the Google libraries.")
+    parser.add_argument("--compare-ref", help="Also measure the functions at this git revision.")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to run the cold starts with.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--functions-dir", default=FUNCTIONS_DIR, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Keep the function's own log lines off the line the parent parses.
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                timings = cold_start(args.functions_dir, args.child, args.fakes)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(timings))
+        return
+
+    results = {"current": measure(FUNCTIONS_DIR, args.runs, args.fakes, args.python)}
+    print_results("Working tree", results["current"])
+    if args.compare_ref:
+        export_dir, functions_dir = export_ref(args.compare_ref)
+        try:
+            results[args.compare_ref] = measure(functions_dir, args.runs, args.fakes, args.python)
+        finally:
+            shutil.rmtree(export_dir)
+        print_results(args.compare_ref, results[args.compare_ref])
+        print_comparison(results[args.compare_ref], results["current"])
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
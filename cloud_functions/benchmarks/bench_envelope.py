@@ -0,0 +1,76 @@
+"""
+Encode/decode throughput and message size of loader envelopes, for every
+JSON backend (json, orjson) and compression (none, gzip, zstd) available.
+
+    python cloud_functions/benchmarks/bench_envelope.py
+    python cloud_functions/benchmarks/bench_envelope.py --records 500 --repeat 50
+
+Each envelope holds --records synthetic Mailchimp campaigns, the shape the
+extractor publishes. Encoding is what the extractor pays per message;
+decoding (from the raw message bytes) is what the loader pays.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import fake_mailchimp  # noqa: E402
+from shared import envelope  # noqa: E402
+
+COMPRESSIONS = ["", "gzip"] + (["zstd"] if importlib.util.find_spec("zstandard") else [])
+
+
+def make_envelope(records):
+    return {"source": "mailchimp", "user_id": "bench-user", "table_name": "mailchimp_campaigns",
+            "records": [fake_mailchimp.make_campaign(i) for i in range(records)]}
+
+
+def time_per_call(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def measure(payload, backend, compression, repeat):
+    # Swap the module's serializer, as importing it with only that backend installed would.
+    envelope.dumps, envelope.loads = envelope.JSON_BACKENDS[backend]
+    encode_s, (data, attributes) = time_per_call(lambda: envelope.encode(payload, compression), repeat)
+    decode_s, decoded = time_per_call(lambda: envelope.decode(data, attributes), repeat)
+    assert len(decoded["records"]) == len(payload["records"])
+    return {"bytes": len(data), "encode_ms": encode_s * 1000, "decode_ms": decode_s * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=500, help="Records per envelope.")
+    parser.add_argument("--repeat", type=int, default=20, help="Encodes/decodes timed per combination.")
+    args = parser.parse_args()
+
+    payload = make_envelope(args.records)
+    envelope.COMPRESSION_MIN_BYTES = 0
+    default_backend = envelope.JSON_BACKEND
+
+    print(f"{args.records} records per envelope; default backend: {default_backend}")
+    print(f"{'json':<8}{'compression':<13}{'bytes':>10}{'encode ms':>11}{'decode ms':>11}"
+          f"{'enc MB/s':>10}{'dec MB/s':>10}")
+    baseline = None
+    for backend in envelope.JSON_BACKENDS:
+        for compression in COMPRESSIONS:
+            stats = measure(payload, backend, compression, args.repeat)
+            if baseline is None:
+                baseline = stats
+            raw_mb = baseline["bytes"] / 1e6
+            print(f"{backend:<8}{compression or 'none':<13}{stats['bytes']:>10}"
+                  f"{stats['encode_ms']:>11.2f}{stats['decode_ms']:>11.2f}"
+                  f"{raw_mb / (stats['encode_ms'] / 1000):>10.1f}{raw_mb / (stats['decode_ms'] / 1000):>10.1f}")
+    envelope.dumps, envelope.loads = envelope.JSON_BACKENDS[default_backend]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Latency of the OAuth callbacks against local stand-ins: the time from the
+provider's redirect hitting the function to the redirect back to the app.
+
+    python cloud_functions/benchmarks/bench_oauth_callbacks.py
+    python cloud_functions/benchmarks/bench_oauth_callbacks.py --compare-ref HEAD~1 --requests 200
+
+Secret Manager, Firestore and Pub/Sub are the fakes in fakes.py; the
+provider's token endpoint is a stub that answers after --token-latency.
+A publish future resolves --publish-latency after the publish, like the
+round trip the real client makes in the background, so a callback that
+waits on it pays for it. The callbacks now queue the initial sync in
+Firestore for oauth/initial-sync instead; "triggers" counts both kinds.
+
+Each tree is measured in a fresh interpreter, serving --requests callbacks
+for different users one after another on one warm instance. --compare-ref
+also measures the callbacks as they were at a git revision.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.dirname(HERE)
+PROJECT_ID = "bench-project"
+
+# (directory, entry point, app credentials secret)
+CALLBACKS = [
+    ("oauth/mailchimp-callback", "mailchimp_oauth_callback", "mailchimp-oauth-credentials"),
+    ("oauth/constant-contact-callback", "constant_contact_oauth_callback", "constant_contact_oauth_credentials"),
+]
+
+
+class FakeRequest:
+    """The parts of a Flask request the callbacks read."""
+
+    def __init__(self, code, user_id):
+        self.args = {"code": code, "state": user_id}
+        self.base_url = "http://localhost/callback"
+
+
+def token_endpoint(latency):
+    """A stand-in for the providers' token endpoints."""
+    def post(url, data=None, timeout=None, **kwargs):
+        time.sleep(latency)
+        body = {"access_token": f"token-{data['code']}", "refresh_token": "refresh", "dc": "us1"}
+        return types.SimpleNamespace(status_code=200, raise_for_status=lambda: None, json=lambda: body)
+    return post
+
+
+def sync_triggers(backends):
+    """Initial syncs published to Pub/Sub or queued in pending_syncs."""
+    return sum(backends.pubsub.published.values()) + len(backends.firestore.collection("pending_syncs").stream())
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1)]
+
+
+# ===================================================================
+#           CHILD: ONE TREE
+# ===================================================================
+
+def serve_callbacks(functions_dir, args):
+    """Serves args.requests callbacks per function; runs in a fresh interpreter."""
+    sys.path.insert(0, HERE)
+    import fakes
+    backends = fakes.install_fake_modules(
+        pubsub=fakes.FakePubSub(result_latency=args.publish_latency),
+        secrets=fakes.FakeSecretManager(call_latency=args.secret_latency),
+    )
+    for _, _, secret_name in CALLBACKS:
+        backends.secrets.secrets[f"projects/{PROJECT_ID}/secrets/{secret_name}/versions/latest"] = json.dumps(
+            {"client_id": "bench-client", "client_secret": "bench-secret"})
+
+    os.environ["GCP_PROJECT_ID"] = PROJECT_ID
+    sys.path.insert(0, functions_dir)
+    from shared import http_client
+    http_client.post = token_endpoint(args.token_latency)
+
+    results = {}
+    for directory, entry_point, _ in CALLBACKS:
+        function_dir = os.path.join(functions_dir, directory)
+        sys.path.insert(0, function_dir)
+        spec = importlib.util.spec_from_file_location(entry_point, os.path.join(function_dir, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        callback = getattr(module, entry_point)
+
+        latencies = []
+        triggers_before = sync_triggers(backends)
+        for i in range(args.requests):
+            started = time.perf_counter()
+            response = callback(FakeRequest(f"code-{i}", f"{entry_point}-user-{i}"))
+            latencies.append((time.perf_counter() - started) * 1000)
+            status = response[1] if isinstance(response, tuple) else 302
+            if status != 302:
+                raise RuntimeError(f"{entry_point} answered {response}")
+        sys.path.remove(function_dir)
+
+        results[directory] = {
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p99_ms": round(percentile(latencies, 99), 1),
+            "mean_ms": round(statistics.mean(latencies), 1),
+            "sync_triggers": sync_triggers(backends) - triggers_before,
+        }
+    results["secret_manager_calls"] = backends.secrets.calls
+    return results
+
+
+def run_child(functions_dir, args):
+    command = [args.python, os.path.abspath(__file__), "--child", "--functions-dir", functions_dir,
+               "--requests", str(args.requests), "--token-latency", str(args.token_latency),
+               "--secret-latency", str(args.secret_latency), "--publish-latency", str(args.publish_latency)]
+    result = subprocess.run(command, capture_output=True, text=True)
+    lines = [line for line in result.stdout.splitlines() if line.startswith("{")]
+    if result.returncode != 0 or not lines:
+        raise RuntimeError((result.stderr.strip().splitlines() or ["no output"])[-1])
+    return json.loads(lines[-1])
+
+
+# ===================================================================
+#           PARENT
+# ===================================================================
+
+def print_results(label, results):
+    print(f"\n{label} (Secret Manager calls: {results['secret_manager_calls']})")
+    print(f"{'callback':<34}{'p50 ms':>9}{'p99 ms':>9}{'mean ms':>9}{'triggers':>10}")
+    for directory, _, _ in CALLBACKS:
+        stats = results[directory]
+        print(f"{directory:<34}{stats['p50_ms']:>9.1f}{stats['p99_ms']:>9.1f}{stats['mean_ms']:>9.1f}"
+              f"{stats['sync_triggers']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="Callbacks served per function.")
+    parser.add_argument("--token-latency", type=float, default=0.15, help="Seconds per token exchange.")
+    parser.add_argument("--secret-latency", type=float, default=0.04, help="Seconds per Secret Manager call.")
+    parser.add_argument("--publish-latency", type=float, default=0.05,
+                        help="Seconds until a publish future resolves.")
+    parser.add_argument("--compare-ref", help="Also measure the callbacks at this git revision.")
+    parser.add_argument("--python", default=sys.executable, help="Interpreter to run the callbacks with.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--functions-dir", default=FUNCTIONS_DIR, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Keep the callbacks' own log lines off the line the parent parses.
+        with open(os.devnull, "w") as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                results = serve_callbacks(args.functions_dir, args)
+            finally:
+                sys.stdout = stdout
+        print(json.dumps(results))
+        return
+
+    results = {"current": run_child(FUNCTIONS_DIR, args)}
+    print_results("Working tree", results["current"])
+    if args.compare_ref:
+        from bench_cold_start import export_ref
+        export_dir, functions_dir = export_ref(args.compare_ref)
+        try:
+            results[args.compare_ref] = run_child(functions_dir, args)
+        finally:
+            shutil.rmtree(export_dir)
+        print_results(args.compare_ref, results[args.compare_ref])
+
+        print(f"\n{'callback':<34}{'p50 before':>12}{'p50 after':>11}{'p99 before':>12}{'p99 after':>11}")
+        for directory, _, _ in CALLBACKS:
+            before, after = results[args.compare_ref][directory], results["current"][directory]
+            print(f"{directory:<34}{before['p50_ms']:>12.1f}{after['p50_ms']:>11.1f}"
+                  f"{before['p99_ms']:>12.1f}{after['p99_ms']:>11.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+End-to-end benchmark of the sync pipeline:
+    start_data_sync -> process_data_sync -> mailchimp_sync -> bq_loader
+
+The real function entry points are imported and wired to in-process fakes
+of Pub/Sub, Firestore, Secret Manager and BigQuery (fakes.py). Mailchimp is
+the synthetic API in fake_mailchimp.py, served over HTTP from a child
+process. Needs the functions' non-Google dependencies (requests).
+
+    python cloud_functions/benchmarks/bench_pipeline.py --sizes 100,1000,10000,100000
+    python cloud_functions/benchmarks/bench_pipeline.py --sizes 1000000 --load-mode bulk
+
+Each tenant size N is split into N/50 campaigns and the rest list members.
+Reported per size: records/sec, Mailchimp API calls, peak traced memory and
+p50/p99 latency of every stage. --output writes the results as JSON;
+--baseline compares against such a file and exits non-zero on a regression.
+"""
+import argparse
+import contextlib
+import functools
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS_DIR = os.path.join(HERE, "..")
+sys.path.insert(0, HERE)
+sys.path.insert(0, FUNCTIONS_DIR)
+
+import fake_mailchimp  # noqa: E402
+import fakes  # noqa: E402
+
+PROJECT_ID = "bench-project"
+
+
+def topic(name):
+    return f"projects/{PROJECT_ID}/topics/{name}"
+
+
+def load_function(directory, module_name):
+    """Imports a function's main.py with its directory on sys.path, as the runtime does."""
+    path = os.path.join(FUNCTIONS_DIR, directory)
+    sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeRequest:
+    """The parts of a Flask request that start_data_sync reads."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.method = "POST"
+        self.headers = {}
+        self.args = {}
+
+    def get_json(self, silent=False):
+        return self.payload
+
+
+class StageTimer:
+    """Collects the duration of every invocation of each stage."""
+
+    def __init__(self):
+        self.durations_ms = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, stage, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(stage, (time.perf_counter() - started) * 1000)
+        return timed
+
+    def record(self, stage, elapsed_ms):
+        with self._lock:
+            self.durations_ms.setdefault(stage, []).append(elapsed_ms)
+
+    def reset(self):
+        with self._lock:
+            self.durations_ms = {}
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1)]
+
+
+def api_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/__stats") as response:
+        return json.load(response)
+
+
+def build_pipeline(args, base_url):
+    """Installs the fakes, imports the four functions and subscribes them to their topics."""
+    os.environ.update({
+        "GCP_PROJECT": PROJECT_ID,
+        "GCP_PROJECT_ID": PROJECT_ID,
+        "LOADER_MODE": args.loader_mode,
+        "LOAD_MODE": args.load_mode,
+        "MAILCHIMP_PAGE_WORKERS": str(args.page_workers),
+        "STAGING_URI": tempfile.mkdtemp(prefix="bench-staging-"),
+    })
+    if args.time_budget is not None:
+        os.environ["SYNC_TIME_BUDGET_SECONDS"] = str(args.time_budget)
+    backends = fakes.install_fake_modules(
+        bigquery_client=fakes.FakeBigQueryClient(call_latency=args.bq_latency),
+        pubsub=fakes.FakePubSub(publish_latency=args.pubsub_latency, max_workers=args.concurrency),
+    )
+
+    start = load_function("http-start-sync", "bench_start_sync")
+    router = load_function("pubsub-data-sync", "bench_router")
+    extractor = load_function(os.path.join("extractors", "mailchimp-sync"), "bench_mailchimp_sync")
+    loader = load_function("bq-loader", "bench_bq_loader")
+
+    # Point the extractor at the synthetic API, with the requested page size.
+    import batch_operations
+    import mailchimp_api
+    from shared import http_client
+    mailchimp_api.api_base_url = lambda server_prefix: f"{base_url}/3.0"
+    mailchimp_api.iter_pages = functools.partial(mailchimp_api.iter_pages, count=args.page_size)
+    batch_operations.member_operations = functools.partial(batch_operations.member_operations,
+                                                           count=args.page_size)
+    if not args.unthrottled:
+        http_client.HOST_LIMITS["127.0.0.1"] = http_client.HOST_LIMITS["api.mailchimp.com"]
+
+    timer = StageTimer()
+    backends.pubsub.subscribe(topic("initiate-data-sync"),
+                              timer.wrap("process_data_sync", router.process_data_sync))
+    backends.pubsub.subscribe(topic("trigger-mailchimp-sync"),
+                              timer.wrap("mailchimp_sync", extractor.mailchimp_sync))
+    backends.pubsub.subscribe(topic("bq-loader-topic"), timer.wrap("bq_loader", loader.bq_loader))
+    return backends, timer.wrap("start_data_sync", start.start_data_sync), timer, loader
+
+
+def run_size(size, run_index, args, base_url, backends, start_data_sync, timer, loader):
+    campaigns = max(1, size // 50)
+    members = size - campaigns
+    user_id = f"bench-{size}-{run_index}"
+    backends.firestore.collection("user_credentials").document(user_id).set({
+        "mailchimp_access_token": f"bench:{campaigns}:{members}",
+        "mailchimp_server_prefix": "bench",
+    })
+    backends.bigquery.tables.clear()
+    timer.reset()
+    errors_before = len(backends.pubsub.errors)
+    calls_before = api_stats(base_url)
+
+    if args.memory:
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    start_data_sync(FakeRequest({"user": user_id, "source": "mailchimp"}))
+    backends.pubsub.wait_idle()
+    elapsed = time.perf_counter() - started
+    peak_bytes = tracemalloc.get_traced_memory()[1] if args.memory else 0
+
+    calls_after = api_stats(base_url)
+    api_calls = sum(calls_after["calls"].values()) - sum(calls_before["calls"].values())
+    api_durations = calls_after["durations_ms"][len(calls_before["durations_ms"]):]
+
+    loaded = backends.bigquery.row_count()
+    stages = {stage: {"count": len(values), "p50_ms": round(percentile(values, 50), 1),
+                      "p99_ms": round(percentile(values, 99), 1)}
+              for stage, values in dict(timer.durations_ms, mailchimp_api=api_durations).items()}
+    return {
+        "size": size,
+        "records_loaded": loaded,
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(loaded / elapsed, 1) if elapsed else 0.0,
+        "api_calls": api_calls,
+        "peak_mib": round(peak_bytes / 1024 ** 2, 1),
+        "errors": len(backends.pubsub.errors) - errors_before,
+        "stages": stages,
+    }
+
+
+def print_result(result):
+    print(f"{result['size']:>9}{result['records_loaded']:>10}{result['seconds']:>10.2f}"
+          f"{result['records_per_sec']:>12.0f}{result['api_calls']:>8}{result['peak_mib']:>10.1f}"
+          f"{result['errors']:>8}")
+    for stage, stats in result["stages"].items():
+        print(f"{'':>9}  {stage:<20}{stats['count']:>8} calls   p50 {stats['p50_ms']:>9.1f} ms"
+              f"   p99 {stats['p99_ms']:>9.1f} ms")
+
+
+def check_baseline(results, baseline_path, tolerance):
+    """Returns the sizes whose records/sec fell more than tolerance below the baseline."""
+    with open(baseline_path) as f:
+        baseline = {result["size"]: result for result in json.load(f)}
+    regressions = []
+    for result in results:
+        expected = baseline.get(result["size"])
+        if expected and result["records_per_sec"] < expected["records_per_sec"] * (1 - tolerance):
+            regressions.append((result["size"], expected["records_per_sec"], result["records_per_sec"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="Comma-separated tenant sizes in records (up to 1000000).")
+    parser.add_argument("--load-mode", choices=["stream", "bulk"], default="stream")
+    parser.add_argument("--loader-mode", choices=["stream", "batch"], default="stream")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--page-workers", type=int, default=4)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="Seconds per Mailchimp request.")
+    parser.add_argument("--api-record-latency", type=float, default=0.00001,
+                        help="Extra seconds per record a Mailchimp response carries.")
+    parser.add_argument("--bq-latency", type=float, default=0.02, help="Seconds per BigQuery call.")
+    parser.add_argument("--pubsub-latency", type=float, default=0.0, help="Seconds per publish call.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent function invocations.")
+    parser.add_argument("--time-budget", type=int,
+                        help="Seconds before an extractor hands its sync over to a new invocation.")
+    parser.add_argument("--unthrottled", action="store_true",
+                        help="Don't apply Mailchimp's per-account rate limits to the synthetic API.")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Skip tracemalloc (it slows allocation-heavy code down).")
+    parser.add_argument("--verbose", action="store_true", help="Show the functions' log output.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON results to compare records/sec against.")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server, base_url = fake_mailchimp.start_server(args.api_latency, args.api_record_latency)
+    backends, start_data_sync, timer, loader = build_pipeline(args, base_url)
+    if args.memory:
+        tracemalloc.start()
+
+    print(f"{'size':>9}{'loaded':>10}{'seconds':>10}{'records/s':>12}{'calls':>8}{'peak MiB':>10}{'errors':>8}")
+    results = []
+    with open(os.devnull, "w") as devnull:
+        for run_index, size in enumerate(int(s) for s in args.sizes.split(",")):
+            logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull)
+            with logs:
+                result = run_size(size, run_index, args, base_url, backends, start_data_sync, timer, loader)
+            results.append(result)
+            print_result(result)
+
+    server.terminate()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        regressions = check_baseline(results, args.baseline, args.tolerance)
+        for size, expected, actual in regressions:
+            print(f"!!! Regression at {size} records: {actual:.0f} records/s vs baseline {expected:.0f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
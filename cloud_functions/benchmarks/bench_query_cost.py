@@ -0,0 +1,115 @@
+"""
+Bytes scanned and on-demand cost of the 02-data-analysis notebook queries,
+on the original staging tables versus the loader's partitioned, clustered
+tables.
+
+    python cloud_functions/benchmarks/bench_query_cost.py \
+        --project data-app-dev-2 --user-id <tenant> --since 2024-01-01
+
+Queries are dry-run by default, which is free. A dry run only accounts for
+partition pruning; pass --run to execute them and report bytes billed, which
+also reflects clustering on user_id.
+"""
+import argparse
+
+from google.cloud import bigquery
+
+ON_DEMAND_USD_PER_TIB = 6.25
+
+# Feature columns of the notebook's analytics table; {c} is the table alias.
+FEATURES = r"""
+  CHAR_LENGTH({c}subject_line) AS subject_line_length,
+  STRPOS(LOWER({c}subject_line), '*|fname|*') > 0 AS has_personalization,
+  STRPOS({c}subject_line, '?') > 0 AS has_question,
+  REGEXP_CONTAINS({c}subject_line, r'\d') AS has_number,
+  REGEXP_CONTAINS(LOWER({c}subject_line), r'sale|free|% off|discount|save') AS has_promo_word,
+  EXTRACT(DAYOFWEEK FROM {c}send_time) AS send_day_of_week,
+  EXTRACT(HOUR FROM {c}send_time) AS send_hour_of_day"""
+
+
+def notebook_queries(args):
+    """Returns {query name: (staging-table SQL, partitioned-table SQL)}."""
+    staging = f"{args.project}.{args.staging_dataset}"
+    loader = f"{args.project}.{args.dataset}"
+    return {
+        "campaign_analytics": (
+            f"""
+SELECT campaigns.campaign_id, campaigns.subject_line, campaigns.send_time,
+  reports.opens_total, reports.clicks_total, reports.open_rate,
+  {FEATURES.format(c="campaigns.")},
+  SAFE_DIVIDE(reports.clicks_total, reports.opens_total) AS click_through_open_rate
+FROM `{staging}.{args.prefix}_campaigns_stg` AS campaigns
+INNER JOIN `{staging}.{args.prefix}_reports_stg` AS reports ON campaigns.campaign_id = reports.campaign_id
+""",
+            f"""
+SELECT campaign_id, subject_line, send_time, opens, clicks, open_rate,
+  {FEATURES.format(c="")},
+  SAFE_DIVIDE(clicks, opens) AS click_through_open_rate
+FROM `{loader}.mailchimp_campaigns`
+WHERE user_id = @user_id AND send_time >= @since
+""",
+        ),
+        "campaign_recipients": (
+            f"""
+SELECT c.campaign_id, c.subject_line, m.email_address, m.status AS member_status, m.list_id
+FROM `{staging}.{args.prefix}_campaigns_stg` AS c
+JOIN `{staging}.{args.prefix}_members_stg` AS m ON c.recipients_list_id = m.list_id
+""",
+            f"""
+SELECT c.campaign_id, c.subject_line, m.email_address, m.status AS member_status, m.list_id
+FROM `{loader}.mailchimp_campaigns` AS c
+JOIN `{loader}.mailchimp_members` AS m ON c.user_id = m.user_id AND c.list_id = m.list_id
+WHERE c.user_id = @user_id AND m.user_id = @user_id AND c.send_time >= @since
+""",
+        ),
+    }
+
+
+def measure(client, sql, args):
+    """Returns the bytes a query scans: processed for a dry run, billed when run."""
+    job_config = bigquery.QueryJobConfig(
+        dry_run=not args.run,
+        use_query_cache=False,
+        query_parameters=[
+            bigquery.ScalarQueryParameter("user_id", "STRING", args.user_id),
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", args.since),
+        ],
+    )
+    job = client.query(sql, job_config=job_config)
+    if not args.run:
+        return job.total_bytes_processed
+    job.result()
+    return job.total_bytes_billed
+
+
+def cost(num_bytes):
+    return num_bytes / 1024 ** 4 * ON_DEMAND_USD_PER_TIB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project", required=True)
+    parser.add_argument("--dataset", default="insightiq_data", help="Dataset the loader writes to.")
+    parser.add_argument("--staging-dataset", default="staging_data")
+    parser.add_argument("--prefix", default="peer2", help="Table prefix of the notebook's staging tables.")
+    parser.add_argument("--user-id", required=True)
+    parser.add_argument("--since", default="1970-01-01", help="Lower bound on send_time.")
+    parser.add_argument("--run", action="store_true", help="Execute the queries (billed).")
+    args = parser.parse_args()
+
+    client = bigquery.Client(project=args.project)
+    label = "billed" if args.run else "processed"
+    print(f"{'query':<22}{'layout':<14}{'MiB ' + label:>16}{'USD':>12}")
+
+    for name, (staging_sql, partitioned_sql) in notebook_queries(args).items():
+        for layout, sql in (("staging", staging_sql), ("partitioned", partitioned_sql)):
+            try:
+                num_bytes = measure(client, sql, args)
+            except Exception as e:
+                print(f"{name:<22}{layout:<14}  !!! {e}")
+                continue
+            print(f"{name:<22}{layout:<14}{num_bytes / 1024 ** 2:>16.2f}{cost(num_bytes):>12.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Subject-line feature extraction: per-row Python versus the vectorized
+engine in thesis_logic_notebooks/subject_features.py.
+
+    python cloud_functions/benchmarks/bench_subject_features.py --lines 1000000
+
+The synthetic corpus mixes recurring newsletter subjects with one-off
+promotional lines; --distinct controls how many different lines it has.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "..", "thesis_logic_notebooks"))
+
+from subject_features import FEATURE_COLUMNS, compute_features  # noqa: E402
+
+TEMPLATES = [
+    "Hi *|FNAME|*, your {month} newsletter is here",
+    "{pct}% off everything this weekend only",
+    "Free shipping on orders over ${amount}",
+    "Did you see what's new in {month}?",
+    "Last chance: save {pct}% before midnight",
+    "Our {month} product update",
+    "*|FNAME|*, we picked these for you",
+    "Join us for the {month} webinar",
+]
+MONTHS = ["January", "February", "March", "April", "May", "June",
+          "July", "August", "September", "October", "November", "December"]
+
+
+def make_corpus(lines, distinct, seed=7):
+    rng = random.Random(seed)
+    pool = [rng.choice(TEMPLATES).format(month=rng.choice(MONTHS), pct=rng.randint(5, 70),
+                                         amount=rng.randint(10, 200)) + f" #{i}"
+            for i in range(distinct)]
+    corpus = [rng.choice(pool) for _ in range(lines)]
+    for i in range(0, lines, 1000):
+        corpus[i] = None  # A few drafts without a subject line
+    return pd.Series(corpus, dtype=object)
+
+
+def per_row_features(subject_lines):
+    """The straightforward version: one Python call chain per row."""
+    def features(line):
+        if line is None:
+            return [pd.NA] * len(FEATURE_COLUMNS)
+        lower = line.lower()
+        return [
+            len(line),
+            "*|fname|*" in lower,
+            "?" in line,
+            re.search(r"[0-9]", line) is not None,
+            re.search(r"sale|free|% off|discount|save", lower) is not None,
+        ]
+    return pd.DataFrame(subject_lines.map(features).tolist(), columns=FEATURE_COLUMNS,
+                        index=subject_lines.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--distinct", type=int, default=50_000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.lines, args.distinct)
+    print(f"{'engine':<12}{'lines':>10}{'seconds':>10}{'lines/sec':>14}")
+
+    results = {}
+    for engine, fn in (("per-row", per_row_features), ("vectorized", compute_features)):
+        started = time.perf_counter()
+        results[engine] = fn(corpus)
+        elapsed = time.perf_counter() - started
+        print(f"{engine:<12}{len(corpus):>10}{elapsed:>10.2f}{len(corpus) / elapsed:>14.0f}")
+
+    for column in FEATURE_COLUMNS:
+        expected = results["per-row"][column].astype(results["vectorized"][column].dtype)
+        assert expected.equals(results["vectorized"][column]), column
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+A synthetic Mailchimp Marketing API for benchmarks.
+
+Serves the endpoints the mailchimp-sync extractor uses (/campaigns,
+/reports/{id}, /lists, /batches and the batch result archives) over real HTTP on localhost, with
+configurable per-request and per-record latency. Each tenant's size comes
+from its access token, "bench:<campaigns>:<members>", so one server can act
+as any number of accounts. GET /__stats returns the call counts and
+server-side latencies.
+
+Run it in a separate process (start_server) so its memory use doesn't mix
+with the pipeline being measured.
+"""
+import datetime
+import io
+import json
+import multiprocessing
+import re
+import tarfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MEMBERS_PER_LIST = 100_000
+OPERATIONS_PER_RESULT_FILE = 50
+EPOCH = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _timestamp(seconds):
+    return (EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def make_campaign(i, with_links=True):
+    opens = (i * 7919) % 5000
+    clicks = opens // 7
+    campaign = {
+        "id": f"cmp{i:08d}",
+        "web_id": i,
+        "type": "regular",
+        "status": "sent",
+        "create_time": _timestamp(i * 3600),
+        "send_time": _timestamp(i * 3600 + 600),
+        "emails_sent": 5000,
+        "recipients": {"list_id": "list0000", "recipient_count": 5000, "segment_text": ""},
+        "settings": {
+            "subject_line": f"Campaign {i}: {(i % 60) + 5}% off this week" if i % 3 else f"Hi *|FNAME|*, news #{i}",
+            "preview_text": "",
+            "title": f"Campaign {i}",
+            "from_name": "Bench Co",
+            "reply_to": "bench@example.com",
+        },
+        "tracking": {"opens": True, "html_clicks": True, "text_clicks": False},
+        "report_summary": {
+            "opens": opens, "unique_opens": opens // 2, "open_rate": opens / 10000,
+            "clicks": clicks, "subscriber_clicks": clicks // 2, "click_rate": clicks / 10000,
+        },
+    }
+    if with_links:
+        campaign["_links"] = [{"rel": "self", "href": f"https://us1.api.mailchimp.com/3.0/campaigns/{i}",
+                               "method": "GET"} for _ in range(6)]
+    return campaign
+
+
+def make_report(i):
+    campaign = make_campaign(i, with_links=False)
+    summary = campaign["report_summary"]
+    return {
+        "id": campaign["id"],
+        "campaign_title": campaign["settings"]["title"],
+        "type": "regular",
+        "list_id": "list0000",
+        "subject_line": campaign["settings"]["subject_line"],
+        "emails_sent": campaign["emails_sent"],
+        "abuse_reports": 0,
+        "unsubscribed": i % 7,
+        "send_time": campaign["send_time"],
+        "bounces": {"hard_bounces": i % 3, "soft_bounces": i % 5, "syntax_errors": 0},
+        "opens": {"opens_total": summary["opens"], "unique_opens": summary["unique_opens"],
+                  "open_rate": summary["open_rate"], "last_open": campaign["send_time"]},
+        "clicks": {"clicks_total": summary["clicks"], "unique_clicks": summary["subscriber_clicks"],
+                   "unique_subscriber_clicks": summary["subscriber_clicks"], "click_rate": summary["click_rate"],
+                   "last_click": campaign["send_time"]},
+        "list_stats": {"sub_rate": 0, "unsub_rate": 0, "open_rate": 0.25, "click_rate": 0.03},
+    }
+
+
+def make_member(list_index, offset):
+    i = list_index * MEMBERS_PER_LIST + offset
+    return {
+        "id": f"{i:032x}",
+        "email_address": f"member{i}@example.com",
+        "list_id": f"list{list_index:04d}",
+        "status": "subscribed" if i % 10 else "unsubscribed",
+        "member_rating": i % 5 + 1,
+        "timestamp_opt": _timestamp(i),
+        "last_changed": _timestamp(i * 2),
+        "stats": {"avg_open_rate": (i % 100) / 100, "avg_click_rate": (i % 20) / 100},
+        "merge_fields": {"FNAME": f"First{i}", "LNAME": f"Last{i}"},
+    }
+
+
+def _tenant_size(headers):
+    match = re.search(r"bench:(\d+):(\d+)", headers.get("Authorization", ""))
+    return (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+
+
+def _list_sizes(members):
+    sizes = []
+    while members > 0:
+        sizes.append(min(members, MEMBERS_PER_LIST))
+        members -= sizes[-1]
+    return sizes
+
+
+class _State:
+    def __init__(self, latency, per_record_latency):
+        self.latency = latency
+        self.per_record_latency = per_record_latency
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.durations_ms = []
+        self.batches = {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        started = time.perf_counter()
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = None
+        if method == "POST":
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        route, status, payload, records = self._route(method, url.path, params, body)
+        time.sleep(self.state.latency + self.state.per_record_latency * records)
+
+        content_type = "application/json"
+        if isinstance(payload, bytes):
+            data, content_type = payload, "application/gzip"
+        else:
+            data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+        if route != "stats":
+            with self.state.lock:
+                self.state.calls[route] = self.state.calls.get(route, 0) + 1
+                self.state.durations_ms.append((time.perf_counter() - started) * 1000)
+
+    def _route(self, method, path, params, body):
+        """Returns (route label, status, payload, number of records served)."""
+        campaigns, members = _tenant_size(self.headers)
+        offset, count = int(params.get("offset", 0)), int(params.get("count", 10))
+
+        if path == "/__stats":
+            with self.state.lock:
+                return "stats", 200, {"calls": dict(self.state.calls),
+                                      "durations_ms": list(self.state.durations_ms)}, 0
+
+        if method == "GET" and path == "/3.0/campaigns":
+            with_links = "campaigns._links" not in params.get("exclude_fields", "")
+            page = [make_campaign(i, with_links) for i in range(offset, min(offset + count, campaigns))]
+            return "GET /campaigns", 200, {"campaigns": page, "total_items": campaigns}, len(page)
+
+        match = re.fullmatch(r"/3\.0/reports/cmp(\d+)", path)
+        if method == "GET" and match:
+            if int(match.group(1)) >= campaigns:
+                return "GET /reports/{id}", 404, {"status": 404, "detail": "Resource not found"}, 0
+            return "GET /reports/{id}", 200, make_report(int(match.group(1))), 1
+
+        if method == "GET" and path == "/3.0/lists":
+            sizes = _list_sizes(members)
+            page = [{"id": f"list{i:04d}", "stats": {"member_count": size, "unsubscribe_count": 0,
+                                                     "cleaned_count": 0, "total_contacts": size}}
+                    for i, size in enumerate(sizes)][offset:offset + count]
+            return "GET /lists", 200, {"lists": page, "total_items": len(sizes)}, len(page)
+
+        if method == "POST" and path == "/3.0/batches":
+            with self.state.lock:
+                batch_id = f"batch{len(self.state.batches):06d}"
+                self.state.batches[batch_id] = (body.get("operations", []), members)
+            return "POST /batches", 200, {"id": batch_id, "status": "pending"}, 0
+
+        match = re.fullmatch(r"/3\.0/batches/(\w+)", path)
+        if method == "GET" and match:
+            operations, _ = self.state.batches[match.group(1)]
+            host, port = self.server.server_address[:2]
+            return "GET /batches/{id}", 200, {
+                "id": match.group(1), "status": "finished",
+                "total_operations": len(operations), "finished_operations": len(operations),
+                "errored_operations": 0,
+                "response_body_url": f"http://{host}:{port}/batch-results/{match.group(1)}.tar.gz",
+            }, 0
+
+        match = re.fullmatch(r"/batch-results/(\w+)\.tar\.gz", path)
+        if method == "GET" and match:
+            operations, total = self.state.batches[match.group(1)]
+            archive, records = _batch_archive(operations, total)
+            return "GET batch results", 200, archive, records
+
+        return "not found", 404, {"status": 404, "detail": f"{method} {path} is not simulated"}, 0
+
+
+def _batch_archive(operations, members):
+    """Builds the tar.gz of operation results Mailchimp serves for a finished batch."""
+    sizes = _list_sizes(members)
+    buffer = io.BytesIO()
+    records = 0
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for start in range(0, len(operations), OPERATIONS_PER_RESULT_FILE):
+            results = []
+            for operation in operations[start:start + OPERATIONS_PER_RESULT_FILE]:
+                list_index = int(operation["path"].split("/")[2][len("list"):])
+                offset, count = operation["params"]["offset"], operation["params"]["count"]
+                page = [make_member(list_index, o)
+                        for o in range(offset, min(offset + count, sizes[list_index]))]
+                records += len(page)
+                results.append({"status_code": 200, "operation_id": operation.get("operation_id"),
+                                "response": json.dumps({"members": page})})
+            data = json.dumps(results).encode("utf-8")
+            info = tarfile.TarInfo(f"{start // OPERATIONS_PER_RESULT_FILE}.json")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue(), records
+
+
+def serve(port_queue, latency, per_record_latency):
+    _Handler.state = _State(latency, per_record_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(latency=0.05, per_record_latency=0.00001):
+    """Starts the API in a child process; returns (process, base URL without /3.0)."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(port_queue, latency, per_record_latency),
+                                      daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get(timeout=10)}"
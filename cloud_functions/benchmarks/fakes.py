@@ -0,0 +1,534 @@
+"""
+In-process stand-ins for the Google Cloud services used by the functions.
+They model per-call round-trip latency so benchmarks can compare call
+patterns without touching a real project.
+
+install_fake_modules() registers them as google.cloud.* (and
+functions_framework) so the real function modules can be imported and
+driven end to end.
+"""
+import base64
+import copy
+import datetime
+import gzip
+import io
+import itertools
+import json
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ===================================================================
+#           BIGQUERY
+# ===================================================================
+
+class NotFound(Exception):
+    """Stands in for google.api_core.exceptions.NotFound."""
+
+
+class AlreadyExists(Exception):
+    """Stands in for google.api_core.exceptions.AlreadyExists."""
+
+
+class _Job:
+    def __init__(self, output_rows=0):
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = 0
+
+    def result(self, *args, **kwargs):
+        return []
+
+
+class FakeBigQueryClient:
+    """Stands in for bigquery.Client; records every row it receives."""
+
+    def __init__(self, call_latency=0.02, per_row_latency=0.00002):
+        self.call_latency = call_latency
+        self.per_row_latency = per_row_latency
+        self.tables = {}
+        self.schemas = {}
+        self.insert_calls = 0
+        self.load_jobs = 0
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table_id, rows, row_ids=None, **kwargs):
+        time.sleep(self.call_latency + self.per_row_latency * len(rows))
+        with self._lock:
+            self.insert_calls += 1
+            self.tables.setdefault(table_id, []).extend(rows)
+        return []
+
+    def get_table(self, table_id):
+        time.sleep(self.call_latency)
+        with self._lock:
+            if table_id not in self.schemas:
+                raise NotFound(f"Not found: Table {table_id}")
+            return self.schemas[table_id]
+
+    def create_table(self, table, exists_ok=False):
+        time.sleep(self.call_latency)
+        with self._lock:
+            self.schemas.setdefault(table.table_id, table)
+            return self.schemas[table.table_id]
+
+    def update_table(self, table, fields):
+        time.sleep(self.call_latency)
+        with self._lock:
+            self.schemas[table.table_id] = table
+        return table
+
+    def delete_table(self, table_id, not_found_ok=False):
+        with self._lock:
+            self.schemas.pop(table_id, None)
+            self.tables.pop(table_id, None)
+
+    def load_table_from_file(self, file_obj, table_id, job_config=None, **kwargs):
+        """Loads newline-delimited JSON from an open (uncompressed) binary file."""
+        rows = [json.loads(line) for line in io.TextIOWrapper(file_obj, encoding="utf-8") if line.strip()]
+        time.sleep(self.call_latency * 10 + self.per_row_latency * len(rows) / 10)
+        with self._lock:
+            self.load_jobs += 1
+            self.tables.setdefault(table_id, []).extend(rows)
+        return _Job(output_rows=len(rows))
+
+    def load_table_from_uri(self, uris, table_id, job_config=None, **kwargs):
+        rows = []
+        for uri in uris:
+            with gzip.open(uri, "rt", encoding="utf-8") as staged:
+                rows.extend(json.loads(line) for line in staged if line.strip())
+        time.sleep(self.call_latency * 10 + self.per_row_latency * len(rows) / 10)
+        with self._lock:
+            self.load_jobs += 1
+            self.tables.setdefault(table_id, []).extend(rows)
+        return _Job(output_rows=len(rows))
+
+    def query(self, sql, job_config=None, **kwargs):
+        time.sleep(self.call_latency)
+        return _Job()
+
+    def row_count(self, table_id=None):
+        with self._lock:
+            if table_id:
+                return len(self.tables.get(table_id, []))
+            return sum(len(rows) for rows in self.tables.values())
+
+
+def _bigquery_module(client):
+    module = types.ModuleType("google.cloud.bigquery")
+    module.Client = lambda *args, **kwargs: client
+
+    class SchemaField:
+        def __init__(self, name, field_type, mode="NULLABLE", **kwargs):
+            self.name, self.field_type, self.mode = name, field_type, mode
+
+    class Table:
+        def __init__(self, table_id, schema=None):
+            self.table_id = table_id
+            self.schema = list(schema or [])
+            self.time_partitioning = None
+            self.clustering_fields = None
+            self.expires = None
+            self.modified = _now()
+
+    def config(**kwargs):
+        return types.SimpleNamespace(**kwargs)
+
+    module.SchemaField = SchemaField
+    module.Table = Table
+    module.TimePartitioning = config
+    module.TimePartitioningType = types.SimpleNamespace(DAY="DAY", MONTH="MONTH")
+    module.SourceFormat = types.SimpleNamespace(NEWLINE_DELIMITED_JSON="NEWLINE_DELIMITED_JSON",
+                                                PARQUET="PARQUET")
+    module.WriteDisposition = types.SimpleNamespace(WRITE_APPEND="WRITE_APPEND",
+                                                    WRITE_TRUNCATE="WRITE_TRUNCATE")
+    module.LoadJobConfig = config
+    module.QueryJobConfig = config
+    module.ScalarQueryParameter = lambda name, type_, value: (name, type_, value)
+    return module
+
+
+# ===================================================================
+#           PUB/SUB
+# ===================================================================
+
+class FakeFuture:
+    """A publish future that resolves result_latency seconds after the publish."""
+
+    def __init__(self, message_id, result_latency=0.0):
+        self.message_id = message_id
+        self.ready_at = time.monotonic() + result_latency
+
+    def result(self, timeout=None):
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return self.message_id
+
+    def done(self):
+        return time.monotonic() >= self.ready_at
+
+    def exception(self, timeout=None):
+        return None
+
+    def add_done_callback(self, callback):
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            threading.Timer(delay, callback, args=(self,)).start()
+        else:
+            callback(self)
+
+
+class FakeCloudEvent:
+    """What functions_framework hands a Pub/Sub-triggered function."""
+
+    def __init__(self, message):
+        self.data = {"message": message}
+        self._attributes = {"id": message["messageId"], "time": message["publishTime"],
+                            "type": "google.cloud.pubsub.topic.v1.messagePublished"}
+
+    def __getitem__(self, key):
+        return self._attributes[key]
+
+    def get(self, key, default=None):
+        return self._attributes.get(key, default)
+
+
+class FakePubSub:
+    """
+    A message bus shared by every fake PublisherClient.
+    Messages published to a topic with a subscriber are delivered to it on a
+    thread pool, like push subscriptions invoking Cloud Functions; messages to
+    other topics are kept in 'undelivered'.
+    publish_latency blocks the publish() call itself; result_latency is the
+    round trip the real client makes in the background, paid by whoever
+    waits on the returned future.
+    """
+
+    def __init__(self, publish_latency=0.0, max_workers=8, result_latency=0.0):
+        self.publish_latency = publish_latency
+        self.result_latency = result_latency
+        self.subscribers = {}
+        self.published = {}
+        self.undelivered = {}
+        self.errors = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._outstanding = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def subscribe(self, topic_path, handler):
+        self.subscribers[topic_path] = handler
+
+    def publish(self, topic_path, data, **attributes):
+        if self.publish_latency:
+            time.sleep(self.publish_latency)
+        message = {
+            "data": base64.b64encode(data).decode("ascii"),
+            "attributes": {key: str(value) for key, value in attributes.items()},
+            "messageId": str(next(self._ids)),
+            "publishTime": _now().isoformat().replace("+00:00", "Z"),
+        }
+        handler = self.subscribers.get(topic_path)
+        with self._lock:
+            self.published[topic_path] = self.published.get(topic_path, 0) + 1
+            if handler is None:
+                self.undelivered.setdefault(topic_path, []).append(message)
+            else:
+                self._outstanding += 1
+        if handler is not None:
+            self._pool.submit(self._deliver, handler, message)
+        return FakeFuture(message["messageId"], self.result_latency)
+
+    def _deliver(self, handler, message):
+        try:
+            handler(FakeCloudEvent(message))
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            with self._lock:
+                self._outstanding -= 1
+                self._idle.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until every delivered message has been handled."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self._outstanding == 0, timeout=timeout)
+
+
+def _pubsub_module(bus):
+    module = types.ModuleType("google.cloud.pubsub_v1")
+
+    class PublisherClient:
+        def __init__(self, *args, **kwargs):
+            self.bus = bus
+
+        @staticmethod
+        def topic_path(project, topic):
+            return f"projects/{project}/topics/{topic}"
+
+        def publish(self, topic, data, **attributes):
+            return self.bus.publish(topic, data, **attributes)
+
+    module.PublisherClient = PublisherClient
+    module.types = types.SimpleNamespace(BatchSettings=lambda **kwargs: types.SimpleNamespace(**kwargs))
+    return module
+
+
+# ===================================================================
+#           FIRESTORE
+# ===================================================================
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+SERVER_TIMESTAMP = object()
+
+
+def _resolve(value, current):
+    if value is SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    return copy.deepcopy(value)
+
+
+def _merge(target, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif isinstance(value, dict):
+            target[key] = {}
+            _merge(target[key], value)
+        else:
+            target[key] = _resolve(value, target.get(key))
+
+
+class _Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class _DocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return _CollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, transaction=None, **kwargs):
+        self._db.calls += 1
+        with self._db.lock:
+            return _Snapshot(self.id, self._db.documents.get(self.path))
+
+    def set(self, data, merge=False):
+        self._db.calls += 1
+        with self._db.lock:
+            document = self._db.documents.get(self.path) if merge else None
+            document = document if document is not None else {}
+            _merge(document, data)
+            self._db.documents[self.path] = document
+
+    def update(self, data):
+        self.set(data, merge=True)
+
+    def delete(self):
+        with self._db.lock:
+            self._db.documents.pop(self.path, None)
+
+
+class _CollectionReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+
+    def document(self, doc_id):
+        return _DocumentReference(self._db, f"{self.path}/{doc_id}")
+
+    def stream(self):
+        prefix = self.path + "/"
+        with self._db.lock:
+            items = [(path, data) for path, data in self._db.documents.items()
+                     if path.startswith(prefix) and "/" not in path[len(prefix):]]
+        return [_Snapshot(path.rsplit("/", 1)[-1], data) for path, data in items]
+
+
+class _Transaction:
+    def __init__(self, db):
+        self._db = db
+
+    def set(self, ref, data, merge=False):
+        ref.set(data, merge=merge)
+
+    def update(self, ref, data):
+        ref.update(data)
+
+
+class _WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append((ref, data, merge))
+
+    def commit(self):
+        # Applied under the store's lock, so a batch is atomic like the real one.
+        with self._db.lock:
+            for ref, data, merge in self._writes:
+                ref.set(data, merge=merge)
+        self._writes = []
+
+
+class FakeFirestore:
+    """A document store shared by every fake firestore.Client."""
+
+    def __init__(self):
+        self.documents = {}
+        self.lock = threading.RLock()
+        self.transaction_lock = threading.Lock()
+        self.calls = 0
+
+    def collection(self, name):
+        return _CollectionReference(self, name)
+
+    def transaction(self, **kwargs):
+        return _Transaction(self)
+
+    def batch(self):
+        return _WriteBatch(self)
+
+
+def _firestore_module(db):
+    module = types.ModuleType("google.cloud.firestore")
+    module.Client = lambda *args, **kwargs: db
+    module.Increment = Increment
+    module.SERVER_TIMESTAMP = SERVER_TIMESTAMP
+
+    def transactional(fn):
+        def run(transaction, *args, **kwargs):
+            # Transactions on the fake are simply serialized.
+            with transaction._db.transaction_lock:
+                return fn(transaction, *args, **kwargs)
+        return run
+
+    module.transactional = transactional
+    return module
+
+
+# ===================================================================
+#           SECRET MANAGER
+# ===================================================================
+
+class FakeSecretManager:
+    """Holds secrets as {"projects/p/secrets/name/versions/latest": "payload"}."""
+
+    def __init__(self, call_latency=0.02):
+        self.call_latency = call_latency
+        self.secrets = {}
+        self.created = set()
+        self.calls = 0
+
+    def access_secret_version(self, request=None, name=None, **kwargs):
+        time.sleep(self.call_latency)
+        self.calls += 1
+        name = (request or {}).get("name", name)
+        if name not in self.secrets:
+            raise NotFound(f"Secret {name} not found")
+        payload = types.SimpleNamespace(data=self.secrets[name].encode("utf-8"))
+        return types.SimpleNamespace(payload=payload)
+
+    def create_secret(self, request=None, **kwargs):
+        time.sleep(self.call_latency)
+        self.calls += 1
+        name = f"{request['parent']}/secrets/{request['secret_id']}"
+        if f"{name}/versions/latest" in self.secrets or name in self.created:
+            raise AlreadyExists(f"Secret {name} already exists")
+        self.created.add(name)
+        return types.SimpleNamespace(name=name)
+
+    def add_secret_version(self, request=None, **kwargs):
+        time.sleep(self.call_latency)
+        self.calls += 1
+        name = request["parent"]
+        if f"{name}/versions/latest" not in self.secrets and name not in self.created:
+            raise NotFound(f"Secret {name} not found")
+        self.secrets[f"{name}/versions/latest"] = request["payload"]["data"].decode("utf-8")
+        return types.SimpleNamespace(name=f"{name}/versions/latest")
+
+
+def _secretmanager_module(secrets):
+    module = types.ModuleType("google.cloud.secretmanager")
+    module.SecretManagerServiceClient = lambda *args, **kwargs: secrets
+    return module
+
+
+# ===================================================================
+#           MODULE INSTALLATION
+# ===================================================================
+
+def _package(name):
+    module = sys.modules.get(name)
+    if module is None:
+        module = types.ModuleType(name)
+        module.__path__ = []
+        sys.modules[name] = module
+    return module
+
+
+def install_fake_modules(bigquery_client=None, pubsub=None, firestore_db=None, secrets=None):
+    """
+    Registers the fakes as google.cloud.{bigquery,pubsub_v1,firestore,secretmanager},
+    google.api_core.exceptions, functions_framework and flask. Must run before the
+    function modules are imported. Returns the shared fake backends.
+    """
+    backends = types.SimpleNamespace(
+        bigquery=bigquery_client or FakeBigQueryClient(),
+        pubsub=pubsub or FakePubSub(),
+        firestore=firestore_db or FakeFirestore(),
+        secrets=secrets or FakeSecretManager(),
+    )
+
+    google = _package("google")
+    cloud = _package("google.cloud")
+    api_core = _package("google.api_core")
+    google.cloud, google.api_core = cloud, api_core
+
+    exceptions = types.ModuleType("google.api_core.exceptions")
+    exceptions.NotFound = NotFound
+    exceptions.AlreadyExists = AlreadyExists
+    exceptions.GoogleAPICallError = Exception
+    sys.modules["google.api_core.exceptions"] = exceptions
+    api_core.exceptions = exceptions
+
+    for name, module in (("bigquery", _bigquery_module(backends.bigquery)),
+                         ("pubsub_v1", _pubsub_module(backends.pubsub)),
+                         ("firestore", _firestore_module(backends.firestore)),
+                         ("secretmanager", _secretmanager_module(backends.secrets))):
+        sys.modules[f"google.cloud.{name}"] = module
+        setattr(cloud, name, module)
+
+    framework = types.ModuleType("functions_framework")
+    framework.http = framework.cloud_event = lambda fn: fn
+    framework.redirect = lambda location, code=302: ("", code, {"Location": location})
+    sys.modules["functions_framework"] = framework
+    flask = types.ModuleType("flask")
+    flask.redirect = framework.redirect
+    sys.modules["flask"] = flask
+    return backends
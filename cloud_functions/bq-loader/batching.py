@@ -0,0 +1,86 @@
+from shared import envelope
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# BigQuery recommends ~500 rows per streaming request and rejects
+# requests larger than 10 MB, so the defaults stay well below both.
+DEFAULT_MAX_ROWS = 500
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+
+
+# ===================================================================
+#           2. ROW BATCHER
+# ===================================================================
+
+class RowBatcher:
+    """
+    Splits the rows of one message into streaming insert requests of at
+    most max_rows rows and max_bytes bytes per table_id. Full batches are
+    inserted as they fill up; flush() inserts the rest. Nothing is kept
+    between messages: the loader flushes before it returns, so a message
+    is only acknowledged once its rows reached BigQuery.
+
+    insert_fn has the signature of bigquery.Client.insert_rows_json; rows
+    added with row_ids are inserted with those insert IDs so BigQuery can
+    drop retried duplicates. A request that fails as a whole raises.
+    Every insert returns a list of failures, one per rejected row:
+        {"table_id": ..., "row": {...}, "errors": [...]}
+    """
+
+    def __init__(self, insert_fn, max_rows=DEFAULT_MAX_ROWS, max_bytes=DEFAULT_MAX_BYTES):
+        self.insert_fn = insert_fn
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self._buffers = {}  # table_id -> {"rows": [], "row_ids": [], "bytes": int}
+
+    def add(self, table_id, row, row_id=None):
+        """Adds one row and inserts the table's batch if it crossed a size threshold."""
+        return self.add_many(table_id, [row], None if row_id is None else [row_id])
+
+    def add_many(self, table_id, rows, row_ids=None):
+        """Adds several rows for one table, inserting full batches as they fill up."""
+        if row_ids is None:
+            row_ids = [None] * len(rows)
+        failures = []
+        for row, row_id in zip(rows, row_ids):
+            row_bytes = len(envelope.dumps(row))
+            buffer = self._buffers.get(table_id)
+
+            # Never let a single request grow past max_bytes.
+            if buffer and buffer["bytes"] + row_bytes > self.max_bytes:
+                failures += self._insert(table_id, self._buffers.pop(table_id))
+                buffer = None
+
+            if buffer is None:
+                buffer = self._buffers[table_id] = {"rows": [], "row_ids": [], "bytes": 0}
+
+            buffer["rows"].append(row)
+            buffer["row_ids"].append(row_id)
+            buffer["bytes"] += row_bytes
+
+            if len(buffer["rows"]) >= self.max_rows:
+                failures += self._insert(table_id, self._buffers.pop(table_id))
+        return failures
+
+    def flush(self):
+        """Inserts every partial batch."""
+        failures = []
+        while self._buffers:
+            table_id, buffer = self._buffers.popitem()
+            failures += self._insert(table_id, buffer)
+        return failures
+
+    def pending_rows(self):
+        """Returns the number of rows added but not inserted yet."""
+        return sum(len(buffer["rows"]) for buffer in self._buffers.values())
+
+    def _insert(self, table_id, buffer):
+        rows, row_ids = buffer["rows"], buffer["row_ids"]
+        if any(row_id is not None for row_id in row_ids):
+            errors = self.insert_fn(table_id, rows, row_ids=row_ids)
+        else:
+            errors = self.insert_fn(table_id, rows)
+        return [{"table_id": table_id, "row": rows[error["index"]], "errors": error.get("errors", [])}
+                for error in errors or []]
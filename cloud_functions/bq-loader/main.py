@@ -1,8 +1,12 @@
-import base64
-import json
+import functools
 import os
+import uuid
 import functions_framework
-from google.cloud import bigquery
+
+from batching import RowBatcher
+from shared import claim_check, clients, envelope, schema_registry, staging, sync_jobs, telemetry
+from table_schemas import SchemaCache
+import upserts
 
 # ===================================================================
 #                      1. CONFIGURATION
@@ -11,11 +15,104 @@ from google.cloud import bigquery
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "data-app-dev-2")
 BQ_DATASET_ID = os.getenv("BQ_DATASET", "insightiq_data")
 
+# "stream" inserts each message's rows in one request; "batch" splits them
+# into requests of at most BATCH_MAX_ROWS rows / BATCH_MAX_BYTES bytes. Either
+# way every row is sent before the message is acknowledged.
+LOADER_MODE = os.getenv("LOADER_MODE", "stream")
+BATCH_MAX_ROWS = int(os.getenv("BATCH_MAX_ROWS", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(5 * 1024 * 1024)))
+
+# "append" adds every row. "upsert" loads a bulk manifest into a staging table
+# and MERGEs it into the target once per sync, so the target holds one row per
+# record. A message's "write_mode" overrides the default. Streamed envelopes
+# are always appended, with deterministic insert IDs to drop retried duplicates.
+WRITE_MODE = os.getenv("WRITE_MODE", "append")
+
+# Bulk manifests (staged NDJSON/Parquet files) are loaded with load jobs.
+# Values are bigquery.SourceFormat / WriteDisposition constants, spelled out so
+# the BigQuery library is only imported once a message needs it.
+SOURCE_FORMATS = {
+    "ndjson": "NEWLINE_DELIMITED_JSON",
+    "parquet": "PARQUET",
+}
+WRITE_APPEND = "WRITE_APPEND"
+WRITE_TRUNCATE = "WRITE_TRUNCATE"
+
 # --- Client ---
-bq_client = bigquery.Client()
+# The BigQuery client is created on first use (clients.bigquery_client()).
+def insert_rows(table_id, rows, **kwargs):
+    return clients.bigquery_client().insert_rows_json(table_id, rows, **kwargs)
+
+
+schema_cache = SchemaCache(clients.bigquery_client)
+
 
 # ===================================================================
-#           2. MAIN CLOUD FUNCTION (PUBSUB TRIGGER)
+#           2. UTILITY FUNCTIONS
+# ===================================================================
+
+def report_failures(failures):
+    """Prints every row BigQuery rejected, one line per row."""
+    for failure in failures:
+        print(f"!!! BigQuery rejected row for {failure['table_id']}: "
+              f"{failure['errors']} -- row: {failure['row']}")
+
+
+def record_job_progress(payload, loaded_rows, failed_rows):
+    """
+    Counts a message's rows towards the bulk sync job it belongs to, if any,
+    before the message is acknowledged. A failed write is only logged: the
+    rows themselves are loaded.
+    """
+    job_id = telemetry.current_job_id()
+    try:
+        sync_jobs.record_load(clients.firestore_client(), job_id, payload.get("user_id"), payload.get("source"),
+                              loaded=loaded_rows, failed=failed_rows)
+    except Exception as e:
+        print(f"!!! Error recording load progress on job {job_id}: {e}")
+
+
+def row_ids_for(table_name, rows, payload):
+    """Deterministic insert IDs for rows; rows without a record id get a random one."""
+    return [schema_registry.row_id(table_name, row, payload) or uuid.uuid4().hex for row in rows]
+
+
+def load_staged_files(table_id, uris, file_format, table_name=None,
+                      write_disposition=WRITE_APPEND):
+    """
+    Loads the files staged for one table during one sync.
+    Files in Cloud Storage go through a single load job; a local staging
+    directory (tests, local runs) is uploaded from disk instead, one job
+    after the other, each file after the first appended to what it loaded.
+    Unregistered tables take their schema from the files (autodetect).
+    """
+    from google.cloud import bigquery
+
+    def job_config(disposition):
+        return bigquery.LoadJobConfig(
+            source_format=SOURCE_FORMATS[file_format],
+            write_disposition=disposition,
+            autodetect=not schema_registry.is_registered(table_name),
+        )
+
+    bq_client = clients.bigquery_client()
+    if all(staging.is_gcs_uri(uri) for uri in uris):
+        sources, load = [uris], bq_client.load_table_from_uri
+    else:
+        sources, load = staging.local_load_sources(uris, file_format), bq_client.load_table_from_file
+
+    loaded_rows = 0
+    for source in sources:
+        job = load(source, table_id, job_config=job_config(write_disposition))
+        job.result()  # Raises if the load job failed
+        loaded_rows += job.output_rows or 0
+        # A truncating load only truncates once.
+        write_disposition = WRITE_APPEND
+    return loaded_rows
+
+
+# ===================================================================
+#           3. MAIN CLOUD FUNCTION (PUBSUB TRIGGER)
 # ===================================================================
 
 @functions_framework.cloud_event
@@ -23,20 +120,44 @@ def bq_loader(cloud_event):
     """
     Receives a data payload from a Pub/Sub topic and loads it into BigQuery.
     1. Triggered by a message on the 'bq-loader-topic'.
-    2. Decodes the message to get the data and target table name.
-    3. Streams the data into the specified BigQuery table.
+    2. Decodes the message to get the records and target table name.
+    3. Flattens registered tables' records into their typed columns.
+    4. Streams the records into the specified BigQuery table.
+    Each message is logged as one "load" span under the sync's trace, and
+    counted on the sync's bulk job when it belongs to one.
     """
+    with telemetry.trace(cloud_event), telemetry.span("load", loader_mode=LOADER_MODE) as span:
+        loaded = load_message(cloud_event, span)
+        if loaded:
+            record_job_progress(*loaded)
+
+
+def load_message(cloud_event, span):
+    """Loads one message; returns (payload, loaded_rows, failed_rows) once its payload is read."""
     # 1. Decode the incoming message
     try:
-        message_data_encoded = cloud_event.data["message"]["data"]
-        message_data_decoded = base64.b64decode(message_data_encoded).decode('utf-8')
-        payload = json.loads(message_data_decoded)
+        # Decoded straight from the message bytes; older Constant Contact
+        # envelopes ("tenant_id"/"data_type") are mapped onto user_id/table_name.
+        message_data, attributes = envelope.read_event(cloud_event)
+        payload = envelope.decode(message_data, attributes)
+        span.add(num_bytes=len(message_data))
 
         table_name = payload.get("table_name")
-        data_row = payload.get("data") # This should be a single JSON object/dict
+        # Bulk manifests list staged file "uris"; envelopes carry a "records" list,
+        # or a "payload_ref" to them when they were too large to inline;
+        # older messages carry a single "data" object.
+        if payload.get("load_mode") == "bulk":
+            records = payload.get("uris")
+        elif payload.get("payload_ref"):
+            records = claim_check.iter_records(payload["payload_ref"])
+            span.set(payload_ref=payload["payload_ref"])
+        elif "records" in payload:
+            records = payload.get("records")
+        else:
+            records = [payload["data"]] if payload.get("data") else []
 
-        if not table_name or not data_row:
-            print(f"!!! Error: Missing 'table_name' or 'data' in payload: {payload}")
+        if not table_name or not records:
+            print(f"!!! Error: Missing 'table_name' or 'records'/'payload_ref'/'data'/'uris' in payload: {payload}")
             return
     except Exception as e:
         print(f"!!! Error decoding Pub/Sub message: {e}")
@@ -44,18 +165,68 @@ def bq_loader(cloud_event):
 
     # 2. Prepare the data for BigQuery
     # The insert_rows_json method expects a list of dictionaries.
-    rows_to_insert = [data_row]
     table_id = f"{GCP_PROJECT_ID}.{BQ_DATASET_ID}.{table_name}"
+    span.set(table_name=table_name, load_mode=payload.get("load_mode", "stream"))
+    try:
+        schema_cache.ensure_table(table_id, table_name)
+    except Exception as e:
+        print(f"!!! Could not create or update table {table_id}: {e}")
+
+    if payload.get("load_mode") == "bulk":
+        # A manifest of staged files: one load job (plus one MERGE when upserting) per sync.
+        file_format = payload.get("file_format", "ndjson")
+        write_mode = payload.get("write_mode", WRITE_MODE)
+        span.set(write_mode=write_mode, files=len(records))
+        try:
+            print(f"--- Loading {len(records)} staged files into table: {table_id} ({write_mode}) ---")
+            if write_mode == "upsert" and upserts.can_upsert(table_name):
+                load_into = functools.partial(load_staged_files, uris=records, file_format=file_format,
+                                              table_name=table_name,
+                                              write_disposition=WRITE_TRUNCATE)
+                loaded_rows, merged_rows = upserts.upsert_staged(
+                    clients.bigquery_client(), table_id, table_name, payload.get("sync_id"), load_into)
+                print(f"Successfully merged {loaded_rows} staged rows ({merged_rows} rows changed).")
+                span.set(merged_rows=merged_rows)
+            else:
+                if write_mode == "upsert":
+                    print(f"!!! No row keys registered for {table_name}; appending instead of upserting.")
+                loaded_rows = load_staged_files(table_id, records, file_format, table_name)
+                print(f"Successfully loaded {loaded_rows} rows into BigQuery.")
+            span.add(records=loaded_rows)
+            return payload, loaded_rows, 0
+        except Exception as e:
+            print(f"!!! BigQuery load job failed for {table_id}: {e}")
+            # The staged files' row count is unknown; the job only records the failed manifest.
+            return payload, 0, 0
+
+    # 3. Flatten nested provider records (bulk files are flattened when staged)
+    records = [schema_registry.flatten(table_name, record, payload) for record in records]
+    row_ids = row_ids_for(table_name, records, payload)
+    span.add(records=len(records))
+
+    if LOADER_MODE == "batch":
+        # Every batch is inserted before the message is acknowledged. A request
+        # that fails as a whole raises, so Pub/Sub redelivers the message and
+        # the insert IDs drop the rows that did arrive.
+        batcher = RowBatcher(insert_rows, max_rows=BATCH_MAX_ROWS, max_bytes=BATCH_MAX_BYTES)
+        failures = batcher.add_many(table_id, records, row_ids)
+        failures += batcher.flush()
+        report_failures(failures)
+        span.set(rejected_rows=len(failures))
+        return payload, len(records) - len(failures), len(failures)
 
-    print(f"--- Attempting to insert 1 row into table: {table_id} ---")
+    print(f"--- Attempting to insert {len(records)} rows into table: {table_id} ---")
 
-    # 3. Stream the data into BigQuery
+    # 4. Stream the data into BigQuery
     try:
-        errors = bq_client.insert_rows_json(table_id, rows_to_insert)
+        errors = insert_rows(table_id, records, row_ids=row_ids)
         if not errors:
-            print("Successfully inserted row into BigQuery.")
+            print(f"Successfully inserted {len(records)} rows into BigQuery.")
         else:
             print(f"!!! BigQuery insertion errors: {errors}")
+            span.set(rejected_rows=len(errors))
+        return payload, len(records) - len(errors), len(errors)
 
     except Exception as e:
-        print(f"!!! An unexpected error occurred loading data to BigQuery: {e}")
\ No newline at end of file
+        print(f"!!! An unexpected error occurred loading data to BigQuery: {e}")
+        return payload, 0, len(records)
\ No newline at end of file
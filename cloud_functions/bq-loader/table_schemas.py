@@ -0,0 +1,80 @@
+import threading
+
+from shared import schema_registry
+
+# ===================================================================
+#           TABLE PROVISIONING
+# ===================================================================
+
+
+def build_table(table_id, table_name):
+    """Builds a partitioned, clustered Table for a registered table_name."""
+    from google.cloud import bigquery
+
+    table = bigquery.Table(table_id, schema=[
+        bigquery.SchemaField(name, bq_type, mode="NULLABLE")
+        for name, bq_type in schema_registry.columns(table_name)
+    ])
+    if table_name in schema_registry.TABLE_LAYOUTS:
+        partition_column, granularity, cluster_columns = schema_registry.TABLE_LAYOUTS[table_name]
+        table.time_partitioning = bigquery.TimePartitioning(
+            type_=getattr(bigquery.TimePartitioningType, granularity), field=partition_column)
+        table.clustering_fields = cluster_columns
+    return table
+
+
+class SchemaCache:
+    """
+    Keeps the BigQuery tables of registered table_names in step with the
+    schema registry.
+
+    The first message for a table on an instance creates the table if it is
+    missing (partitioned and clustered per schema_registry.TABLE_LAYOUTS), or
+    reads its schema and adds any registry column it lacks (additive changes
+    only, so existing data and queries keep working). The resolved column set
+    is cached, so later messages never call the BigQuery API for it again.
+    get_client returns the BigQuery client, which is only needed on a cache miss.
+    """
+
+    def __init__(self, get_client):
+        self.get_client = get_client
+        self._lock = threading.Lock()
+        self._columns = {}  # table_id -> set of column names known to exist
+
+    def ensure_table(self, table_id, table_name):
+        """Creates or extends table_id to match the registry. Unregistered tables are left alone."""
+        if not schema_registry.is_registered(table_name):
+            return
+
+        wanted = schema_registry.columns(table_name)
+        known = self._columns.get(table_id)
+        if known is not None and all(name in known for name, _ in wanted):
+            return
+
+        # Only a cache miss pays for importing the BigQuery library.
+        from google.api_core.exceptions import NotFound
+        from google.cloud import bigquery
+
+        with self._lock:
+            try:
+                table = self.get_client().get_table(table_id)
+            except NotFound:
+                self.get_client().create_table(build_table(table_id, table_name), exists_ok=True)
+                print(f"--- Created table {table_id} ---")
+                self._columns[table_id] = {name for name, _ in wanted}
+                return
+
+            if table.time_partitioning is None and table_name in schema_registry.TABLE_LAYOUTS:
+                print(f"Table {table_id} predates the registry layout and is not partitioned; "
+                      f"recreate it to get partition pruning.")
+
+            existing = {field.name for field in table.schema}
+            missing = [(name, bq_type) for name, bq_type in wanted if name not in existing]
+            if missing:
+                table.schema = list(table.schema) + [
+                    bigquery.SchemaField(name, bq_type, mode="NULLABLE") for name, bq_type in missing
+                ]
+                self.get_client().update_table(table, ["schema"])
+                print(f"--- Added columns {[name for name, _ in missing]} to {table_id} ---")
+
+            self._columns[table_id] = existing | {name for name, _ in wanted}
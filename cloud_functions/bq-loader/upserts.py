@@ -0,0 +1,82 @@
+import datetime
+import re
+import uuid
+
+from shared import schema_registry
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Staging tables are dropped after the MERGE; the expiration only cleans up
+# after a loader that crashed half-way through.
+STAGING_TABLE_EXPIRATION = datetime.timedelta(hours=24)
+
+
+def can_upsert(table_name):
+    return table_name in schema_registry.ROW_KEYS
+
+
+def staging_table_id(table_id, sync_id):
+    suffix = re.sub(r"[^A-Za-z0-9_]", "_", str(sync_id or uuid.uuid4().hex))
+    return f"{table_id}__staging_{suffix}"
+
+
+# ===================================================================
+#           2. MERGE
+# ===================================================================
+
+def merge_sql(table_id, staging_id, table_name, column_names):
+    """
+    Builds the MERGE that upserts one sync's staged rows into the target.
+    Rows are matched on user_id plus the table's key columns; if the staging
+    table holds several versions of a record, only the newest one is merged:
+    the highest version, and among equal versions (or for tables without a
+    version column) the copy flattened last.
+    """
+    key_columns, version_column = schema_registry.ROW_KEYS[table_name]
+    keys = ["user_id"] + key_columns
+    order_by = " ORDER BY " + ", ".join(
+        f"`{column}` DESC" for column in [version_column, "synced_at"] if column)
+
+    on_clause = " AND ".join(f"T.`{key}` = S.`{key}`" for key in keys)
+    set_clause = ",\n    ".join(f"`{name}` = S.`{name}`" for name in column_names if name not in keys)
+
+    return f"""
+MERGE `{table_id}` T
+USING (
+  SELECT * FROM `{staging_id}`
+  WHERE TRUE
+  QUALIFY ROW_NUMBER() OVER (PARTITION BY {", ".join(f"`{key}`" for key in keys)}{order_by}) = 1
+) S
+ON {on_clause}
+WHEN MATCHED THEN UPDATE SET
+    {set_clause}
+WHEN NOT MATCHED THEN INSERT ROW
+"""
+
+
+def upsert_staged(client, table_id, table_name, sync_id, load_into):
+    """
+    Upserts one sync's staged files into table_id.
+    1. Creates a staging table with the target's schema.
+    2. Loads the files into it with load_into(staging_table_id).
+    3. MERGEs the staging table into the target and drops it.
+    Returns (rows loaded, rows affected by the MERGE).
+    """
+    from google.cloud import bigquery
+
+    target = client.get_table(table_id)
+    staging_id = staging_table_id(table_id, sync_id)
+
+    staging_table = bigquery.Table(staging_id, schema=target.schema)
+    staging_table.expires = datetime.datetime.now(datetime.timezone.utc) + STAGING_TABLE_EXPIRATION
+    client.create_table(staging_table, exists_ok=True)
+    try:
+        loaded_rows = load_into(staging_id)
+        job = client.query(merge_sql(table_id, staging_id, table_name,
+                                     [field.name for field in target.schema]))
+        job.result()
+        return loaded_rows, job.num_dml_affected_rows or 0
+    finally:
+        client.delete_table(staging_id, not_found_ok=True)
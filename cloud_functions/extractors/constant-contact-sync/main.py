@@ -1,10 +1,17 @@
-import base64
-import json
+import contextlib
+import csv
+import io
+import itertools
 import os
+import re
+import time
+import uuid
 
 import functions_framework
-import requests
-from google.cloud import pubsub_v1, secretmanager
+
+from shared import checkpoints, clients, envelope, http_client, leases, sync_jobs, telemetry
+from shared.credentials import CredentialProvider, read_json_secret
+from shared.publishing import open_publisher
 
 # ===================================================================
 #                      1. CONFIGURATION
@@ -13,67 +20,373 @@ from google.cloud import pubsub_v1, secretmanager
 # --- Environment Variables ---
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "mis581-capstone-data")
 LOAD_TOPIC_NAME = os.getenv("LOAD_TOPIC_NAME", "load-to-bigquery")
+# This function's own trigger topic: a long sync re-triggers itself to continue.
+TRIGGER_TOPIC_NAME = os.getenv("TRIGGER_TOPIC", "trigger-constant-contact-sync")
+# A finished sync requests its bulk job's next queued sync, or a full refresh
+# queued behind it, here.
+SYNC_TOPIC_NAME = os.getenv("SYNC_TOPIC", "initiate-data-sync")
+
+# --- Constant Contact API ---
+API_HOST = "https://api.cc.email"
+API_BASE_URL = f"{API_HOST}/v3"
+REQUEST_TIMEOUT_SECONDS = 30
+# Largest page sizes the v3 API accepts.
+CONTACTS_PAGE_SIZE = 500
+EMAILS_PAGE_SIZE = 500
+# Accounts with more contacts than this use one bulk export job instead of paging.
+BULK_EXPORT_THRESHOLD = int(os.getenv("CC_BULK_EXPORT_THRESHOLD", "50000"))
+EXPORT_POLL_INTERVAL_SECONDS = 5
+# Counted from the export's start, across the invocations a chained sync polls in.
+EXPORT_POLL_TIMEOUT_SECONDS = 30 * 60
+# Activity states in which an export job will never complete.
+EXPORT_FAILED_STATES = ("failed", "cancelled", "timed_out")
+# Export CSV columns (headers lower-cased, non-alphanumerics as "_") -> the
+# field, dotted for nested objects, of the contacts /contacts returns, so
+# exported and paged contacts load into the same columns. Other columns
+# (custom fields, addresses, list memberships) are left out.
+EXPORT_COLUMNS = {
+    "contact_id": "contact_id",
+    "email_address": "email_address.address",
+    "email": "email_address.address",
+    "email_status": "email_address.permission_to_send",
+    "email_permission_status": "email_address.permission_to_send",
+    "first_name": "first_name",
+    "last_name": "last_name",
+    "job_title": "job_title",
+    "company": "company_name",
+    "company_name": "company_name",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+}
+# "stream" publishes records for streaming inserts; "bulk" stages files for load jobs.
+DEFAULT_LOAD_MODE = os.getenv("LOAD_MODE", "stream")
+
+# --- Credential cache ---
+CREDENTIALS_TTL_SECONDS = int(os.getenv("CREDENTIALS_TTL_SECONDS", "300"))
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CREDENTIALS_CACHE_SIZE", "256"))
 
 # --- Clients ---
-publisher = pubsub_v1.PublisherClient()
-load_topic_path = publisher.topic_path(GCP_PROJECT_ID, LOAD_TOPIC_NAME)
+# Firestore and Pub/Sub clients are created on first use (shared/clients.py).
+load_topic_path = clients.topic_path(GCP_PROJECT_ID, LOAD_TOPIC_NAME)
+trigger_topic_path = clients.topic_path(GCP_PROJECT_ID, TRIGGER_TOPIC_NAME)
+sync_topic_path = clients.topic_path(GCP_PROJECT_ID, SYNC_TOPIC_NAME)
 
 
 # ===================================================================
 #           2. UTILITY FUNCTIONS
 # ===================================================================
 
-def get_constant_contact_credentials(project_id, secret_name):
-    """Retrieves Constant Contact API credentials from Google Cloud Secret Manager."""
+def get_constant_contact_credentials(tenant_id):
+    """Retrieves a tenant's Constant Contact API credentials from Google Cloud Secret Manager."""
     try:
-        secret_client = secretmanager.SecretManagerServiceClient()
-        secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-        response = secret_client.access_secret_version(request={"name": secret_path})
-        return json.loads(response.payload.data.decode("UTF-8"))
+        return read_json_secret(GCP_PROJECT_ID, f"constant-contact-token-{tenant_id}")
 
     except Exception as e:
         print(f"!!! ERROR fetching Constant Contact credentials: {e}")
         raise
 
-def publish_to_load_topic(data_list, data_type, tenant_id):
-    """Publishes each item in a list to the central loading topic."""
-    if not data_list:
-        print(f"No {data_type} to publish.")
-        return
+# Warm instances reuse a tenant's token instead of reading the secret on every run.
+credential_provider = CredentialProvider(
+    get_constant_contact_credentials,
+    ttl_seconds=CREDENTIALS_TTL_SECONDS,
+    max_size=CREDENTIALS_CACHE_SIZE,
+)
+
+
+def publish_to_load_topic(tenant_id, data_type, fetch, access_token, checkpoint, load_mode=DEFAULT_LOAD_MODE):
+    """
+    Streams one data type to the central loading topic in batched envelopes
+    or staged files, checkpointing each page so an interrupted sync resumes
+    from the last committed page. Returns the number of records published
+    for the sync; raises checkpoints.SyncSuspended when the invocation runs
+    out of time.
+    """
+    saved = checkpoint.resource(data_type)
+    if saved:
+        print(f"Resuming {data_type} from position {saved.get('position')}")
+    print(f"Publishing {data_type} records to {LOAD_TOPIC_NAME} ({load_mode} mode)...")
+    envelopes = open_publisher(clients.batch_publisher_client(), load_topic_path, {
+        "source": "constant-contact",
+        "user_id": tenant_id,
+        "table_name": f"constant_contact_{data_type}",
+        "sync_id": checkpoint.sync_id,
+    }, load_mode=load_mode, sync_id=checkpoint.sync_id, attributes=telemetry.message_attributes(),
+        resume=saved.get("publisher"))
+    resumed_records = envelopes.records_published
+    suspended = None
+    with telemetry.span("extract", table_name=data_type, load_mode=load_mode, resumed=bool(saved)) as span:
+        try:
+            # Closed explicitly so a suspended fetch releases its HTTP stream right here.
+            with contextlib.closing(fetch(access_token, saved.get("position"))) as pages:
+                for records, position in pages:
+                    envelopes.publish_many(records)
+                    # Pages without a position can't be resumed mid-way; nothing to save.
+                    if position is not None:
+                        checkpoint.commit(data_type, envelopes, position)
+        except checkpoints.SyncSuspended as e:
+            suspended = e
 
-    print(f"Publishing {len(data_list)} {data_type} records to {LOAD_TOPIC_NAME}...")
-    for item in data_list:
-        message_payload = {
-            "tenant_id": tenant_id,
-            "data_type": data_type,
-            "data": item,
-        }
-        message_data = json.dumps(message_payload).encode("utf-8")
-        future = publisher.publish(load_topic_path, message_data)
-        future.result()
-    print(f"Successfully published {len(data_list)} {data_type} records.")
+        if not suspended:
+            envelopes.close()
+        span.add(records=envelopes.records_published - resumed_records, num_bytes=envelopes.bytes_published)
+        span.set(messages=envelopes.messages_published, suspended=bool(suspended))
+    if suspended:
+        raise suspended
+
+    checkpoint.finish(data_type, records=envelopes.records_published)
+    if not envelopes.records_published:
+        print(f"No {data_type} to publish.")
+        return 0
+    print(f"Successfully published {envelopes.records_published} {data_type} records "
+          f"in {envelopes.messages_published} messages.")
+    return envelopes.records_published
 
 
 # ===================================================================
 #           3. CONSTANT CONTACT API EXTRACTION FUNCTIONS
 # ===================================================================
 
-# TODO: Implement the functions to fetch data from the Constant Contact API.
-# You will need to consult the Constant Contact API documentation for details
-# on the available endpoints and data formats.
+def auth_headers(access_token):
+    return {"Authorization": f"Bearer {access_token}", "Accept": "application/json"}
+
+
+def iter_pages(path, key, headers, params=None, next_href=None):
+    """
+    Yields (records, position) for every page of a cursor-paginated v3 collection.
+    Each response links to the next page in '_links.next.href', which already
+    carries the cursor and page size, so params only apply to the first request.
+    position ({"next": href}) resumes the collection at the following page;
+    it is None after the last page.
+    """
+    url = f"{API_HOST}{next_href}" if next_href else f"{API_BASE_URL}{path}"
+    if next_href:
+        params = None
+    while url:
+        response = http_client.get(url, headers=headers, params=params, timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        body = response.json()
+
+        next_href = body.get("_links", {}).get("next", {}).get("href")
+        yield body.get(key, []), {"next": next_href} if next_href else None
+        url = f"{API_HOST}{next_href}" if next_href else None
+        params = None
+
+
+def count_contacts(headers):
+    """Returns the total number of contacts in the account."""
+    response = http_client.get(f"{API_BASE_URL}/contacts", headers=headers,
+                               params={"limit": 1, "include_count": "true", "status": "all"},
+                               timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json().get("contacts_count", 0)
 
-def fetch_contacts(access_token):
-    """Placeholder function to fetch contacts."""
+
+def contact_from_export_row(row):
+    """Maps one export CSV row onto the shape of a /contacts record (EXPORT_COLUMNS)."""
+    contact = {}
+    for header, value in row.items():
+        field = EXPORT_COLUMNS.get(re.sub(r"[^a-z0-9]+", "_", (header or "").strip().lower()).strip("_"))
+        value = (value or "").strip()
+        if not field or not value:
+            continue
+        *parents, name = field.split(".")
+        target = contact
+        for parent in parents:
+            target = target.setdefault(parent, {})
+        target[name] = value
+    return contact
+
+
+def export_contacts(headers, position=None):
+    """
+    Yields (contacts, position) from one bulk export job instead of thousands of pages.
+    1. Starts a /activities/contact_exports job.
+    2. Polls the activity until it is completed, yielding no contacts after
+       each poll so the caller's checkpoint can suspend the sync meanwhile.
+    3. Streams the resulting CSV file and yields it CONTACTS_PAGE_SIZE
+       rows at a time, mapped onto /contacts fields (contact_from_export_row).
+    position ({"activity_id": ..., "rows": n, "started_at": epoch seconds})
+    resumes the same export after its first n rows; the first one is
+    yielded as soon as the job starts.
+    """
+    if position:
+        activity_id = position["activity_id"]
+        position = dict(position, started_at=position.get("started_at", time.time()))
+        print(f"Resuming contact export activity {activity_id} after {position['rows']} rows")
+        activity = {"state": None}
+    else:
+        response = http_client.post(f"{API_BASE_URL}/activities/contact_exports", headers=headers,
+                                    json={"status": "all"}, timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        activity = response.json()
+        activity_id = activity["activity_id"]
+        print(f"Started contact export activity {activity_id}")
+        position = {"activity_id": activity_id, "rows": 0, "started_at": time.time()}
+        yield [], position
+
+    while activity.get("state") != "completed":
+        if activity.get("state") in EXPORT_FAILED_STATES:
+            raise RuntimeError(f"Contact export {activity_id} ended in state '{activity['state']}'.")
+        if time.time() - position["started_at"] >= EXPORT_POLL_TIMEOUT_SECONDS:
+            raise RuntimeError(f"Contact export {activity_id} did not complete in time.")
+        if activity.get("state") is not None:
+            yield [], position
+            time.sleep(EXPORT_POLL_INTERVAL_SECONDS)
+
+        response = http_client.get(f"{API_BASE_URL}/activities/{activity_id}", headers=headers,
+                                   timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        activity = response.json()
+        print(f"Contact export {activity_id}: {activity.get('state')} "
+              f"({activity.get('percent_done', 0)}%)")
+
+    results_href = activity["_links"]["results"]["href"]
+    rows_read = position["rows"]
+    with http_client.get(f"{API_HOST}{results_href}", headers=dict(headers, Accept="text/csv"),
+                         stream=True, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+        response.raise_for_status()
+        # Read straight off the socket. newline="" keeps the line endings, so
+        # csv still parses quoted fields that span lines.
+        # auto_close off: io wrappers treat a drained urllib3 response as closed.
+        response.raw.decode_content = True
+        response.raw.auto_close = False
+        text = io.TextIOWrapper(response.raw, encoding="utf-8", newline="")
+        rows = itertools.islice(csv.DictReader(text), rows_read, None)
+        while True:
+            chunk = [contact_from_export_row(row) for row in itertools.islice(rows, CONTACTS_PAGE_SIZE)]
+            if not chunk:
+                break
+            rows_read += len(chunk)
+            yield chunk, dict(position, rows=rows_read)
+
+
+def fetch_contacts(access_token, position=None):
+    """
+    Yields (contacts, position) page by page, paging by cursor or through a
+    bulk export for large accounts. A saved position continues the same
+    cursor or export.
+    """
     print("Fetching contacts from Constant Contact...")
-    # api_url = "https://api.cc.email/v3/contacts"
-    # headers = {"Authorization": f"Bearer {access_token}"}
-    # ... (add pagination logic)
-    return []
+    headers = auth_headers(access_token)
+    if position and "activity_id" in position:
+        yield from export_contacts(headers, position)
+        return
+    if position:
+        yield from iter_pages("/contacts", "contacts", headers, next_href=position["next"])
+        return
 
-def fetch_campaigns(access_token):
-    """Placeholder function to fetch campaigns."""
+    total = count_contacts(headers)
+    if total > BULK_EXPORT_THRESHOLD:
+        print(f"{total} contacts exceed the bulk threshold of {BULK_EXPORT_THRESHOLD}; using an export job.")
+        yield from export_contacts(headers)
+        return
+
+    print(f"Paging through {total} contacts, {CONTACTS_PAGE_SIZE} per page.")
+    yield from iter_pages("/contacts", "contacts", headers,
+                          params={"limit": CONTACTS_PAGE_SIZE, "status": "all"})
+
+def fetch_campaigns(access_token, position=None):
+    """Yields (campaigns, position) for every page of email campaigns."""
     print("Fetching campaigns from Constant Contact...")
-    return []
+    yield from iter_pages("/emails", "campaigns", auth_headers(access_token),
+                          params={"limit": EMAILS_PAGE_SIZE}, next_href=(position or {}).get("next"))
+
+
+DATA_TYPES = (("contacts", fetch_contacts), ("campaigns", fetch_campaigns))
+
+
+def finish_job_item(tenant_id, status, **fields):
+    """
+    Records the sync's outcome on the bulk sync job it belongs to, if any,
+    and dispatches the job's next queued Constant Contact sync. Raises
+    sync_jobs.JobUpdateError if the outcome can't be recorded, failing the
+    invocation so the message is redelivered.
+    """
+    sync_jobs.finish_and_dispatch(clients.firestore_client(), sync_topic_path, telemetry.current_job_id(),
+                                  tenant_id, "constant-contact", status, **fields)
+
+
+def release_lease(tenant_id, lease_id):
+    """
+    Lets the router accept the next sync request for this tenant, and requests
+    again a full refresh the router queued while this sync held the lease,
+    with the trace attributes of the message that asked for it.
+    """
+    pending = leases.release(clients.firestore_client(), tenant_id, "constant-contact", lease_id)
+    if not pending:
+        return
+    request, queued_attributes = pending
+    try:
+        data, attributes = envelope.encode(request)
+        clients.publisher_client().publish(sync_topic_path, data, **attributes, **queued_attributes).result()
+        print(f"Requested the full refresh queued for tenant {tenant_id} during this sync.")
+    except Exception as e:
+        print(f"!!! Error requesting the full refresh queued for tenant {tenant_id}: {e}")
+
+
+def run_sync(tenant_id, load_mode=DEFAULT_LOAD_MODE, sync_id=None, lease_id=None):
+    """
+    Fetches the tenant's credentials, then extracts and publishes each data
+    type, continuing from the checkpoint an earlier invocation of the sync left.
+    Returns False when the sync was handed over to a new invocation.
+    """
+    try:
+        credentials = credential_provider.get(tenant_id)
+        if not credentials or not credentials.get("access_token"):
+            raise ValueError("Access token not found in credentials.")
+
+    except Exception as e:
+        print(f"Error getting credentials: {e}")
+        finish_job_item(tenant_id, "failed", error=f"Error getting credentials: {e}")
+        return True
+
+    db = clients.firestore_client()
+    checkpoint = checkpoints.open_checkpoint(db, tenant_id, "constant-contact", sync_id, {"load_mode": load_mode})
+    sync_id = checkpoint.sync_id
+    telemetry.set_sync_id(sync_id)
+    sync_jobs.start_item(db, telemetry.current_job_id(), tenant_id, "constant-contact")
+
+    # --- Extraction and publishing ---
+    # Records are streamed from the API straight into the loader topic.
+    print("\n--- Publishing extracted data to loader topic ---")
+    records_published = 0
+    errors = {}
+    for data_type, fetch in DATA_TYPES:
+        if checkpoint.is_done(data_type):
+            print(f"{data_type} already finished in an earlier invocation.")
+            records_published += checkpoint.resource(data_type).get("records", 0)
+            continue
+        try:
+            # A 401 means the cached token was replaced; re-read it and retry once.
+            records_published += credential_provider.call(tenant_id, lambda creds: publish_to_load_topic(
+                tenant_id, data_type, fetch, creds["access_token"], checkpoint, load_mode=load_mode))
+        except checkpoints.SyncSuspended as e:
+            # Out of time: the progress is saved, so carry on in a fresh invocation.
+            print(f"{e} Continuing sync {sync_id} in a new invocation.")
+            leases.renew(db, tenant_id, "constant-contact", lease_id)
+            checkpoints.continue_sync(trigger_topic_path, {
+                "source": "constant-contact", "user": tenant_id, "load_mode": load_mode,
+                "lease_id": lease_id, "sync_id": sync_id,
+            })
+            return False
+        except Exception as e:
+            print(f"!!! ERROR extracting {data_type}: {e}")
+            errors[data_type] = str(e)
+
+    if all(checkpoint.is_done(data_type) for data_type, _ in DATA_TYPES):
+        checkpoint.clear()
+    else:
+        print(f"Progress of sync {sync_id} is saved; the next sync for this tenant resumes it.")
+
+    # Report the outcome to the bulk sync job this sync belongs to, if any.
+    error = "; ".join(f"{data_type}: {message}" for data_type, message in errors.items())
+    finish_job_item(tenant_id, "failed" if errors else "done",
+                    records_extracted=records_published, **({"error": error} if error else {}))
+
+    telemetry.log("extract_summary", tenant_id=tenant_id, invocation=checkpoint.state["invocations"],
+                  credential_cache=credential_provider.metrics(),
+                  http_latency=http_client.latency_histograms())
+    return True
 
 
 # ===================================================================
@@ -84,12 +397,16 @@ def fetch_campaigns(access_token):
 def constant_contact_sync(cloud_event):
     """
     Triggered by a message on 'trigger-constant-contact-sync'.
+    Progress is checkpointed page by page: a failed or re-triggered sync
+    resumes where it stopped, and a long one re-triggers itself to continue
+    before the function times out.
     """
     try:
-        message_data_encoded = cloud_event.data["message"]["data"]
-        message_data_decoded = base64.b64decode(message_data_encoded).decode("utf-8")
-        data_payload = json.loads(message_data_decoded)
+        data_payload = envelope.decode_event(cloud_event)
         tenant_id = data_payload.get("user")
+        lease_id = data_payload.get("lease_id")
+        load_mode = data_payload.get("load_mode") or DEFAULT_LOAD_MODE
+        sync_id = data_payload.get("sync_id") or lease_id or uuid.uuid4().hex
 
         if not tenant_id:
             print("!!! ERROR: 'user' (tenant_id) not found in message payload.")
@@ -101,25 +418,17 @@ def constant_contact_sync(cloud_event):
         print(f"!!! ERROR decoding Pub/Sub message: {e}")
         return
 
+    finished = True
     try:
-        secret_name = f"constant-contact-token-{tenant_id}"
-        credentials = get_constant_contact_credentials(GCP_PROJECT_ID, secret_name)
-        access_token = credentials.get("access_token")
-
-        if not access_token:
-            raise ValueError("Access token not found in credentials.")
-
-    except Exception as e:
-        print(f"Error getting credentials: {e}")
-        return
-
-    # --- Extraction ---
-    all_contacts = fetch_contacts(access_token)
-    all_campaigns = fetch_campaigns(access_token)
-
-    # --- Publishing ---
-    print("\n--- Publishing extracted data to loader topic ---")
-    publish_to_load_topic(all_contacts, "contacts", tenant_id)
-    publish_to_load_topic(all_campaigns, "campaigns", tenant_id)
+        with telemetry.trace(cloud_event, sync_id=sync_id):
+            finished = run_sync(tenant_id, load_mode=load_mode, sync_id=sync_id, lease_id=lease_id)
+    finally:
+        # Let the router accept the next sync request for this tenant, unless
+        # the sync continues in another invocation that keeps the lease.
+        if finished:
+            release_lease(tenant_id, lease_id)
 
-    print(f"\n--- Constant Contact extraction for tenant '{tenant_id}' complete. ---")
+    if finished:
+        print(f"\n--- Constant Contact extraction for tenant '{tenant_id}' complete. ---")
+    else:
+        print(f"\n--- Constant Contact extraction for tenant '{tenant_id}' continues in a new invocation. ---")
@@ -0,0 +1,178 @@
+import json
+import tarfile
+import time
+
+from shared import http_client
+
+import mailchimp_api
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+POLL_INTERVAL_SECONDS = 10
+# Counted from submission, across the invocations a chained sync polls in.
+POLL_TIMEOUT_SECONDS = 30 * 60
+REQUEST_TIMEOUT_SECONDS = 30
+
+
+class BatchOperationError(Exception):
+    """Raised when a Mailchimp batch job fails or does not finish in time."""
+
+
+# ===================================================================
+#           2. BATCH JOB LIFECYCLE
+# ===================================================================
+
+def member_operations(list_sizes, params=None, count=mailchimp_api.MAX_PAGE_SIZE):
+    """Builds one GET operation per page of members for every list."""
+    operations = []
+    for list_id, total in list_sizes.items():
+        for offset in range(0, total, count):
+            operations.append({
+                "method": "GET",
+                "path": f"/lists/{list_id}/members",
+                "params": dict(params or {}, count=count, offset=offset),
+                "operation_id": f"{list_id}:{offset}",
+            })
+    return operations
+
+
+def submit_batch(base_url, headers, operations):
+    """Submits a /batches job and returns its id."""
+    response = http_client.post(f"{base_url}/batches", headers=headers,
+                                json={"operations": operations}, timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()["id"]
+
+
+def poll_batch(base_url, headers, batch_id, poll_interval=POLL_INTERVAL_SECONDS):
+    """
+    Yields the status body of a batch job, polling every poll_interval
+    seconds, until it finishes; the last body yielded is the finished one.
+    The caller may stop between polls, e.g. to hand over to a new invocation.
+    """
+    while True:
+        response = http_client.get(f"{base_url}/batches/{batch_id}", headers=headers,
+                                   timeout=REQUEST_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        status = response.json()
+        if status.get("status") == "finished":
+            yield status
+            return
+
+        print(f"Batch {batch_id}: {status.get('status')} "
+              f"({status.get('finished_operations', 0)}/{status.get('total_operations', 0)} operations)")
+        yield status
+        time.sleep(poll_interval)
+
+
+def wait_for_batch(base_url, headers, batch_id, poll_interval=POLL_INTERVAL_SECONDS,
+                   timeout=POLL_TIMEOUT_SECONDS):
+    """Polls a batch job until it finishes and returns its final status body."""
+    deadline = time.monotonic() + timeout
+    for status in poll_batch(base_url, headers, batch_id, poll_interval):
+        if status.get("status") == "finished":
+            return status
+        if time.monotonic() >= deadline:
+            raise BatchOperationError(f"Batch {batch_id} did not finish within {timeout} seconds.")
+
+
+def iter_batch_results(response_body_url, key, skip_files=0):
+    """
+    Streams a finished batch's tar.gz archive and yields (records, files_read)
+    for every result file inside, skipping the first skip_files files.
+    The archive is read straight off the HTTP response, one file at a time,
+    so it is never held in memory or written to disk as a whole.
+    """
+    files_read = 0
+    with http_client.get(response_body_url, stream=True, timeout=REQUEST_TIMEOUT_SECONDS) as response:
+        response.raise_for_status()
+        with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.endswith(".json"):
+                    continue
+                files_read += 1
+                if files_read <= skip_files:
+                    continue
+
+                records = []
+                for result in json.load(archive.extractfile(member)):
+                    if result.get("status_code") != 200:
+                        print(f"!!! Batch operation {result.get('operation_id')} failed "
+                              f"with status {result.get('status_code')}: {result.get('response')}")
+                        continue
+                    records.extend(json.loads(result["response"]).get(key, []))
+                yield records, files_read
+
+
+# ===================================================================
+#           3. LIST MEMBERS EXTRACTION
+# ===================================================================
+
+def list_sizes(base_url, headers):
+    """
+    Returns {list_id: number of members in any status} for every list.
+    stats.total_contacts counts subscribed, unsubscribed, cleaned, pending,
+    transactional and archived members alike; Mailchimp only returns it
+    when asked to (include_total_contacts).
+    """
+    lists = mailchimp_api.iter_collection(
+        base_url, "/lists", "lists", headers,
+        params={"include_total_contacts": "true"},
+        fields=["lists.id", "lists.stats.total_contacts"],
+    )
+    return {mc_list["id"]: mc_list.get("stats", {}).get("total_contacts", 0) for mc_list in lists}
+
+
+def iter_members(base_url, headers, params=None, exclude_fields=("members._links",), position=None):
+    """
+    Yields (members, position) for the members of every list using one
+    Mailchimp batch job.
+    1. Sizes each list and builds one GET operation per page of members.
+    2. Submits the operations to /batches and polls until the job finishes,
+       yielding no members after each poll so the caller's checkpoint can
+       suspend the sync while the job runs.
+    3. Streams the result archive and yields members file by file.
+
+    position ({"batch_id": ..., "files": n, "submitted_at": epoch seconds})
+    is where an interrupted run resumes: the same batch job, after its first
+    n result files. The first position is yielded (with no members) as soon
+    as the job is submitted.
+    """
+    if position:
+        batch_id = position["batch_id"]
+        position = dict(position, submitted_at=position.get("submitted_at", time.time()))
+        print(f"Resuming batch {batch_id} after {position['files']} result files.")
+    else:
+        sizes = list_sizes(base_url, headers)
+        params = dict(params or {})
+        if exclude_fields:
+            params["exclude_fields"] = ",".join(exclude_fields)
+
+        operations = member_operations(sizes, params)
+        if not operations:
+            print("No list members to extract.")
+            return
+
+        batch_id = submit_batch(base_url, headers, operations)
+        print(f"Submitted batch {batch_id} with {len(operations)} operations "
+              f"for {len(sizes)} lists ({sum(sizes.values())} members).")
+        position = {"batch_id": batch_id, "files": 0, "submitted_at": time.time()}
+        yield [], position
+
+    for status in poll_batch(base_url, headers, batch_id):
+        if status.get("status") == "finished":
+            break
+        if time.time() - position["submitted_at"] >= POLL_TIMEOUT_SECONDS:
+            raise BatchOperationError(f"Batch {batch_id} did not finish within {POLL_TIMEOUT_SECONDS} seconds.")
+        yield [], position
+
+    if status.get("errored_operations"):
+        print(f"!!! Batch {batch_id} finished with {status['errored_operations']} errored operations.")
+    if not status.get("response_body_url"):
+        raise BatchOperationError(f"Batch {batch_id} finished without a response_body_url.")
+
+    for members, files_read in iter_batch_results(status["response_body_url"], "members",
+                                                  skip_files=position["files"]):
+        yield members, dict(position, files=files_read)
@@ -0,0 +1,134 @@
+import collections
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import http_client
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Mailchimp caps 'count' at 1000 records per page.
+MAX_PAGE_SIZE = 1000
+# Mailchimp allows 10 simultaneous connections per account.
+DEFAULT_MAX_WORKERS = 4
+REQUEST_TIMEOUT_SECONDS = 30
+
+
+def api_base_url(server_prefix):
+    return f"https://{server_prefix}.api.mailchimp.com/3.0"
+
+
+# ===================================================================
+#           2. PAGINATION
+# ===================================================================
+
+def _projection_params(fields, exclude_fields):
+    """Builds Mailchimp's fields/exclude_fields query parameters."""
+    params = {}
+    if fields:
+        # total_items is needed to plan the remaining pages.
+        params["fields"] = ",".join(list(fields) + ["total_items"])
+    if exclude_fields:
+        params["exclude_fields"] = ",".join(exclude_fields)
+    return params
+
+
+def fetch_page(base_url, path, headers, params, offset, count):
+    """Fetches one page of a Mailchimp collection and returns the decoded body."""
+    page_params = dict(params, offset=offset, count=count)
+    response = http_client.get(f"{base_url}{path}", headers=headers, params=page_params,
+                               timeout=REQUEST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_pages(base_url, path, key, headers, params=None, count=MAX_PAGE_SIZE,
+               fields=None, exclude_fields=None, max_workers=DEFAULT_MAX_WORKERS, start_offset=0):
+    """
+    Yields (records, next_offset) for every page of a paginated Mailchimp
+    collection, e.g. /campaigns, starting at start_offset.
+    1. Fetches the first page to learn 'total_items'.
+    2. Fetches the remaining pages concurrently, at most max_workers at a time.
+    3. Yields pages in offset order, so only a few pages are ever held in
+       memory and next_offset is where an interrupted run resumes.
+
+    'key' is the name of the list in the response body, e.g. "campaigns".
+    'fields'/'exclude_fields' are Mailchimp projections such as
+    "campaigns.id" or "campaigns._links".
+    """
+    params = dict(params or {}, **_projection_params(fields, exclude_fields))
+
+    first_page = fetch_page(base_url, path, headers, params, start_offset, count)
+    total_items = first_page.get("total_items", 0)
+    yield first_page.get(key, []), start_offset + count
+    del first_page
+
+    offsets = iter(range(start_offset + count, total_items, count))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque()
+        for offset in offsets:
+            pending.append((offset, pool.submit(fetch_page, base_url, path, headers, params, offset, count)))
+            if len(pending) >= max_workers:
+                break
+
+        while pending:
+            offset, future = pending.popleft()
+            page = future.result()
+            next_offset = next(offsets, None)
+            if next_offset is not None:
+                pending.append((next_offset, pool.submit(fetch_page, base_url, path, headers, params,
+                                                         next_offset, count)))
+            yield page.get(key, []), offset + count
+
+
+def iter_collection(base_url, path, key, headers, **kwargs):
+    """Yields every record of a paginated Mailchimp collection (see iter_pages)."""
+    for records, _ in iter_pages(base_url, path, key, headers, **kwargs):
+        yield from records
+
+
+# ===================================================================
+#           3. PER-RESOURCE FAN-OUT
+# ===================================================================
+
+def fetch_resource(base_url, path, headers, params=None):
+    """Fetches one resource, e.g. /reports/{campaign_id}; returns None if it doesn't exist."""
+    response = http_client.get(f"{base_url}{path}", headers=headers, params=params,
+                               timeout=REQUEST_TIMEOUT_SECONDS)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def iter_resources(base_url, path_template, ids, headers, params=None, max_workers=DEFAULT_MAX_WORKERS,
+                   start=0):
+    """
+    Yields (body, resume_index) for path_template.format(id) of every id
+    from index start on, fetching max_workers at a time.
+    Bodies are yielded in id order, so resume_index (the index after the
+    body's id) is exact: a run resumed from it fetches none of the bodies
+    already yielded. At most 2 * max_workers responses are fetched or held
+    at once; a slow request holds back the ones after it. 'ids' may be a
+    lazy iterator. Missing resources (404) are skipped.
+    """
+    ids = itertools.islice(enumerate(ids), start, None)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = collections.deque()  # (index, future) in id order
+
+        def submit_next():
+            index, resource_id = next(ids, (None, None))
+            if resource_id is not None:
+                future = pool.submit(fetch_resource, base_url, path_template.format(resource_id), headers, params)
+                pending.append((index, future))
+
+        for _ in range(2 * max_workers):
+            submit_next()
+
+        while pending:
+            index, future = pending.popleft()
+            body = future.result()
+            submit_next()
+            if body is not None:
+                yield body, index + 1
@@ -1,10 +1,15 @@
-import base64
-import json
+import contextlib
+import datetime
 import os
+import uuid
 import functions_framework
 import requests
-from google.cloud import firestore
-from google.cloud import pubsub_v1
+
+import batch_operations
+import mailchimp_api
+from shared import checkpoints, clients, envelope, http_client, leases, sync_jobs, sync_state, telemetry
+from shared.credentials import CredentialProvider, is_unauthorized
+from shared.publishing import open_publisher
 
 # ===================================================================
 #                      1. CONFIGURATION
@@ -12,15 +17,405 @@ from google.cloud import pubsub_v1
 
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "data-app-dev-2")
 LOADER_TOPIC_NAME = os.getenv("LOADER_TOPIC", "bq-loader-topic")
+# Announces finished syncs to downstream stages such as analytics-refresh.
+SYNC_COMPLETED_TOPIC_NAME = os.getenv("SYNC_COMPLETED_TOPIC", "sync-completed")
+# This function's own trigger topic: a long sync re-triggers itself to continue.
+TRIGGER_TOPIC_NAME = os.getenv("TRIGGER_TOPIC", "trigger-mailchimp-sync")
+# A finished sync requests its bulk job's next queued sync, or a full refresh
+# queued behind it, here.
+SYNC_TOPIC_NAME = os.getenv("SYNC_TOPIC", "initiate-data-sync")
+
+# --- Mailchimp API ---
+# Projections are comma-separated Mailchimp field paths. '_links' repeats
+# on every campaign and is never loaded, so it is dropped by default.
+CAMPAIGN_FIELDS = [f for f in os.getenv("MAILCHIMP_CAMPAIGN_FIELDS", "").split(",") if f]
+CAMPAIGN_EXCLUDE_FIELDS = [f for f in os.getenv("MAILCHIMP_CAMPAIGN_EXCLUDE_FIELDS", "campaigns._links").split(",") if f]
+PAGE_WORKERS = int(os.getenv("MAILCHIMP_PAGE_WORKERS", str(mailchimp_api.DEFAULT_MAX_WORKERS)))
+# Campaign reports are fetched one request per campaign, this many at a time
+# (Mailchimp allows 10 simultaneous connections per account).
+REPORT_WORKERS = int(os.getenv("MAILCHIMP_REPORT_WORKERS", "8"))
+REPORT_EXCLUDE_FIELDS = [f for f in os.getenv("MAILCHIMP_REPORT_EXCLUDE_FIELDS", "_links,timeseries").split(",") if f]
+# A campaign's opens and clicks stop changing in practice this long after it was sent.
+REPORT_FINAL_DAYS = int(os.getenv("MAILCHIMP_REPORT_FINAL_DAYS", "30"))
+# Resources synced when the trigger message doesn't list any.
+DEFAULT_RESOURCES = [r for r in os.getenv("MAILCHIMP_RESOURCES", "campaigns,reports,members").split(",") if r]
+# "stream" publishes records for streaming inserts; "bulk" stages files for load jobs.
+DEFAULT_LOAD_MODE = os.getenv("LOAD_MODE", "stream")
+
+# --- Incremental sync ---
+# For each resource: the Mailchimp filter parameter and the record field
+# whose largest value becomes the next run's high-water mark. Reports keep
+# changing after a campaign is sent, so their mark is the time the last
+# report sync started instead (see fetch_reports).
+INCREMENTAL_FILTERS = {
+    "campaigns": ("since_send_time", "send_time"),
+    "members": ("since_last_changed", "last_changed"),
+    "reports": ("since_send_time", None),
+}
+
+# --- Credential cache ---
+CREDENTIALS_TTL_SECONDS = int(os.getenv("CREDENTIALS_TTL_SECONDS", "300"))
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CREDENTIALS_CACHE_SIZE", "256"))
 
 # --- Clients ---
-db = firestore.Client()
-publisher = pubsub_v1.PublisherClient()
-loader_topic_path = publisher.topic_path(GCP_PROJECT_ID, LOADER_TOPIC_NAME)
+# Firestore and Pub/Sub clients are created on first use (shared/clients.py).
+loader_topic_path = clients.topic_path(GCP_PROJECT_ID, LOADER_TOPIC_NAME)
+sync_completed_topic_path = clients.topic_path(GCP_PROJECT_ID, SYNC_COMPLETED_TOPIC_NAME)
+trigger_topic_path = clients.topic_path(GCP_PROJECT_ID, TRIGGER_TOPIC_NAME)
+sync_topic_path = clients.topic_path(GCP_PROJECT_ID, SYNC_TOPIC_NAME)
+
+
+def get_mailchimp_credentials(user_id):
+    """Reads the user's Mailchimp token and server prefix from Firestore, or None."""
+    doc = clients.firestore_client().collection('user_credentials').document(user_id).get()
+    if not doc.exists:
+        return None
+    credentials = doc.to_dict()
+    return {
+        "access_token": credentials.get('mailchimp_access_token'),
+        "server_prefix": credentials.get('mailchimp_server_prefix'),
+    }
+
+# Warm instances reuse a user's token instead of reading Firestore on every run.
+credential_provider = CredentialProvider(
+    get_mailchimp_credentials,
+    ttl_seconds=CREDENTIALS_TTL_SECONDS,
+    max_size=CREDENTIALS_CACHE_SIZE,
+)
 
 
 # ===================================================================
-#           2. MAIN CLOUD FUNCTION (PUBSUB TRIGGER)
+#           2. EXTRACTION FUNCTIONS
+# ===================================================================
+
+def fetch_campaigns(base_url, headers, params, position=None):
+    """Pages through /campaigns concurrently; position is the offset to resume from."""
+    print(f"Fetching campaigns from: {base_url}/campaigns")
+    return mailchimp_api.iter_pages(
+        base_url, "/campaigns", "campaigns", headers,
+        params=params,
+        fields=CAMPAIGN_FIELDS,
+        exclude_fields=CAMPAIGN_EXCLUDE_FIELDS,
+        max_workers=PAGE_WORKERS,
+        start_offset=position or 0,
+    )
+
+
+def fetch_members(base_url, headers, params, position=None):
+    """Extracts the members of every list with a single Mailchimp batch job."""
+    print(f"Fetching list members through: {base_url}/batches")
+    return batch_operations.iter_members(base_url, headers, params=params, position=position)
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def report_window_start(params):
+    """Returns the send time of the oldest campaign whose report may still change, or None for all."""
+    last_report_sync = params.get("since_send_time")
+    if not last_report_sync:
+        return None
+    return (parse_time(last_report_sync) - datetime.timedelta(days=REPORT_FINAL_DAYS)).isoformat()
+
+
+def fetch_reports(base_url, headers, params, position=None):
+    """
+    Fetches /reports/{campaign_id} for every sent campaign whose stats may
+    still have changed, REPORT_WORKERS requests at a time, yielding each
+    report as it arrives.
+    A campaign sent more than REPORT_FINAL_DAYS before the last report sync
+    already had final stats when that sync read them, so it is skipped.
+    position is the number of campaigns (in listing order) already done.
+    """
+    campaign_params = {"status": "sent"}
+    since = report_window_start(params)
+    if since:
+        campaign_params["since_send_time"] = since
+    print(f"Fetching reports of campaigns sent since {campaign_params.get('since_send_time', 'the start')} "
+          f"from: {base_url}/reports")
+
+    campaigns = mailchimp_api.iter_collection(
+        base_url, "/campaigns", "campaigns", headers,
+        params=campaign_params,
+        fields=["campaigns.id"],
+        max_workers=PAGE_WORKERS,
+    )
+    reports = mailchimp_api.iter_resources(
+        base_url, "/reports/{}", (campaign["id"] for campaign in campaigns), headers,
+        params={"exclude_fields": ",".join(REPORT_EXCLUDE_FIELDS)} if REPORT_EXCLUDE_FIELDS else None,
+        max_workers=REPORT_WORKERS,
+        start=position or 0,
+    )
+    return (([report], resume_index) for report, resume_index in reports)
+
+
+# Every fetcher yields (records, position) page by page; position is where a
+# resumed sync restarts the resource (shared/checkpoints.py).
+RESOURCE_FETCHERS = {
+    "campaigns": fetch_campaigns,
+    "reports": fetch_reports,
+    "members": fetch_members,
+}
+
+# Earliest send_time of the campaigns each fetch can return, from its params;
+# analytics-refresh only scans the table partitions from there on.
+SEND_TIME_WINDOWS = {
+    "campaigns": lambda params: params.get("since_send_time"),
+    "reports": report_window_start,
+}
+
+
+def changed_since(checkpoint, record_counts):
+    """
+    Returns the earliest send_time among the campaigns and reports this sync
+    published, or None when one of them was a full fetch.
+    """
+    windows = [SEND_TIME_WINDOWS[resource](checkpoint.resource(resource).get("params") or {})
+               for resource in SEND_TIME_WINDOWS if record_counts.get(f"mailchimp_{resource}")]
+    if not windows or None in windows:
+        return None
+    return min(windows, key=parse_time)
+
+
+def sync_resource(user_id, resource, base_url, headers, checkpoint, full_refresh=False,
+                  load_mode=DEFAULT_LOAD_MODE):
+    """
+    Streams one resource of the user's account to the bq-loader-topic.
+    Only records changed after the stored high-water mark are fetched unless
+    full_refresh is set. The mark is advanced once every envelope is published.
+    Progress is checkpointed page by page; a resource the sync already
+    started continues from its saved position, filters and mark.
+    Raises checkpoints.SyncSuspended when the invocation runs out of time.
+    """
+    db = clients.firestore_client()
+    saved = checkpoint.resource(resource)
+    filter_param, watermark_field = INCREMENTAL_FILTERS[resource]
+    if saved:
+        started_at, params, watermark = saved["started_at"], saved["params"], saved.get("start_watermark")
+        print(f"Resuming {resource} from position {saved.get('position')}")
+    else:
+        started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        watermark = None if full_refresh else sync_state.get_watermark(db, user_id, "mailchimp", resource)
+        params = {filter_param: watermark} if watermark else {}
+    tracker = sync_state.WatermarkTracker(watermark_field, watermark) if watermark_field else None
+    if tracker and saved.get("watermark"):
+        tracker.value = saved["watermark"]
+
+    if watermark:
+        print(f"Incremental sync: fetching {resource} with {filter_param} > {watermark}")
+    else:
+        print(f"Full sync: fetching all {resource}")
+
+    # Metadata tells the loader where to save the records
+    envelopes = open_publisher(clients.batch_publisher_client(), loader_topic_path, {
+        "source": "mailchimp",
+        "user_id": user_id,
+        "table_name": f"mailchimp_{resource}",
+        "sync_id": checkpoint.sync_id,
+    }, load_mode=load_mode, sync_id=checkpoint.sync_id, attributes=telemetry.message_attributes(),
+        resume=saved.get("publisher"))
+    resumed_records = envelopes.records_published
+    position = saved.get("position")
+    fetch_failed = False
+    suspended = None
+    with telemetry.span("extract", table_name=f"mailchimp_{resource}", load_mode=load_mode,
+                        incremental=bool(watermark), resumed=bool(saved)) as span:
+        try:
+            # Closed explicitly so a suspended fetch shuts its worker pool down right here.
+            with contextlib.closing(RESOURCE_FETCHERS[resource](base_url, headers, params,
+                                                                saved.get("position"))) as pages:
+                for records, position in pages:
+                    envelopes.publish_many(tracker.track(records) if tracker else records)
+                    checkpoint.commit(resource, envelopes, position, started_at=started_at, params=params,
+                                      start_watermark=watermark, watermark=tracker.value if tracker else None)
+
+        except checkpoints.SyncSuspended as e:
+            # Everything published so far is committed; the next invocation
+            # publishes the rest (and a bulk sync's manifest).
+            suspended = e
+
+        except (requests.exceptions.RequestException, batch_operations.BatchOperationError) as e:
+            if is_unauthorized(e):
+                raise  # Let the credential provider refresh the token and retry.
+            # Records already read are still published below, and the
+            # checkpoint moves to the last page read for the next attempt.
+            print(f"!!! Error fetching {resource} from Mailchimp API: {e}")
+            fetch_failed = True
+
+        # Wait for the outstanding envelopes; raises if any publish failed.
+        if not suspended:
+            envelopes.close()
+        if fetch_failed:
+            # A bulk sync's manifest now lists the files staged so far; saving
+            # the publisher's state drops them so the next attempt's doesn't.
+            checkpoint.save_progress(resource, envelopes, position, started_at=started_at, params=params,
+                                     start_watermark=watermark, watermark=tracker.value if tracker else None)
+        span.add(records=envelopes.records_published - resumed_records, num_bytes=envelopes.bytes_published)
+        span.set(messages=envelopes.messages_published, fetch_failed=fetch_failed, suspended=bool(suspended))
+    if suspended:
+        raise suspended
+    if not envelopes.records_published:
+        print(f"No new {resource} found to load.")
+    else:
+        print(f"Successfully published {envelopes.records_published} {resource} in "
+              f"{envelopes.messages_published} messages to '{LOADER_TOPIC_NAME}'.")
+
+    # A partial run must not move the mark, or the missed records are skipped forever;
+    # the resource stays unfinished in the checkpoint and the next sync resumes it.
+    if fetch_failed:
+        return envelopes.records_published
+
+    if tracker is None:
+        new_watermark = started_at  # Reports: the next run looks back from this run's start
+    else:
+        new_watermark = tracker.value if tracker.advanced else None
+    if new_watermark:
+        sync_state.set_watermark(db, user_id, "mailchimp", resource, new_watermark)
+        print(f"High-water mark for {resource} advanced to {new_watermark}")
+
+    checkpoint.finish(resource, records=envelopes.records_published, params=params)
+    return envelopes.records_published
+
+
+def announce_sync_completed(user_id, sync_id, record_counts, changed_since=None):
+    """
+    Tells downstream stages which tables this sync changed, how many records
+    it published to each and the earliest send_time among them (None for a
+    full fetch), so they only process that sync's rows.
+    """
+    event = {"source": "mailchimp", "user_id": user_id, "sync_id": sync_id,
+             "record_counts": record_counts, "changed_since": changed_since}
+    try:
+        data, attributes = envelope.encode(event)
+        publisher = clients.batch_publisher_client()
+        publisher.publish(sync_completed_topic_path, data, **attributes,
+                          **telemetry.message_attributes()).result()
+        print(f"Published sync-completed event for sync {sync_id}: {record_counts}")
+    except Exception as e:
+        print(f"!!! Error publishing sync-completed event: {e}")
+
+
+def finish_job_item(user_id, status, **fields):
+    """
+    Records the sync's outcome on the bulk sync job it belongs to, if any,
+    and dispatches the job's next queued Mailchimp sync. Raises
+    sync_jobs.JobUpdateError if the outcome can't be recorded, failing the
+    invocation so the message is redelivered.
+    """
+    sync_jobs.finish_and_dispatch(clients.firestore_client(), sync_topic_path, telemetry.current_job_id(),
+                                  user_id, "mailchimp", status, **fields)
+
+
+def release_lease(user_id, lease_id):
+    """
+    Lets the router accept the next sync request for this user, and requests
+    again a full refresh the router queued while this sync held the lease,
+    with the trace attributes of the message that asked for it.
+    """
+    pending = leases.release(clients.firestore_client(), user_id, "mailchimp", lease_id)
+    if not pending:
+        return
+    request, queued_attributes = pending
+    try:
+        data, attributes = envelope.encode(request)
+        clients.publisher_client().publish(sync_topic_path, data, **attributes, **queued_attributes).result()
+        print(f"Requested the full refresh queued for user {user_id} during this sync.")
+    except Exception as e:
+        print(f"!!! Error requesting the full refresh queued for user {user_id}: {e}")
+
+
+def run_sync(user_id, resources, full_refresh=False, load_mode=DEFAULT_LOAD_MODE, sync_id=None, lease_id=None):
+    """
+    Fetches the user's credentials and syncs each requested resource,
+    continuing from the checkpoint an earlier invocation of the sync left.
+    Returns False when the sync was handed over to a new invocation.
+    """
+    # 1. Fetch the user's credentials (cached per instance, backed by Firestore)
+    error = None
+    try:
+        credentials = credential_provider.get(user_id)
+        if not credentials:
+            print(f"!!! Error: Could not find credentials for user {user_id} in Firestore.")
+            error = "Credentials not found."
+        elif not credentials["access_token"] or not credentials["server_prefix"]:
+            print(f"!!! Error: Missing Mailchimp credentials for user {user_id}.")
+            error = "Missing Mailchimp credentials."
+    except Exception as e:
+        print(f"!!! Error fetching credentials from Firestore: {e}")
+        error = f"Error fetching credentials: {e}"
+    if error:
+        finish_job_item(user_id, "failed", error=error)
+        return True
+
+    db = clients.firestore_client()
+    checkpoint = checkpoints.open_checkpoint(db, user_id, "mailchimp", sync_id,
+                                             {"full_refresh": full_refresh, "load_mode": load_mode})
+    sync_id = checkpoint.sync_id
+    telemetry.set_sync_id(sync_id)
+    sync_jobs.start_item(db, telemetry.current_job_id(), user_id, "mailchimp")
+
+    # 2. Stream new or changed records of each resource to the bq-loader-topic
+    def run(resource, credentials):
+        base_url = mailchimp_api.api_base_url(credentials["server_prefix"])
+        headers = {"Authorization": f"Bearer {credentials['access_token']}"}
+        return sync_resource(user_id, resource, base_url, headers, checkpoint,
+                             full_refresh=full_refresh, load_mode=load_mode)
+
+    record_counts = {}
+    errors = {}
+    for resource in resources:
+        if resource not in RESOURCE_FETCHERS:
+            print(f"!!! Error: Unknown Mailchimp resource '{resource}', skipping.")
+            continue
+        if checkpoint.is_done(resource):
+            published = checkpoint.resource(resource).get("records", 0)
+            print(f"{resource} already finished in an earlier invocation ({published} records).")
+        else:
+            try:
+                # A 401 means the cached token was revoked or replaced; re-read it and retry once.
+                published = credential_provider.call(user_id, lambda credentials: run(resource, credentials))
+            except checkpoints.SyncSuspended as e:
+                # 3. Out of time: the progress is saved, so carry on in a fresh invocation
+                print(f"{e} Continuing sync {sync_id} in a new invocation.")
+                leases.renew(db, user_id, "mailchimp", lease_id)
+                checkpoints.continue_sync(trigger_topic_path, {
+                    "source": "mailchimp", "user": user_id, "resources": resources,
+                    "full_refresh": full_refresh, "load_mode": load_mode,
+                    "lease_id": lease_id, "sync_id": sync_id,
+                })
+                return False
+            except Exception as e:
+                print(f"!!! Error syncing {resource}: {e}")
+                errors[resource] = str(e)
+                continue
+        if published:
+            record_counts[f"mailchimp_{resource}"] = published
+
+    # 4. Let downstream stages refresh from the rows this sync produced
+    if record_counts:
+        announce_sync_completed(user_id, sync_id, record_counts, changed_since(checkpoint, record_counts))
+
+    unfinished = [r for r in resources if r in RESOURCE_FETCHERS and not checkpoint.is_done(r)]
+    if not unfinished:
+        checkpoint.clear()
+    else:
+        print(f"Progress of sync {sync_id} is saved; the next sync for this user resumes it.")
+
+    # 5. Report the outcome to the bulk sync job this sync belongs to, if any
+    error = "; ".join(f"{r}: {errors.get(r, 'fetch failed')}" for r in unfinished)
+    finish_job_item(user_id, "failed" if unfinished else "done",
+                    records_extracted=sum(record_counts.values()), **({"error": error} if error else {}))
+
+    telemetry.log("extract_summary", user_id=user_id, record_counts=record_counts,
+                  invocation=checkpoint.state["invocations"],
+                  credential_cache=credential_provider.metrics(),
+                  http_latency=http_client.latency_histograms())
+    return True
+
+
+# ===================================================================
+#           3. MAIN CLOUD FUNCTION (PUBSUB TRIGGER)
 # ===================================================================
 
 @functions_framework.cloud_event
@@ -29,15 +424,24 @@ def mailchimp_sync(cloud_event):
     Extracts data from Mailchimp for a given user.
     1. Triggered by a message on the 'initiate-data-sync' topic.
     2. Fetches the user's access token from Firestore.
-    3. Calls the Mailchimp API to get campaign data.
-    4. Publishes the extracted data to the 'bq-loader-topic'.
+    3. Extracts the campaigns and list members changed since the last sync,
+       and the reports of campaigns whose stats may still change.
+    4. Publishes each page to the 'bq-loader-topic' as it arrives,
+       checkpointing progress so a failed or re-triggered sync resumes, and
+       re-triggering itself to continue before the function times out.
+    5. Announces the finished sync on the 'sync-completed' topic and, when
+       the sync is part of a bulk job, records its outcome on the job.
     """
     # 1. Decode the incoming message to get the user_id
     try:
-        message_data_encoded = cloud_event.data["message"]["data"]
-        message_data_decoded = base64.b64decode(message_data_encoded).decode('utf-8')
-        data_payload = json.loads(message_data_decoded)
+        data_payload = envelope.decode_event(cloud_event)
         user_id = data_payload.get("user")
+        # 'full_refresh' ignores the stored high-water marks and backfills everything
+        full_refresh = bool(data_payload.get("full_refresh"))
+        resources = data_payload.get("resources") or DEFAULT_RESOURCES
+        lease_id = data_payload.get("lease_id")
+        load_mode = data_payload.get("load_mode") or DEFAULT_LOAD_MODE
+        sync_id = data_payload.get("sync_id") or lease_id or uuid.uuid4().hex
 
         if not user_id:
             print("!!! Error: user_id not found in message payload.")
@@ -48,63 +452,19 @@ def mailchimp_sync(cloud_event):
 
     print(f"--- Starting Mailchimp sync for user: {user_id} ---")
 
-    # 2. Fetch the user's credentials from Firestore
-    try:
-        doc_ref = db.collection('user_credentials').document(user_id)
-        doc = doc_ref.get()
-        if not doc.exists:
-            print(f"!!! Error: Could not find credentials for user {user_id} in Firestore.")
-            return
-
-        credentials = doc.to_dict()
-        access_token = credentials.get('mailchimp_access_token')
-        server_prefix = credentials.get('mailchimp_server_prefix')
-
-        if not access_token or not server_prefix:
-            print(f"!!! Error: Missing Mailchimp credentials for user {user_id}.")
-            return
-    except Exception as e:
-        print(f"!!! Error fetching credentials from Firestore: {e}")
-        return
-
-    # 3. Call the Mailchimp API to get campaign data
+    finished = True
     try:
-        api_url = f"https://{server_prefix}.api.mailchimp.com/3.0/campaigns"
-        headers = {"Authorization": f"Bearer {access_token}"}
-        
-        print(f"Fetching campaigns from: {api_url}")
-        response = requests.get(api_url, headers=headers, timeout=30)
-        response.raise_for_status()
-        campaigns_data = response.json()
-        
-        # We only need the 'campaigns' list from the response
-        campaigns = campaigns_data.get("campaigns", [])
-        print(f"Successfully fetched {len(campaigns)} campaigns.")
-
-    except requests.exceptions.RequestException as e:
-        print(f"!!! Error fetching data from Mailchimp API: {e}")
-        return
-        
-    if not campaigns:
-        print("No campaigns found to load. Sync complete.")
-        return
-
-    # 4. Publish each campaign to the bq-loader-topic for processing
-    try:
-        for campaign in campaigns:
-            # Add metadata for the loader to know where to save the data
-            message_payload = {
-                "source": "mailchimp",
-                "user_id": user_id,
-                "table_name": "mailchimp_campaigns",
-                "data": campaign
-            }
-            message_data = json.dumps(message_payload).encode("utf-8")
-            future = publisher.publish(loader_topic_path, message_data)
-            future.result() # Wait for the message to be published
-
-        print(f"Successfully published {len(campaigns)} campaign messages to '{LOADER_TOPIC_NAME}'.")
-    except Exception as e:
-        print(f"!!! Error publishing messages to Pub/Sub: {e}")
+        # 2.-3. Fetch credentials, then stream each resource to the bq-loader-topic
+        with telemetry.trace(cloud_event, sync_id=sync_id):
+            finished = run_sync(user_id, resources, full_refresh=full_refresh, load_mode=load_mode,
+                                sync_id=sync_id, lease_id=lease_id)
+    finally:
+        # Let the router accept the next sync request for this user, unless
+        # the sync continues in another invocation that keeps the lease.
+        if finished:
+            release_lease(user_id, lease_id)
 
-    print(f"--- Mailchimp sync for user: {user_id} complete. ---")
\ No newline at end of file
+    if finished:
+        print(f"--- Mailchimp sync for user: {user_id} complete. ---")
+    else:
+        print(f"--- Mailchimp sync for user: {user_id} continues in a new invocation. ---")
\ No newline at end of file
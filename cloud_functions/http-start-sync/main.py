@@ -1,23 +1,32 @@
 import os
-import json
-from google.cloud import pubsub_v1
+import uuid
 import functions_framework
 
-# Initialize the Pub/Sub publisher client.
-publisher = pubsub_v1.PublisherClient()
+from shared import clients, envelope, sync_jobs, telemetry
 
 # Get the Project ID and Topic Name from environment variables.
 # We will set these during deployment.
 project_id = os.getenv('GCP_PROJECT')
 topic_name = 'initiate-data-sync'
-topic_path = publisher.topic_path(project_id, topic_name)
+topic_path = clients.topic_path(project_id, topic_name)
+# The Pub/Sub publisher client is created on the first publish (clients.publisher_client()),
+# so bad requests never pay for it.
+
+# Sources a bulk request may name; each has a 'trigger-{source}-sync' topic.
+BULK_SOURCES = [s for s in os.getenv('BULK_SYNC_SOURCES', 'mailchimp,constant-contact').split(',') if s]
+# Each source's queue document lists every user of the job, and must stay
+# under Firestore's 1 MiB document limit.
+BULK_MAX_SYNCS = int(os.getenv('BULK_SYNC_MAX_SYNCS', '2000'))
+# Request fields passed on to every sync of a bulk job.
+BULK_SYNC_OPTIONS = ('full_refresh', 'load_mode', 'resources')
 
 @functions_framework.http
 def start_data_sync(request):
     """
     HTTP Cloud Function to trigger a data synchronization job.
     1. Receives a request from the frontend.
-    2. Publishes a message to a Pub/Sub topic with the request data.
+    2. Publishes a message to a Pub/Sub topic with the request data,
+       starting the trace that every later function logs under.
     """
     
     # --- SECURITY (Placeholder) ---
@@ -42,15 +51,19 @@ def start_data_sync(request):
 
     try:
         # Prepare the message to be sent to Pub/Sub.
-        # The message data must be a bytestring.
-        message_data = json.dumps(request_json).encode('utf-8')
+        # The message data must be a bytestring (shared/envelope.py encodes it).
+        message_data, attributes = envelope.encode(request_json)
+
+        # Publish the message to the Pub/Sub topic. The trace id travels
+        # as a message attribute through the router, extractor and loader.
+        with telemetry.trace(), telemetry.span("start_sync", source=request_json.get("source")) as span:
+            future = clients.publisher_client().publish(topic_path, message_data, **attributes,
+                                                         **telemetry.message_attributes())
+
+            # future.result() blocks until the message is published.
+            message_id = future.result()
+            span.add(num_bytes=len(message_data))
 
-        # Publish the message to the Pub/Sub topic.
-        future = publisher.publish(topic_path, message_data)
-        
-        # future.result() blocks until the message is published.
-        message_id = future.result()
-        
         print(f"Message {message_id} published to {topic_path}.")
         
         # Return a success response to the frontend.
@@ -58,4 +71,114 @@ def start_data_sync(request):
 
     except Exception as e:
         print(f"Error publishing to Pub/Sub: {e}")
-        return 'Internal Server Error', 500
\ No newline at end of file
+        return 'Internal Server Error', 500
+
+
+def parse_bulk_request(request_json):
+    """
+    Validates a bulk sync request and returns (users, sources, options,
+    max_concurrency), or raises ValueError with the reason.
+    'max_concurrency' is a number for every source or a {source: number} map.
+    """
+    users = request_json.get('users') or request_json.get('tenants')
+    sources = request_json.get('sources')
+    if not isinstance(users, list) or not isinstance(sources, list) or not users or not sources:
+        raise ValueError("'users' (or 'tenants') and 'sources' must be non-empty lists.")
+    if not all(isinstance(value, str) and value for value in users + sources):
+        raise ValueError("'users' and 'sources' must contain non-empty strings.")
+    unknown = [source for source in sources if source not in BULK_SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown sources {unknown}; expected some of {BULK_SOURCES}.")
+
+    # Duplicates would double-count a sync in the job's totals.
+    users, sources = list(dict.fromkeys(users)), list(dict.fromkeys(sources))
+    if len(users) * len(sources) > BULK_MAX_SYNCS:
+        raise ValueError(f"At most {BULK_MAX_SYNCS} (user, source) pairs per request; split the request.")
+
+    max_concurrency = request_json.get('max_concurrency')
+    if max_concurrency is None:
+        max_concurrency = {}
+    elif not isinstance(max_concurrency, dict):
+        max_concurrency = {source: max_concurrency for source in sources}
+    try:
+        max_concurrency = {source: int(limit) for source, limit in max_concurrency.items() if source in sources}
+    except (TypeError, ValueError):
+        raise ValueError("'max_concurrency' must be a number or a {source: number} map.")
+    if any(limit < 1 for limit in max_concurrency.values()):
+        raise ValueError("'max_concurrency' must be at least 1.")
+
+    options = {key: request_json[key] for key in BULK_SYNC_OPTIONS if key in request_json}
+    return users, sources, options, max_concurrency
+
+
+@functions_framework.http
+def start_bulk_sync(request):
+    """
+    HTTP Cloud Function to sync many tenants and sources with one request:
+        {"users": ["user-1", ...], "sources": ["mailchimp", "constant-contact"],
+         "max_concurrency": {"mailchimp": 10}, "full_refresh": false}
+    1. Creates the job's documents under sync_jobs/{job_id}, whose
+       per-tenant status, record counts and durations the dashboard polls
+       through get_sync_job.
+    2. Publishes the first max_concurrency syncs of each source to the
+       'initiate-data-sync' topic in one batch. Each extractor dispatches
+       the next queued sync of its source when it finishes, so no more than
+       max_concurrency syncs per source API run at once.
+    3. Responds 202 with the job id.
+    """
+    request_json = request.get_json(silent=True)
+    if not request_json or not isinstance(request_json, dict):
+        return 'Bad Request: No JSON data found.', 400
+    try:
+        users, sources, options, max_concurrency = parse_bulk_request(request_json)
+    except ValueError as e:
+        return f'Bad Request: {e}', 400
+
+    job_id = uuid.uuid4().hex
+    try:
+        with telemetry.trace(job_id=job_id), telemetry.span("start_bulk_sync", sources=sources) as span:
+            db = clients.firestore_client()
+            first = sync_jobs.create_job(db, job_id, users, sources, options, max_concurrency)
+            failed = sync_jobs.dispatch(topic_path, job_id, first, options)
+            # Syncs that could not be requested are recorded as failed, freeing their slots.
+            for user_id, source in failed:
+                sync_jobs.finish_and_dispatch(db, topic_path, job_id, user_id, source, "failed",
+                                              error="Could not publish the sync request.")
+            span.add(records=len(first) - len(failed))
+            span.set(users=len(users), queued=len(users) * len(sources) - len(first))
+
+        print(f"Bulk sync job {job_id}: {len(users)} users x {len(sources)} sources, "
+              f"{len(first) - len(failed)} syncs dispatched.")
+        return {
+            'job_id': job_id,
+            'job_document': f'{sync_jobs.JOB_COLLECTION}/{job_id}',
+            'total': len(users) * len(sources),
+            'dispatched': len(first) - len(failed),
+        }, 202
+
+    except Exception as e:
+        print(f"Error starting bulk sync job {job_id}: {e}")
+        return 'Internal Server Error', 500
+
+
+@functions_framework.http
+def get_sync_job(request):
+    """
+    HTTP Cloud Function the dashboard polls for a bulk sync job's progress:
+        GET ?job_id=...&items=true
+    Responds with the job's status, per-status counts and record totals;
+    with 'items', also every (tenant, source) sync's status, record counts
+    and duration (sync_jobs.read_job()).
+    """
+    job_id = request.args.get('job_id')
+    if not job_id:
+        return 'Bad Request: Missing job_id.', 400
+    try:
+        job = sync_jobs.read_job(clients.firestore_client(), job_id,
+                                 include_items=request.args.get('items') == 'true')
+    except Exception as e:
+        print(f"Error reading bulk sync job {job_id}: {e}")
+        return 'Internal Server Error', 500
+    if job is None:
+        return 'Not Found: Unknown job_id.', 404
+    return job, 200
@@ -1,9 +1,10 @@
 import json
 import os
-import requests
-from google.cloud import secretmanager, pubsub_v1
 import functions_framework
 
+from shared import clients, http_client, pending_syncs, telemetry
+from shared.credentials import CredentialProvider
+
 # ===================================================================
 #                      1. CONFIGURATION
 # ===================================================================
@@ -11,12 +12,13 @@ import functions_framework
 # --- Environment Variables ---
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "mis581-capstone-data")
 OAUTH_CREDENTIALS_SECRET_NAME = os.getenv("OAUTH_SECRET", "constant_contact_oauth_credentials")
-SYNC_TOPIC_NAME = os.getenv("SYNC_TOPIC", "initiate-data-sync")
+# How long a warm instance reuses the app's OAuth client id and secret.
+OAUTH_CREDENTIALS_TTL_SECONDS = int(os.getenv("OAUTH_CREDENTIALS_TTL_SECONDS", "3600"))
+TOKEN_URL = "https://id.constantcontact.com/as/token.oauth2"
 
 # --- Clients ---
-secret_client = secretmanager.SecretManagerServiceClient()
-publisher = pubsub_v1.PublisherClient()
-sync_topic_path = publisher.topic_path(GCP_PROJECT_ID, SYNC_TOPIC_NAME)
+# Secret Manager and Firestore clients are created on first use (shared/clients.py),
+# so requests rejected with a 400 never pay for them.
 
 
 # ===================================================================
@@ -26,16 +28,46 @@ sync_topic_path = publisher.topic_path(GCP_PROJECT_ID, SYNC_TOPIC_NAME)
 def get_oauth_credentials():
     """Retrieves Constant Contact OAuth client_id and client_secret."""
     secret_path = f"projects/{GCP_PROJECT_ID}/secrets/{OAUTH_CREDENTIALS_SECRET_NAME}/versions/latest"
-    response = secret_client.access_secret_version(request={"name": secret_path})
+    response = clients.secret_manager_client().access_secret_version(request={"name": secret_path})
     return json.loads(response.payload.data.decode("UTF-8"))
 
+# Warm instances reuse the app credentials instead of reading the secret on
+# every callback; a 401 from the token endpoint (rotated secret) drops them,
+# so the next callback re-reads it.
+app_credentials = CredentialProvider(
+    lambda _: get_oauth_credentials(),
+    ttl_seconds=OAUTH_CREDENTIALS_TTL_SECONDS,
+    max_size=1,
+)
+
+
+def exchange_code(auth_code, redirect_uri):
+    """
+    Exchanges an authorization code for the user's token data. The code is
+    single-use, so a failed exchange is never retried with it.
+    """
+    oauth_creds = app_credentials.get("app")
+    token_payload = {
+        "grant_type": "authorization_code",
+        "client_id": oauth_creds["client_id"],
+        "client_secret": oauth_creds["client_secret"],
+        "code": auth_code,
+        "redirect_uri": redirect_uri,
+    }
+    response = http_client.post(TOKEN_URL, data=token_payload, timeout=15)
+    if response.status_code == 401:
+        app_credentials.invalidate("app")
+    response.raise_for_status()
+    return response.json()
+
+
 def create_user_secret(user_id, token_data):
     """Creates a new secret in Secret Manager for a specific user."""
     secret_id = f"constant-contact-token-{user_id}"
     parent = f"projects/{GCP_PROJECT_ID}"
 
     try:
-        secret_client.create_secret(
+        clients.secret_manager_client().create_secret(
             request={
                 "parent": parent,
                 "secret_id": secret_id,
@@ -51,7 +83,8 @@ def create_user_secret(user_id, token_data):
 
     secret_path = f"{parent}/secrets/{secret_id}"
     payload = json.dumps(token_data).encode("UTF-8")
-    secret_client.add_secret_version(request={"parent": secret_path, "payload": {"data": payload}})
+    clients.secret_manager_client().add_secret_version(
+        request={"parent": secret_path, "payload": {"data": payload}})
     print(f"Successfully stored token in secret: {secret_id}")
 
 
@@ -63,6 +96,10 @@ def create_user_secret(user_id, token_data):
 def constant_contact_oauth_callback(request):
     """
     Handles the OAuth2 redirect from Constant Contact.
+    1. Exchanges the authorization code for an access token.
+    2. Stores the token in a user-specific Secret Manager secret.
+    3. Queues the initial sync for oauth/initial-sync to publish, and
+       redirects the user back to the application without waiting on Pub/Sub.
     """
     auth_code = request.args.get("code")
     user_id = request.args.get("state")
@@ -71,28 +108,23 @@ def constant_contact_oauth_callback(request):
         return "Error: Missing authorization code or user state.", 400
 
     try:
-        oauth_creds = get_oauth_credentials()
-        token_url = "https://id.constantcontact.com/as/token.oauth2"
+        # 1. Exchange the code, with the app credentials cached per instance
         redirect_uri = request.base_url
+        token_data = exchange_code(auth_code, redirect_uri)
 
-        token_payload = {
-            "grant_type": "authorization_code",
-            "client_id": oauth_creds["client_id"],
-            "client_secret": oauth_creds["client_secret"],
-            "code": auth_code,
-            "redirect_uri": redirect_uri,
-        }
-
-        response = requests.post(token_url, data=token_payload, timeout=15)
-        response.raise_for_status()
-        token_data = response.json()
-
+        # 2. Store the token; once this returns, the connection is durable
         create_user_secret(user_id, token_data)
 
-        sync_message = {"source": "constant-contact", "user": user_id}
-        message_data = json.dumps(sync_message).encode("utf-8")
-        publisher.publish(sync_topic_path, message_data).result()
-        print(f"Successfully triggered initial sync for user {user_id}")
+        # 3. Queue the initial sync. The token is stored and the code spent,
+        # so a failure here is logged rather than failing the connection.
+        try:
+            # The initial sync starts its own trace, like syncs from http-start-sync.
+            with telemetry.trace(), telemetry.span("start_sync", source="constant-contact"):
+                pending_syncs.queue_sync(clients.firestore_client(), user_id, "constant-contact",
+                                         telemetry.message_attributes())
+            print(f"Queued the initial sync for user {user_id}")
+        except Exception as e:
+            print(f"!!! Error queueing the initial sync for user {user_id}: {e}")
 
         dashboard_url = "http://localhost:3000/dashboard?connected=constant-contact"
         return functions_framework.redirect(dashboard_url)
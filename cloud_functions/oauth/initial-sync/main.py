@@ -0,0 +1,44 @@
+import os
+import functions_framework
+
+from shared import clients, pending_syncs
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "data-app-dev-2")
+SYNC_TOPIC_NAME = os.getenv("SYNC_TOPIC", "initiate-data-sync")
+
+# --- Clients ---
+# Firestore and Pub/Sub clients are created on first use (shared/clients.py).
+sync_topic_path = clients.topic_path(GCP_PROJECT_ID, SYNC_TOPIC_NAME)
+
+
+# ===================================================================
+#           2. MAIN CLOUD FUNCTION (FIRESTORE TRIGGER)
+# ===================================================================
+
+@functions_framework.cloud_event
+def initial_sync(cloud_event):
+    """
+    Starts the first sync of a newly connected account.
+    1. Triggered when an OAuth callback creates a 'pending_syncs' document
+       (google.cloud.firestore.document.v1.created, deployed with --retry).
+    2. Publishes the queued request to 'initiate-data-sync' with the
+       callback's trace attributes, waiting for Pub/Sub to accept it.
+    3. Deletes the document. A failed publish raises, so the event is
+       redelivered until the sync is requested.
+    """
+    # The subject is "documents/pending_syncs/{user_id}__{source}".
+    doc_id = cloud_event["subject"].rsplit("/", 1)[-1]
+    try:
+        request = pending_syncs.publish_pending(clients.firestore_client(), clients.publisher_client(),
+                                                sync_topic_path, doc_id)
+    except Exception as e:
+        print(f"!!! Error requesting the initial sync {doc_id}: {e}")
+        raise
+    if request is None:
+        print(f"Initial sync {doc_id} was already requested.")
+    else:
+        print(f"Successfully triggered initial sync for user {request['user']} ({request['source']}).")
@@ -1,11 +1,12 @@
 import json
 import os
 import requests
-from google.cloud import secretmanager
-from google.cloud import firestore
 import functions_framework
 from flask import redirect
 
+from shared import clients, http_client, pending_syncs, telemetry
+from shared.credentials import CredentialProvider
+
 # ===================================================================
 #                      1. CONFIGURATION
 # ===================================================================
@@ -13,27 +14,58 @@ from flask import redirect
 # --- Environment Variables ---
 GCP_PROJECT_ID = os.getenv("GCP_PROJECT_ID", "data-app-dev-2") # Updated to your current project
 OAUTH_CREDENTIALS_SECRET_NAME = os.getenv("OAUTH_SECRET", "mailchimp-oauth-credentials")
-SYNC_TOPIC_NAME = os.getenv("SYNC_TOPIC", "initiate-data-sync")
+# How long a warm instance reuses the app's OAuth client id and secret.
+OAUTH_CREDENTIALS_TTL_SECONDS = int(os.getenv("OAUTH_CREDENTIALS_TTL_SECONDS", "3600"))
+TOKEN_URL = "https://login.mailchimp.com/oauth2/token"
 
 # --- Clients ---
-secret_client = secretmanager.SecretManagerServiceClient()
-db = firestore.Client() # Initialize Firestore client
+# Secret Manager and Firestore clients are created on first use
+# (shared/clients.py), so requests rejected with a 400 never pay for them.
 
 
 # ===================================================================
-#           2. UTILITY FUNCTION
+#           2. UTILITY FUNCTIONS
 # ===================================================================
 
 def get_oauth_credentials():
     """Retrieves Mailchimp OAuth client_id and client_secret from Secret Manager."""
     secret_path = f"projects/{GCP_PROJECT_ID}/secrets/{OAUTH_CREDENTIALS_SECRET_NAME}/versions/latest"
     try:
-        response = secret_client.access_secret_version(request={"name": secret_path})
+        response = clients.secret_manager_client().access_secret_version(request={"name": secret_path})
         return json.loads(response.payload.data.decode("UTF-8"))
     except Exception as e:
         print(f"!!! Error fetching secret '{OAUTH_CREDENTIALS_SECRET_NAME}': {e}")
         raise
 
+# Warm instances reuse the app credentials instead of reading the secret on
+# every callback; a 401 from the token endpoint (rotated secret) drops them,
+# so the next callback re-reads it.
+app_credentials = CredentialProvider(
+    lambda _: get_oauth_credentials(),
+    ttl_seconds=OAUTH_CREDENTIALS_TTL_SECONDS,
+    max_size=1,
+)
+
+
+def exchange_code(auth_code, redirect_uri):
+    """
+    Exchanges an authorization code for the user's token data. The code is
+    single-use, so a failed exchange is never retried with it.
+    """
+    oauth_creds = app_credentials.get("app")
+    token_payload = {
+        "grant_type": "authorization_code",
+        "client_id": oauth_creds["client_id"],
+        "client_secret": oauth_creds["client_secret"],
+        "code": auth_code,
+        "redirect_uri": redirect_uri,
+    }
+    response = http_client.post(TOKEN_URL, data=token_payload, timeout=15)
+    if response.status_code == 401:
+        app_credentials.invalidate("app")
+    response.raise_for_status()
+    return response.json()
+
 
 # ===================================================================
 #           3. MAIN CLOUD FUNCTION (HTTP TRIGGER)
@@ -44,8 +76,9 @@ def mailchimp_oauth_callback(request):
     """
     Handles the OAuth2 redirect from Mailchimp.
     1. Exchanges the authorization code for an access token.
-    2. Stores the token securely in a user-specific Firestore document.
-    3. Redirects the user back to the application.
+    2. Stores the token securely in a user-specific Firestore document,
+       together with a pending initial sync that oauth/initial-sync publishes.
+    3. Redirects the user back to the application without waiting on Pub/Sub.
     """
     # 1. Get the authorization code and user_id from the request
     auth_code = request.args.get("code")
@@ -55,22 +88,9 @@ def mailchimp_oauth_callback(request):
         return "Error: Missing authorization code or user state.", 400
 
     try:
-        # 2. Exchange the code for an access token
-        oauth_creds = get_oauth_credentials()
-        token_url = "https://login.mailchimp.com/oauth2/token"
+        # 2. Exchange the code for an access token (app credentials are cached per instance)
         redirect_uri = request.base_url # The URL of this function
-
-        token_payload = {
-            "grant_type": "authorization_code",
-            "client_id": oauth_creds["client_id"],
-            "client_secret": oauth_creds["client_secret"],
-            "code": auth_code,
-            "redirect_uri": redirect_uri,
-        }
-
-        response = requests.post(token_url, data=token_payload, timeout=15)
-        response.raise_for_status()
-        token_data = response.json()
+        token_data = exchange_code(auth_code, redirect_uri)
         access_token = token_data.get('access_token')
 
         if not access_token:
@@ -79,12 +99,19 @@ def mailchimp_oauth_callback(request):
 
         # 3. Store the token in a user-specific Firestore document
         # We use a collection 'user_credentials' and a document named after the user_id.
+        # The initial sync is queued in the same batch, so a stored token always gets one.
+        db = clients.firestore_client()
+        batch = db.batch()
         doc_ref = db.collection('user_credentials').document(user_id)
-        doc_ref.set({
+        batch.set(doc_ref, {
             'mailchimp_access_token': access_token,
             'mailchimp_server_prefix': token_data.get('dc')
         }, merge=True) # merge=True prevents overwriting credentials from other services
-        print(f"Successfully stored token in Firestore for user: {user_id}")
+        # The initial sync starts its own trace, like syncs from http-start-sync.
+        with telemetry.trace(), telemetry.span("start_sync", source="mailchimp"):
+            pending_syncs.queue_sync(db, user_id, "mailchimp", telemetry.message_attributes(), batch=batch)
+            batch.commit()
+        print(f"Successfully stored token in Firestore and queued the initial sync for user: {user_id}")
 
         # 4. Redirect user back to the frontend dashboard
         # TODO: Replace with your actual frontend dashboard URL from an environment variable
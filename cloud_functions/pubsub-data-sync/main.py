@@ -1,12 +1,18 @@
 import os
-import json
-import base64
 import functions_framework
-from google.cloud import pubsub_v1
 
-# Initialize the Pub/Sub publisher client.
-publisher = pubsub_v1.PublisherClient()
+from shared import clients, envelope, leases, sync_jobs, telemetry
+
+# The Pub/Sub publisher and Firestore clients are created on first use
+# (clients.publisher_client() / clients.firestore_client()).
 project_id = os.getenv('GCP_PROJECT')
+# Suppressed syncs of a bulk job hand their slot to the job's next sync via this topic.
+sync_topic_path = clients.topic_path(project_id, 'initiate-data-sync')
+
+# Duplicate requests for a (user, source) that is already syncing, or that
+# finished less than SYNC_COOLDOWN_SECONDS ago, are dropped.
+SYNC_COOLDOWN_SECONDS = int(os.getenv('SYNC_COOLDOWN_SECONDS', str(leases.DEFAULT_COOLDOWN_SECONDS)))
+SYNC_LEASE_TTL_SECONDS = int(os.getenv('SYNC_LEASE_TTL_SECONDS', str(leases.DEFAULT_LEASE_TTL_SECONDS)))
 
 @functions_framework.cloud_event
 def process_data_sync(cloud_event):
@@ -14,33 +20,83 @@ def process_data_sync(cloud_event):
     Pub/Sub-triggered Cloud Function that acts as a router.
     1. Receives a message from the 'initiate-data-sync' topic.
     2. Inspects the 'source' field in the message data.
-    3. Forwards the message to a source-specific topic (e.g., 'trigger-mailchimp-sync').
+    3. Takes the (user, source) sync lease, dropping duplicate requests
+       (recorded as "skipped" when the request belongs to a bulk sync job).
+       A full refresh requested while a sync runs is queued on the lease;
+       the extractor requests it again when the running sync ends.
+    4. Forwards the message to a source-specific topic (e.g., 'trigger-mailchimp-sync'),
+       with the trace attributes and the lease id as the sync id.
     """
+    with telemetry.trace(cloud_event), telemetry.span("route") as span:
+        return route_message(cloud_event, span)
+
+
+def route_message(cloud_event, span):
+    leased = False
     try:
         # Decode the incoming message
-        message_data_encoded = cloud_event.data["message"]["data"]
-        message_data_decoded = base64.b64decode(message_data_encoded).decode('utf-8')
-        data_payload = json.loads(message_data_decoded)
+        data_payload = envelope.decode_event(cloud_event)
         source = data_payload.get("source")
 
         if not source:
             print("ERROR: 'source' not found in message payload.")
             return 'Bad Request: Missing source', 400
 
+        # Coalesce duplicate requests: only one sync per (user, source) at a time.
+        # The extractor releases the lease when it finishes.
+        user_id = data_payload.get("user")
+        if user_id:
+            lease_id = cloud_event.data["message"].get("messageId") or cloud_event["id"]
+            full_refresh = bool(data_payload.get("full_refresh"))
+            suppressed = leases.try_acquire(
+                clients.firestore_client(), user_id, source, lease_id,
+                ttl_seconds=SYNC_LEASE_TTL_SECONDS,
+                cooldown_seconds=SYNC_COOLDOWN_SECONDS,
+                # An explicit backfill shouldn't be swallowed by the cooldown,
+                # nor by a sync already running: it is queued behind that one.
+                bypass_cooldown=full_refresh,
+                pending_request=data_payload if full_refresh else None,
+                # Republished with the trace and job id it arrived with.
+                pending_attributes=telemetry.message_attributes() if full_refresh else None,
+            )
+            if suppressed:
+                print(f"Suppressed duplicate '{source}' sync for user {user_id} ({suppressed}).")
+                if full_refresh:
+                    print(f"Queued the full refresh of '{source}' for user {user_id} until the running sync ends.")
+                # Raises JobUpdateError if the job can't record it, so the
+                # request is redelivered instead of stalling the job.
+                sync_jobs.finish_and_dispatch(clients.firestore_client(), sync_topic_path,
+                                              telemetry.current_job_id(), user_id, source, "skipped",
+                                              error=f"Suppressed by the router ({suppressed}).")
+                return 'Success: Duplicate sync suppressed.', 200
+            leased = True
+            data_payload["lease_id"] = lease_id
+            # Every record of this sync is tagged with the lease id as its sync id.
+            telemetry.set_sync_id(data_payload.get("sync_id") or lease_id)
+
         print(f"Routing job for source: '{source}'")
+        span.set(source=source)
 
         # Determine the target topic based on the source
         # This makes the router extensible for future sources.
         target_topic_name = f"trigger-{source}-sync"
-        topic_path = publisher.topic_path(project_id, target_topic_name)
+        topic_path = clients.topic_path(project_id, target_topic_name)
 
-        # Republish the original message to the target topic
-        future = publisher.publish(topic_path, message_data_encoded)
+        # Republish the message, now carrying the lease id, to the target topic
+        message_data, attributes = envelope.encode(data_payload)
+        future = clients.publisher_client().publish(topic_path, message_data, **attributes,
+                                                    **telemetry.message_attributes())
         message_id = future.result()
+        span.add(num_bytes=len(message_data))
 
         print(f"Message {message_id} published to {topic_path} for routing.")
         return 'Success: Job routed.', 200
 
+    except sync_jobs.JobUpdateError:
+        raise
     except Exception as e:
         print(f"Error routing Pub/Sub message: {e}")
+        # The sync was never handed to an extractor, so nothing would release its lease.
+        if leased:
+            leases.release(clients.firestore_client(), user_id, source, lease_id, start_cooldown=False)
         return 'Internal Server Error', 500
\ No newline at end of file
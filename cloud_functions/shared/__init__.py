@@ -0,0 +1,9 @@
+"""
+Code shared by several Cloud Functions.
+
+Each function is deployed from its own directory, so this package is copied
+next to the function's main.py before deploying, e.g.:
+
+    cp -r cloud_functions/shared cloud_functions/bq-loader/
+    gcloud functions deploy bq-loader --source cloud_functions/bq-loader ...
+"""
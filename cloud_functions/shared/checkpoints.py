@@ -0,0 +1,157 @@
+import datetime
+import os
+import time
+
+from shared import clients, envelope, telemetry
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# One document per (user, source), next to 'sync_leases':
+#   sync_checkpoints/{user_id}__{source} = {
+#       "sync_id": ..., "options": {"full_refresh": ..., "load_mode": ...},
+#       "resources": {"campaigns": {"status": "running" | "done", "position": ..., "publisher": {...}, ...}},
+#       "invocations": n, "updated_at": ...}
+# It is deleted once every resource of the sync has finished.
+CHECKPOINT_COLLECTION = "sync_checkpoints"
+# Progress is saved at most this often; a failed run repeats at most this much work.
+DEFAULT_INTERVAL_SECONDS = int(os.getenv("CHECKPOINT_INTERVAL_SECONDS", "30"))
+# A sync hands over to a new invocation once it has run this long. Keep it
+# well under the function timeout (540 s for event-driven functions by default).
+DEFAULT_TIME_BUDGET_SECONDS = int(os.getenv("SYNC_TIME_BUDGET_SECONDS", "420"))
+# Checkpoints older than this are ignored and the next sync starts over.
+DEFAULT_MAX_AGE_SECONDS = int(os.getenv("CHECKPOINT_MAX_AGE_SECONDS", str(24 * 60 * 60)))
+
+
+class SyncSuspended(Exception):
+    """Raised at a page boundary once a sync has used its time budget; its progress is saved."""
+
+
+def _checkpoint_ref(db, user_id, source):
+    return db.collection(CHECKPOINT_COLLECTION).document(f"{user_id}__{source}")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ===================================================================
+#           2. SYNC CHECKPOINT
+# ===================================================================
+
+class SyncCheckpoint:
+    """
+    Extraction progress of one sync, saved to Firestore as pages are published
+    so a failed, redelivered or re-triggered sync resumes where it stopped.
+
+    Extractors call commit() after publishing each page with the position to
+    resume from; finish() when a resource is complete; and clear() when the
+    whole sync is. A commit that is due waits for the publisher to deliver
+    everything handed to it (publisher.commit()) before saving, so a saved
+    position never runs ahead of the published records. A suspended
+    invocation saves the position of the last page it published, so the
+    next one publishes nothing twice; only an invocation that crashes
+    repeats the pages published since its last save.
+    """
+
+    def __init__(self, db, user_id, source, sync_id, options=None, state=None,
+                 interval_seconds=DEFAULT_INTERVAL_SECONDS, time_budget_seconds=DEFAULT_TIME_BUDGET_SECONDS):
+        self.db = db
+        self.user_id = user_id
+        self.source = source
+        self.resumed = state is not None
+        self.state = state or {"sync_id": sync_id, "options": dict(options or {}), "resources": {}, "invocations": 0}
+        self.state["invocations"] = self.state.get("invocations", 0) + 1
+        self.interval_seconds = interval_seconds
+        self.deadline = time.monotonic() + time_budget_seconds
+        self._saved_at = {}
+
+    @property
+    def sync_id(self):
+        return self.state["sync_id"]
+
+    def resource(self, name):
+        """Returns the saved state of a resource ({} if it hasn't started)."""
+        return self.state["resources"].get(name, {})
+
+    def is_done(self, name):
+        return self.resource(name).get("status") == "done"
+
+    def out_of_time(self):
+        return time.monotonic() >= self.deadline
+
+    def commit(self, name, publisher, position, **fields):
+        """
+        Records that every page up to position has been handed to publisher.
+        Saves when the resource's first commit or the interval is due, and
+        raises SyncSuspended (after saving) once the time budget is used up.
+        """
+        now = time.monotonic()
+        out_of_time = self.out_of_time()
+        saved_at = self._saved_at.get(name)
+        if not out_of_time and saved_at is not None and now - saved_at < self.interval_seconds:
+            return
+
+        self.save_progress(name, publisher, position, **fields)
+        if out_of_time:
+            raise SyncSuspended(f"Time budget used up while extracting {name}.")
+
+    def save_progress(self, name, publisher, position, **fields):
+        """Saves a resource's position and publisher state now, whether or not a commit is due."""
+        self.state["resources"][name] = dict(
+            fields, status="running", position=position, publisher=publisher.commit())
+        self.save()
+        self._saved_at[name] = time.monotonic()
+
+    def finish(self, name, **fields):
+        """Marks a resource as complete."""
+        self.state["resources"][name] = dict(fields, status="done")
+        self.save()
+
+    def save(self):
+        self.state["updated_at"] = _now()
+        _checkpoint_ref(self.db, self.user_id, self.source).set(self.state)
+
+    def clear(self):
+        """Deletes the checkpoint once the whole sync has finished."""
+        try:
+            _checkpoint_ref(self.db, self.user_id, self.source).delete()
+        except Exception as e:
+            print(f"!!! Error deleting sync checkpoint for {self.user_id}/{self.source}: {e}")
+
+
+def open_checkpoint(db, user_id, source, sync_id, options=None, max_age_seconds=DEFAULT_MAX_AGE_SECONDS, **kwargs):
+    """
+    Returns the checkpoint to run a sync with.
+    The saved checkpoint of (user_id, source) is resumed when it belongs to
+    sync_id (a chained or redelivered invocation), or when it is recent and
+    was started with the same options (a re-triggered sync takes over the
+    unfinished one, keeping its sync id). Otherwise a new checkpoint starts.
+    """
+    options = dict(options or {})
+    snapshot = _checkpoint_ref(db, user_id, source).get()
+    state = snapshot.to_dict() if snapshot.exists else None
+    if state:
+        updated_at = state.get("updated_at")
+        fresh = updated_at and updated_at + datetime.timedelta(seconds=max_age_seconds) > _now()
+        if state.get("sync_id") == sync_id or (fresh and state.get("options") == options):
+            print(f"Resuming sync {state['sync_id']} from its checkpoint "
+                  f"(invocation {state.get('invocations', 0) + 1}).")
+            return SyncCheckpoint(db, user_id, source, state["sync_id"], options, state=state, **kwargs)
+    return SyncCheckpoint(db, user_id, source, sync_id, options, **kwargs)
+
+
+# ===================================================================
+#           3. CHAINING INVOCATIONS
+# ===================================================================
+
+def continue_sync(topic_path, message):
+    """
+    Re-triggers the extractor with the same message so the sync continues
+    from its checkpoint in a fresh invocation. The trace and sync ids go
+    along as attributes.
+    """
+    data, attributes = envelope.encode(message)
+    clients.publisher_client().publish(topic_path, data, **attributes,
+                                       **telemetry.message_attributes()).result()
@@ -0,0 +1,72 @@
+import gzip
+import hashlib
+import os
+import tempfile
+
+from shared import clients, envelope, staging
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Where oversized payloads go: a "gs://bucket/prefix" URI, or a local
+# directory for tests and local runs. Defaults to a 'claims' folder under the
+# bulk staging location; with neither set, every payload stays inline.
+# Blobs are content-addressed and never deleted by the pipeline, so give the
+# bucket a lifecycle rule that removes them after a few days.
+CLAIM_CHECK_URI = os.getenv("CLAIM_CHECK_URI") or (
+    f"{staging.STAGING_URI.rstrip('/')}/claims" if staging.STAGING_URI else "")
+# Envelopes larger than this carry a reference instead of their records.
+CLAIM_CHECK_THRESHOLD_BYTES = int(os.getenv("CLAIM_CHECK_THRESHOLD_BYTES", str(1024 * 1024)))
+
+
+def is_enabled():
+    return bool(CLAIM_CHECK_URI)
+
+
+# ===================================================================
+#           2. STORE / READ
+# ===================================================================
+
+def put_records(records, base_uri=None):
+    """
+    Stores records as a gzipped NDJSON blob named after the SHA-256 of its
+    content and returns the blob's URI. Storing the same records twice (e.g.
+    a retried publish) finds the existing blob and writes nothing.
+    """
+    base_uri = (base_uri or CLAIM_CHECK_URI).rstrip("/")
+    body = b"".join(envelope.dumps(record) + b"\n" for record in records)
+    digest = hashlib.sha256(body).hexdigest()
+    uri = f"{base_uri}/{digest[:2]}/{digest}.ndjson.gz"
+    # mtime=0 keeps the compressed bytes identical for identical content.
+    data = gzip.compress(body, mtime=0)
+
+    if staging.is_gcs_uri(uri):
+        from google.api_core.exceptions import PreconditionFailed
+        bucket, path = staging.split_gcs_uri(uri)
+        try:
+            clients.storage_client().bucket(bucket).blob(path).upload_from_string(
+                data, content_type="application/gzip", if_generation_match=0)
+        except PreconditionFailed:
+            pass  # Already stored
+    elif not os.path.exists(uri):
+        os.makedirs(os.path.dirname(uri), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(uri))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, uri)
+    return uri
+
+
+def iter_records(uri):
+    """Streams the records of a stored blob back, one line at a time."""
+    if staging.is_gcs_uri(uri):
+        bucket, path = staging.split_gcs_uri(uri)
+        source = clients.storage_client().bucket(bucket).blob(path).open("rb")
+    else:
+        source = open(uri, "rb")
+
+    with source, gzip.GzipFile(fileobj=source) as lines:
+        for line in lines:
+            if line.strip():
+                yield envelope.loads(line)
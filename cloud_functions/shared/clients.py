@@ -0,0 +1,75 @@
+import threading
+
+# ===================================================================
+#           LAZY GOOGLE CLOUD CLIENTS
+# ===================================================================
+# Each client (and the library behind it) is created on first use and then
+# shared by every request the instance serves. Building clients at import
+# time makes every cold start pay for the library import and gRPC channel
+# setup, even on paths that never use the client (e.g. a 400 response).
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _get_or_create(name, create):
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = create()
+    return client
+
+
+def firestore_client():
+    """Returns the instance-wide Firestore client, creating it on first use."""
+    def create():
+        from google.cloud import firestore
+        return firestore.Client()
+    return _get_or_create("firestore", create)
+
+
+def bigquery_client():
+    """Returns the instance-wide BigQuery client, creating it on first use."""
+    def create():
+        from google.cloud import bigquery
+        return bigquery.Client()
+    return _get_or_create("bigquery", create)
+
+
+def publisher_client():
+    """Returns a PublisherClient for single messages that are sent right away."""
+    def create():
+        from google.cloud import pubsub_v1
+        return pubsub_v1.PublisherClient()
+    return _get_or_create("publisher", create)
+
+
+def batch_publisher_client():
+    """Returns a PublisherClient with the shared batch settings, for bulk publishing."""
+    def create():
+        from shared.publishing import make_publisher_client
+        return make_publisher_client()
+    return _get_or_create("batch_publisher", create)
+
+
+def secret_manager_client():
+    """Returns the instance-wide SecretManagerServiceClient, creating it on first use."""
+    def create():
+        from google.cloud import secretmanager
+        return secretmanager.SecretManagerServiceClient()
+    return _get_or_create("secret_manager", create)
+
+
+def storage_client():
+    """Returns the instance-wide Cloud Storage client, creating it on first use."""
+    def create():
+        from google.cloud import storage
+        return storage.Client()
+    return _get_or_create("storage", create)
+
+
+def topic_path(project_id, topic_name):
+    # Same string as PublisherClient.topic_path(), without creating a client.
+    return f"projects/{project_id}/topics/{topic_name}"
@@ -0,0 +1,110 @@
+import collections
+import json
+import threading
+import time
+
+from shared import clients
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_TENANTS = 256
+
+
+def get_secret_client():
+    """Returns the instance-wide SecretManagerServiceClient, creating it on first use."""
+    return clients.secret_manager_client()
+
+
+def read_json_secret(project_id, secret_name):
+    """Reads the latest version of a secret and decodes its JSON payload."""
+    secret_path = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
+    response = get_secret_client().access_secret_version(request={"name": secret_path})
+    return json.loads(response.payload.data.decode("UTF-8"))
+
+
+def is_unauthorized(error):
+    """True if an exception carries an HTTP 401 response (e.g. requests.HTTPError)."""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) == 401
+
+
+# ===================================================================
+#           2. CREDENTIAL PROVIDER
+# ===================================================================
+
+class CredentialProvider:
+    """
+    Per-tenant credential cache with a TTL and LRU eviction.
+
+    'fetch' loads a tenant's credentials from the backing store (Firestore,
+    Secret Manager, ...) and may return None when none exist; None is never
+    cached. Cached entries live for ttl_seconds, and at most max_size
+    tenants are kept, evicting the least recently used.
+    """
+
+    def __init__(self, fetch, ttl_seconds=DEFAULT_TTL_SECONDS, max_size=DEFAULT_MAX_TENANTS,
+                 clock=time.monotonic):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.clock = clock
+
+        self._entries = collections.OrderedDict()  # tenant_id -> (expires_at, credentials)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "refreshes": 0}
+
+    def get(self, tenant_id):
+        """Returns cached credentials, fetching them on a miss or after expiry."""
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry and entry[0] > self.clock():
+                self._entries.move_to_end(tenant_id)
+                self._stats["hits"] += 1
+                return entry[1]
+            if entry:
+                del self._entries[tenant_id]
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+
+        credentials = self.fetch(tenant_id)
+        if credentials is None:
+            return None
+
+        with self._lock:
+            self._entries[tenant_id] = (self.clock() + self.ttl_seconds, credentials)
+            self._entries.move_to_end(tenant_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+        return credentials
+
+    def invalidate(self, tenant_id):
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+    def call(self, tenant_id, fn):
+        """
+        Calls fn(credentials). If the provider API answers 401, the cached
+        credentials are dropped, re-fetched and fn is retried once.
+        """
+        try:
+            return fn(self.get(tenant_id))
+        except Exception as e:
+            if not is_unauthorized(e):
+                raise
+            print(f"Provider returned 401 for tenant {tenant_id}; refreshing cached credentials.")
+            self.invalidate(tenant_id)
+            with self._lock:
+                self._stats["refreshes"] += 1
+            return fn(self.get(tenant_id))
+
+    def metrics(self):
+        """Returns cache counters, e.g. for logging at the end of a run."""
+        with self._lock:
+            stats = dict(self._stats, size=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
@@ -0,0 +1,117 @@
+import base64
+import gzip
+import json
+import os
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Version 2 envelopes carry "schema_version", "user_id" and "table_name".
+# Unversioned (version 1) messages are still accepted: Constant Contact's
+# "tenant_id"/"data_type" fields are mapped onto the version 2 names.
+SCHEMA_VERSION = 2
+VERSION_FIELD = "schema_version"
+
+# Compressed message bodies are flagged with this Pub/Sub attribute.
+ENCODING_ATTRIBUTE = "content_encoding"
+# "" (off), "gzip" or "zstd". Bodies smaller than COMPRESSION_MIN_BYTES are sent as is.
+COMPRESSION = os.getenv("ENVELOPE_COMPRESSION", "")
+COMPRESSION_MIN_BYTES = int(os.getenv("ENVELOPE_COMPRESSION_MIN_BYTES", "4096"))
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, default=str, separators=(",", ":")).encode("utf-8")
+
+
+# orjson serializes several times faster than json; both produce and accept UTF-8 bytes.
+JSON_BACKENDS = {"json": (_json_dumps, json.loads)}
+try:
+    import orjson
+    JSON_BACKENDS["orjson"] = (lambda obj: orjson.dumps(obj, default=str), orjson.loads)
+except ImportError:
+    pass
+
+JSON_BACKEND = "orjson" if "orjson" in JSON_BACKENDS else "json"
+dumps, loads = JSON_BACKENDS[JSON_BACKEND]
+
+
+# ===================================================================
+#           2. COMPRESSION
+# ===================================================================
+
+_zstd = None
+
+
+def _zstandard():
+    global _zstd
+    if _zstd is None:
+        import zstandard
+        _zstd = zstandard
+    return _zstd
+
+
+def compress(data, encoding):
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "zstd":
+        return _zstandard().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise ValueError(f"Unsupported envelope compression '{encoding}'.")
+
+
+def decompress(data, encoding):
+    if not encoding:
+        return data
+    if encoding == "gzip":
+        return gzip.decompress(data)
+    if encoding == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unsupported envelope encoding '{encoding}'.")
+
+
+# ===================================================================
+#           3. ENCODE / DECODE
+# ===================================================================
+
+def encode(payload, compression=None):
+    """
+    Serializes a message payload for publishing, stamped with the schema version.
+    Returns (data, attributes); pass both to PublisherClient.publish(topic, data, **attributes).
+    """
+    compression = COMPRESSION if compression is None else compression
+    data = dumps(dict(payload, **{VERSION_FIELD: SCHEMA_VERSION}))
+    if not compression or len(data) < COMPRESSION_MIN_BYTES:
+        return data, {}
+    return compress(data, compression), {ENCODING_ATTRIBUTE: compression}
+
+
+def normalize(payload):
+    """Maps older message schemas onto the current field names."""
+    if payload.get(VERSION_FIELD, 1) > SCHEMA_VERSION:
+        print(f"!!! Message schema version {payload[VERSION_FIELD]} is newer than {SCHEMA_VERSION}; "
+              f"reading the fields this version knows.")
+    if "user_id" not in payload and "tenant_id" in payload:
+        payload["user_id"] = payload["tenant_id"]
+    if "table_name" not in payload and payload.get("data_type"):
+        source = (payload.get("source") or "").replace("-", "_")
+        payload["table_name"] = f"{source}_{payload['data_type']}" if source else payload["data_type"]
+    return payload
+
+
+def decode(data, attributes=None):
+    """Parses a message body (bytes, as published) into a normalized payload dict."""
+    encoding = (attributes or {}).get(ENCODING_ATTRIBUTE)
+    return normalize(loads(decompress(data, encoding)))
+
+
+def read_event(cloud_event):
+    """Returns (body bytes, attributes) of the Pub/Sub message in a CloudEvent."""
+    message = cloud_event.data["message"]
+    return base64.b64decode(message["data"]), message.get("attributes") or {}
+
+
+def decode_event(cloud_event):
+    """Decodes the Pub/Sub message that triggered a function."""
+    return decode(*read_event(cloud_event))
@@ -0,0 +1,279 @@
+import bisect
+import collections
+import email.utils
+import hashlib
+import random
+import re
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+POOL_MAXSIZE = 20
+DEFAULT_TIMEOUT_SECONDS = 30
+
+# --- Retries ---
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Requests that may change state are only retried when the provider
+# explicitly rejected them without processing them.
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+NON_IDEMPOTENT_RETRY_STATUSES = {429}
+# Total time one request may spend waiting between attempts; a Retry-After
+# longer than what is left is cut short, and no retry starts once it is spent.
+RETRY_BUDGET_SECONDS = 120
+
+# --- Per-tenant limits, by API host suffix ---
+# max_concurrent: simultaneous connections; rate/burst: token bucket in requests per second.
+# Mailchimp allows 10 simultaneous connections per account; Constant Contact 4 requests/second.
+HOST_LIMITS = {
+    "api.mailchimp.com": {"max_concurrent": 10, "rate": 10.0, "burst": 10},
+    "api.cc.email": {"max_concurrent": 4, "rate": 4.0, "burst": 4},
+}
+
+# --- Latency histogram bucket upper bounds, in milliseconds ---
+LATENCY_BUCKETS_MS = [25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float("inf")]
+
+# --- Limiters kept per instance, least recently used evicted first ---
+MAX_LIMITERS = 1024
+
+
+# ===================================================================
+#           2. RATE LIMITING
+# ===================================================================
+
+class TokenBucket:
+    """Classic token bucket: 'rate' tokens per second, holding at most 'burst'."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = float(burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class TenantLimiter:
+    """A connection semaphore plus a token bucket for one tenant on one API."""
+
+    def __init__(self, max_concurrent, rate, burst):
+        self.semaphore = threading.BoundedSemaphore(max_concurrent)
+        self.bucket = TokenBucket(rate, burst)
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        self.bucket.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.semaphore.release()
+        return False
+
+
+_limiters = collections.OrderedDict()  # (host, tenant) -> TenantLimiter
+_limiters_lock = threading.Lock()
+
+
+def _limits_for(host):
+    for suffix, limits in HOST_LIMITS.items():
+        if host == suffix or host.endswith("." + suffix):
+            return limits
+    return None
+
+
+def _limiter(host, tenant):
+    limits = _limits_for(host)
+    if not limits:
+        return None
+    key = (host, tenant)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = TenantLimiter(**limits)
+            # Requests still holding an evicted limiter finish with it; the
+            # tenant's next request starts a fresh one.
+            while len(_limiters) > MAX_LIMITERS:
+                _limiters.popitem(last=False)
+        _limiters.move_to_end(key)
+        return limiter
+
+
+def _tenant_key(headers):
+    # Without an explicit tenant, the access token identifies the account.
+    auth = (headers or {}).get("Authorization", "")
+    return hashlib.sha256(auth.encode("utf-8")).hexdigest()[:16] if auth else None
+
+
+# ===================================================================
+#           3. LATENCY HISTOGRAMS
+# ===================================================================
+
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+# Path segments that identify a record (ids, hashes) are folded into one label;
+# short ones such as '3.0' or 'v3' are API versions and stay as they are.
+_ID_SEGMENT = re.compile(r"^\d+$|^(?=.*\d)[\w.-]{6,}$")
+
+
+def endpoint_label(method, url):
+    """Builds a low-cardinality label such as 'GET us1.api.mailchimp.com/3.0/reports/{id}'."""
+    parsed = urlparse(url)
+    segments = ["{id}" if _ID_SEGMENT.match(s) else s for s in parsed.path.split("/")]
+    return f"{method} {parsed.netloc}{'/'.join(segments)}"
+
+
+def _observe(endpoint, elapsed_ms):
+    with _histograms_lock:
+        histogram = _histograms.setdefault(endpoint, {
+            "counts": [0] * len(LATENCY_BUCKETS_MS), "count": 0, "sum_ms": 0.0,
+        })
+        histogram["counts"][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        histogram["count"] += 1
+        histogram["sum_ms"] += elapsed_ms
+
+
+def _bucket_label(bound):
+    return "+Inf" if bound == float("inf") else f"<={bound}ms"
+
+
+def latency_histograms():
+    """Returns {endpoint: {"buckets": {"<=25ms": n, ...}, "count": n, "sum_ms": x}}."""
+    with _histograms_lock:
+        return {
+            endpoint: {
+                "buckets": {_bucket_label(bound): n for bound, n in zip(LATENCY_BUCKETS_MS, h["counts"])},
+                "count": h["count"],
+                "sum_ms": round(h["sum_ms"], 1),
+            }
+            for endpoint, h in _histograms.items()
+        }
+
+
+def print_latency_summary():
+    for endpoint, histogram in sorted(latency_histograms().items()):
+        mean = histogram["sum_ms"] / histogram["count"] if histogram["count"] else 0
+        print(f"HTTP {endpoint}: {histogram['count']} calls, mean {mean:.0f} ms, "
+              f"buckets {histogram['buckets']}")
+
+
+# ===================================================================
+#           4. SESSION AND REQUESTS
+# ===================================================================
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the instance-wide keep-alive session, creating it on first use."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=10, pool_maxsize=POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _retry_after_seconds(response):
+    """Parses a Retry-After header given either in seconds or as an HTTP date."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_seconds(attempt):
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def request(method, url, tenant=None, max_retries=MAX_RETRIES, retry_budget=RETRY_BUDGET_SECONDS, **kwargs):
+    """
+    Sends a request through the shared session and returns the response.
+    1. Waits for the tenant's connection slot and rate-limit token.
+    2. Retries 429/5xx responses and connection errors with exponential
+       backoff and jitter, honouring Retry-After when the provider sends it,
+       for at most retry_budget seconds of waiting in total.
+    3. Records the call's latency in the endpoint's histogram.
+
+    Like requests.request, it does not raise for HTTP error statuses; call
+    raise_for_status() on the result.
+    """
+    method = method.upper()
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT_SECONDS)
+    host = urlparse(url).hostname or ""
+    limiter = _limiter(host, tenant or _tenant_key(kwargs.get("headers")))
+    label = endpoint_label(method, url)
+    retry_statuses = RETRY_STATUSES if method in IDEMPOTENT_METHODS else NON_IDEMPOTENT_RETRY_STATUSES
+
+    attempt = 0
+    retry_deadline = time.monotonic() + retry_budget
+    while True:
+        started = time.perf_counter()
+        try:
+            if limiter:
+                with limiter:
+                    response = get_session().request(method, url, **kwargs)
+            else:
+                response = get_session().request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            _observe(label, (time.perf_counter() - started) * 1000)
+            remaining = retry_deadline - time.monotonic()
+            if attempt >= max_retries or method not in IDEMPOTENT_METHODS or remaining <= 0:
+                raise
+            delay = min(_backoff_seconds(attempt), remaining)
+            print(f"HTTP {label} failed ({e}); retrying in {delay:.1f}s")
+        else:
+            _observe(label, (time.perf_counter() - started) * 1000)
+            remaining = retry_deadline - time.monotonic()
+            if response.status_code not in retry_statuses or attempt >= max_retries or remaining <= 0:
+                return response
+            retry_after = _retry_after_seconds(response)
+            delay = min(retry_after if retry_after is not None else _backoff_seconds(attempt), remaining)
+            print(f"HTTP {label} returned {response.status_code}; retrying in {delay:.1f}s")
+            response.close()
+
+        attempt += 1
+        time.sleep(delay)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
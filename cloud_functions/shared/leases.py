@@ -0,0 +1,145 @@
+import datetime
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# One document per (user, source):
+#   sync_leases/{user_id}__{source} = {"status": "running" | "released", "lease_id": ...,
+#                                      "pending_request": {...} | None,
+#                                      "pending_attributes": {...} | None, ...}
+LEASE_COLLECTION = "sync_leases"
+# A lease that is never released (crashed extractor) stops blocking after this long.
+DEFAULT_LEASE_TTL_SECONDS = 60 * 60
+# Requests arriving this soon after a sync finished are treated as duplicates.
+DEFAULT_COOLDOWN_SECONDS = 60
+
+
+def _lease_ref(db, user_id, source):
+    return db.collection(LEASE_COLLECTION).document(f"{user_id}__{source}")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+# ===================================================================
+#           2. ACQUIRE / RELEASE / RENEW
+# ===================================================================
+
+def _acquire_in_transaction(transaction, lease_ref, lease_id, ttl_seconds, cooldown_seconds, bypass_cooldown,
+                            pending_request, pending_attributes):
+    snapshot = lease_ref.get(transaction=transaction)
+    lease = snapshot.to_dict() if snapshot.exists else {}
+    now = _now()
+
+    if lease.get("status") == "running" and lease.get("expires_at") and lease["expires_at"] > now:
+        if pending_request:
+            transaction.set(lease_ref, {"pending_request": pending_request,
+                                        "pending_attributes": dict(pending_attributes or {})}, merge=True)
+        return "in_flight"
+    if (not bypass_cooldown and lease.get("status") == "released" and lease.get("released_at")
+            and lease["released_at"] + datetime.timedelta(seconds=cooldown_seconds) > now):
+        return "cooldown"
+
+    transaction.set(lease_ref, {
+        "status": "running",
+        "lease_id": lease_id,
+        "acquired_at": now,
+        "expires_at": now + datetime.timedelta(seconds=ttl_seconds),
+    }, merge=True)
+    return None
+
+
+def try_acquire(db, user_id, source, lease_id, ttl_seconds=DEFAULT_LEASE_TTL_SECONDS,
+                cooldown_seconds=DEFAULT_COOLDOWN_SECONDS, bypass_cooldown=False, pending_request=None,
+                pending_attributes=None):
+    """
+    Takes the sync lease for (user_id, source) unless a sync is already in
+    flight or finished less than cooldown_seconds ago.
+
+    Returns None when the lease was acquired, otherwise the reason the
+    request was suppressed ("in_flight" or "cooldown"). Suppressed requests
+    are counted on the lease document. A pending_request suppressed because
+    a sync is in flight is kept on the lease (the latest one wins), with the
+    pending_attributes (e.g. telemetry.message_attributes()) to publish it
+    with, and handed back by release() when that sync ends.
+    """
+    # Imported on use so importing this module doesn't load the Firestore library.
+    from google.cloud import firestore
+    lease_ref = _lease_ref(db, user_id, source)
+    acquire = firestore.transactional(_acquire_in_transaction)
+    reason = acquire(db.transaction(), lease_ref, lease_id, ttl_seconds, cooldown_seconds, bypass_cooldown,
+                     pending_request, pending_attributes)
+    if reason:
+        lease_ref.set({
+            "suppressed_count": firestore.Increment(1),
+            f"suppressed_{reason}_count": firestore.Increment(1),
+            "last_suppressed_at": firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+    return reason
+
+
+def _release_in_transaction(transaction, lease_ref, lease_id, start_cooldown):
+    snapshot = lease_ref.get(transaction=transaction)
+    lease = snapshot.to_dict() if snapshot.exists else {}
+    # A stale extractor must not release a lease a newer sync has taken over.
+    if lease.get("lease_id") != lease_id:
+        return None
+    if not start_cooldown:
+        # The sync never ran: a retry may take the lease right away, and a
+        # queued request waits for the sync that does.
+        transaction.set(lease_ref, {"status": "released"}, merge=True)
+        return None
+    transaction.set(lease_ref, {"status": "released", "released_at": _now(), "pending_request": None,
+                                "pending_attributes": None}, merge=True)
+    if not lease.get("pending_request"):
+        return None
+    return lease["pending_request"], lease.get("pending_attributes") or {}
+
+
+def release(db, user_id, source, lease_id, start_cooldown=True):
+    """
+    Releases the sync lease for (user_id, source) once the extractor has
+    finished, or with start_cooldown=False when the sync never started.
+    Returns (request, attributes) for the request queued while the lease was
+    held (see try_acquire()), which the caller should publish again with
+    those attributes, or None.
+    Runs started without a lease (lease_id None) have nothing to release.
+    Errors are only logged: a lease that can't be released expires after its TTL.
+    """
+    if not lease_id:
+        return None
+    try:
+        from google.cloud import firestore
+        release_lease = firestore.transactional(_release_in_transaction)
+        return release_lease(db.transaction(), _lease_ref(db, user_id, source), lease_id, start_cooldown)
+    except Exception as e:
+        print(f"!!! Error releasing sync lease for {user_id}/{source}: {e}")
+        return None
+
+
+def _renew_in_transaction(transaction, lease_ref, lease_id, ttl_seconds):
+    snapshot = lease_ref.get(transaction=transaction)
+    lease = snapshot.to_dict() if snapshot.exists else {}
+    if lease.get("lease_id") != lease_id or lease.get("status") != "running":
+        return False
+    transaction.set(lease_ref, {"expires_at": _now() + datetime.timedelta(seconds=ttl_seconds)}, merge=True)
+    return True
+
+
+def renew(db, user_id, source, lease_id, ttl_seconds=DEFAULT_LEASE_TTL_SECONDS):
+    """
+    Extends a running sync's lease by ttl_seconds, e.g. before a long sync
+    hands over to its next invocation. Returns False if the lease is no
+    longer held by lease_id.
+    """
+    if not lease_id:
+        return False
+    try:
+        from google.cloud import firestore
+        renew_lease = firestore.transactional(_renew_in_transaction)
+        return renew_lease(db.transaction(), _lease_ref(db, user_id, source), lease_id, ttl_seconds)
+    except Exception as e:
+        print(f"!!! Error renewing sync lease for {user_id}/{source}: {e}")
+        return False
@@ -0,0 +1,57 @@
+import datetime
+
+from shared import envelope
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# One document per sync an HTTP handler hands off without waiting on Pub/Sub:
+#   pending_syncs/{user_id}__{source} = {"request": {"source": ..., "user": ...},
+#                                        "attributes": {...}, "created_at": ...}
+# oauth/initial-sync publishes the request when the document is created and
+# then deletes it.
+PENDING_SYNC_COLLECTION = "pending_syncs"
+
+
+def pending_sync_ref(db, user_id, source):
+    return db.collection(PENDING_SYNC_COLLECTION).document(f"{user_id}__{source}")
+
+
+# ===================================================================
+#           2. QUEUE / PUBLISH
+# ===================================================================
+
+def queue_sync(db, user_id, source, attributes=None, batch=None):
+    """
+    Records a sync request to be published by oauth/initial-sync.
+    attributes (e.g. telemetry.message_attributes()) go on the published
+    message. With batch, the write is added to it instead of committed.
+    """
+    ref = pending_sync_ref(db, user_id, source)
+    data = {
+        "request": {"source": source, "user": user_id},
+        "attributes": dict(attributes or {}),
+        "created_at": datetime.datetime.now(datetime.timezone.utc),
+    }
+    if batch is not None:
+        batch.set(ref, data)
+    else:
+        ref.set(data)
+
+
+def publish_pending(db, publisher, topic_path, doc_id):
+    """
+    Publishes the pending sync request doc_id, waits for Pub/Sub to accept
+    it and deletes the document. Returns the request, or None if it was
+    already published.
+    """
+    ref = db.collection(PENDING_SYNC_COLLECTION).document(doc_id)
+    snapshot = ref.get()
+    if not snapshot.exists:
+        return None
+    pending = snapshot.to_dict()
+    data, attributes = envelope.encode(pending["request"])
+    publisher.publish(topic_path, data, **attributes, **(pending.get("attributes") or {})).result()
+    ref.delete()
+    return pending["request"]
@@ -0,0 +1,160 @@
+import collections
+
+from shared import envelope
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Client-side batching: the Pub/Sub client groups publish() calls into one
+# request instead of sending each message on its own.
+BATCH_SETTINGS = dict(
+    max_messages=100,
+    max_bytes=9 * 1024 * 1024,
+    max_latency=0.05,
+)
+
+# Envelope limits stay well under Pub/Sub's 10 MB message limit.
+DEFAULT_RECORDS_PER_MESSAGE = 500
+DEFAULT_MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_IN_FLIGHT = 100
+
+
+def make_publisher_client():
+    """Creates a PublisherClient that uses the shared batch settings."""
+    # Imported here so modules using the publishers don't load Pub/Sub until they publish.
+    from google.cloud import pubsub_v1
+    return pubsub_v1.PublisherClient(batch_settings=pubsub_v1.types.BatchSettings(**BATCH_SETTINGS))
+
+
+def open_publisher(client, topic_path, metadata, load_mode="stream", sync_id=None, attributes=None,
+                   resume=None):
+    """
+    Returns the record publisher for a load mode:
+    "stream" sends records inline in envelopes for streaming inserts;
+    "bulk" stages them as files for a single BigQuery load job.
+    attributes are set on every message published (e.g. the trace ids).
+    resume is a state returned by the publisher's commit() in an earlier
+    invocation of the same sync (see shared/checkpoints.py).
+    """
+    if load_mode == "bulk":
+        from shared.staging import STAGING_FORMAT, STAGING_URI, StagedPublisher
+        return StagedPublisher(client, topic_path, metadata, STAGING_URI, sync_id,
+                               file_format=STAGING_FORMAT, attributes=attributes, resume=resume)
+    from shared import claim_check
+    return EnvelopePublisher(client, topic_path, metadata, attributes=attributes,
+                             claim_check_uri=claim_check.CLAIM_CHECK_URI,
+                             claim_check_threshold=claim_check.CLAIM_CHECK_THRESHOLD_BYTES,
+                             resume=resume)
+
+
+# ===================================================================
+#           2. ENVELOPE PUBLISHER
+# ===================================================================
+
+class EnvelopePublisher:
+    """
+    Packs records into envelope messages and publishes them without blocking.
+
+    Every envelope carries the given metadata plus a "records" list, encoded
+    by shared/envelope.py (schema version stamped, optionally compressed):
+        {"source": ..., "user_id": ..., "table_name": ..., "records": [...], "schema_version": 2}
+
+    At most max_in_flight publishes are outstanding at a time; close() waits
+    for the rest and raises if any publish failed.
+
+    With a claim_check_uri, an envelope larger than claim_check_threshold
+    bytes is stored there (shared/claim_check.py) and the message carries a
+    reference to it instead of the records:
+        {"source": ..., "user_id": ..., "table_name": ..., "payload_ref": "gs://...", "record_count": n}
+    """
+
+    def __init__(self, client, topic_path, metadata,
+                 records_per_message=DEFAULT_RECORDS_PER_MESSAGE,
+                 max_message_bytes=DEFAULT_MAX_MESSAGE_BYTES,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, attributes=None,
+                 claim_check_uri=None, claim_check_threshold=None, resume=None):
+        self.client = client
+        self.topic_path = topic_path
+        self.metadata = dict(metadata)
+        self.attributes = dict(attributes or {})
+        self.records_per_message = records_per_message
+        self.max_message_bytes = max_message_bytes
+        self.max_in_flight = max_in_flight
+        self.claim_check_uri = claim_check_uri
+        self.claim_check_threshold = claim_check_threshold
+
+        # Counts carry on from an earlier invocation of the same sync.
+        resume = resume or {}
+        self.records_published = resume.get("records_published", 0)
+        self.messages_published = resume.get("messages_published", 0)
+        self.bytes_published = 0
+        self.payloads_referenced = 0
+        self._records = []
+        self._bytes = 0
+        self._in_flight = collections.deque()
+
+    def publish(self, record):
+        """Adds one record to the current envelope, sending it once full."""
+        record_bytes = len(envelope.dumps(record))
+        if self._records and self._bytes + record_bytes > self.max_message_bytes:
+            self.flush_envelope()
+
+        self._records.append(record)
+        self._bytes += record_bytes
+
+        if len(self._records) >= self.records_per_message:
+            self.flush_envelope()
+
+    def publish_many(self, records):
+        for record in records:
+            self.publish(record)
+
+    def flush_envelope(self):
+        """Publishes the current envelope, if it holds any records."""
+        if not self._records:
+            return
+
+        # Keep the window of unacknowledged publishes bounded.
+        while len(self._in_flight) >= self.max_in_flight:
+            self._in_flight.popleft().result()
+
+        message_data, attributes = envelope.encode(dict(self.metadata, records=self._records))
+        if self.claim_check_uri and len(message_data) > self.claim_check_threshold:
+            from shared import claim_check
+            payload_ref = claim_check.put_records(self._records, self.claim_check_uri)
+            message_data, attributes = envelope.encode(
+                dict(self.metadata, payload_ref=payload_ref, record_count=len(self._records)))
+            self.payloads_referenced += 1
+        self._in_flight.append(self.client.publish(self.topic_path, message_data,
+                                                   **self.attributes, **attributes))
+
+        self.records_published += len(self._records)
+        self.messages_published += 1
+        self.bytes_published += len(message_data)
+        self._records = []
+        self._bytes = 0
+
+    def commit(self):
+        """
+        Sends the current envelope and waits until every record handed over
+        so far is published. Returns the state to resume from.
+        """
+        self.flush_envelope()
+        while self._in_flight:
+            self._in_flight.popleft().result()
+        return {"records_published": self.records_published, "messages_published": self.messages_published}
+
+    def close(self):
+        """Sends the last envelope and waits for every outstanding publish."""
+        self.commit()
+        return self.records_published
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        return False
+
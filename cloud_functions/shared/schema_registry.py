@@ -0,0 +1,219 @@
+import copy
+import datetime
+import hashlib
+import json
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Unregistered fields of a record are kept here as a JSON document.
+OVERFLOW_COLUMN = "extra_fields"
+
+# Columns every registered table carries, filled from the message metadata.
+# synced_at is stamped when the record is flattened if the metadata has none.
+METADATA_COLUMNS = [
+    ("user_id", "STRING"),
+    ("source", "STRING"),
+    ("sync_id", "STRING"),
+    ("synced_at", "TIMESTAMP"),
+]
+
+# Per table: (column name, BigQuery type, dotted path in the provider record).
+REGISTRY = {
+    "mailchimp_campaigns": [
+        ("campaign_id", "STRING", "id"),
+        ("web_id", "INTEGER", "web_id"),
+        ("type", "STRING", "type"),
+        ("status", "STRING", "status"),
+        ("create_time", "TIMESTAMP", "create_time"),
+        ("send_time", "TIMESTAMP", "send_time"),
+        ("emails_sent", "INTEGER", "emails_sent"),
+        ("list_id", "STRING", "recipients.list_id"),
+        ("recipient_count", "INTEGER", "recipients.recipient_count"),
+        ("subject_line", "STRING", "settings.subject_line"),
+        ("preview_text", "STRING", "settings.preview_text"),
+        ("title", "STRING", "settings.title"),
+        ("from_name", "STRING", "settings.from_name"),
+        ("opens", "INTEGER", "report_summary.opens"),
+        ("unique_opens", "INTEGER", "report_summary.unique_opens"),
+        ("open_rate", "FLOAT", "report_summary.open_rate"),
+        ("clicks", "INTEGER", "report_summary.clicks"),
+        ("subscriber_clicks", "INTEGER", "report_summary.subscriber_clicks"),
+        ("click_rate", "FLOAT", "report_summary.click_rate"),
+    ],
+    "mailchimp_reports": [
+        ("campaign_id", "STRING", "id"),
+        ("list_id", "STRING", "list_id"),
+        ("subject_line", "STRING", "subject_line"),
+        ("send_time", "TIMESTAMP", "send_time"),
+        ("emails_sent", "INTEGER", "emails_sent"),
+        ("opens", "INTEGER", "opens.opens_total"),
+        ("unique_opens", "INTEGER", "opens.unique_opens"),
+        ("open_rate", "FLOAT", "opens.open_rate"),
+        ("last_open", "TIMESTAMP", "opens.last_open"),
+        ("clicks", "INTEGER", "clicks.clicks_total"),
+        ("unique_clicks", "INTEGER", "clicks.unique_clicks"),
+        ("click_rate", "FLOAT", "clicks.click_rate"),
+        ("hard_bounces", "INTEGER", "bounces.hard_bounces"),
+        ("soft_bounces", "INTEGER", "bounces.soft_bounces"),
+        ("unsubscribed", "INTEGER", "unsubscribed"),
+        ("abuse_reports", "INTEGER", "abuse_reports"),
+    ],
+    "mailchimp_members": [
+        ("member_id", "STRING", "id"),
+        ("email_address", "STRING", "email_address"),
+        ("list_id", "STRING", "list_id"),
+        ("status", "STRING", "status"),
+        ("member_rating", "INTEGER", "member_rating"),
+        ("timestamp_opt", "TIMESTAMP", "timestamp_opt"),
+        ("last_changed", "TIMESTAMP", "last_changed"),
+        ("avg_open_rate", "FLOAT", "stats.avg_open_rate"),
+        ("avg_click_rate", "FLOAT", "stats.avg_click_rate"),
+    ],
+}
+
+# Per table: (columns identifying a record within a tenant, column holding its
+# version). They drive deterministic insert IDs and upsert MERGE keys; the
+# MERGE keeps the highest version, then the latest synced_at.
+ROW_KEYS = {
+    "mailchimp_campaigns": (["campaign_id"], None),
+    "mailchimp_reports": (["campaign_id"], None),
+    "mailchimp_members": (["list_id", "member_id"], "last_changed"),
+}
+
+# Per table: (partitioning column, partition granularity, clustering columns).
+# Analytics queries filter by tenant and send/update date, so tables are
+# partitioned on that date and clustered by tenant.
+TABLE_LAYOUTS = {
+    "mailchimp_campaigns": ("send_time", "MONTH", ["user_id", "campaign_id"]),
+    "mailchimp_reports": ("send_time", "MONTH", ["user_id", "campaign_id"]),
+    "mailchimp_members": ("last_changed", "MONTH", ["user_id", "list_id"]),
+}
+
+# Unregistered tables: the first of these fields present in the record is used.
+FALLBACK_ID_FIELDS = ("id", "contact_id", "campaign_id")
+FALLBACK_VERSION_FIELDS = ("last_changed", "updated_at")
+
+
+def is_registered(table_name):
+    return table_name in REGISTRY
+
+
+def columns(table_name):
+    """Returns [(name, type)] for every column of a registered table, overflow column last."""
+    return (METADATA_COLUMNS
+            + [(name, bq_type) for name, bq_type, _ in REGISTRY[table_name]]
+            + [(OVERFLOW_COLUMN, "JSON")])
+
+
+# ===================================================================
+#           2. FLATTENING
+# ===================================================================
+
+def _get_path(record, path):
+    value = record
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _pop_path(record, path):
+    """Removes a dotted path from a nested dict, pruning parents left empty."""
+    keys = path.split(".")
+    parents = []
+    node = record
+    for key in keys[:-1]:
+        if not isinstance(node.get(key), dict):
+            return
+        parents.append((node, key))
+        node = node[key]
+    node.pop(keys[-1], None)
+    for parent, key in reversed(parents):
+        if parent[key]:
+            break
+        del parent[key]
+
+
+def _coerce(value, bq_type):
+    # Mailchimp sends "" for unset timestamps such as an unsent campaign's send_time.
+    if value is None or value == "":
+        return None
+    if bq_type == "INTEGER":
+        return int(value)
+    if bq_type == "FLOAT":
+        return float(value)
+    if bq_type == "BOOLEAN":
+        return bool(value)
+    if bq_type == "STRING" and not isinstance(value, str):
+        return json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+    return value
+
+
+def flatten(table_name, record, metadata=None, encode_overflow=True):
+    """
+    Maps a provider record onto the table's typed columns.
+    Registered fields become columns; everything else is kept in the
+    OVERFLOW_COLUMN as JSON. Records of unregistered tables pass through as-is.
+
+    Streaming inserts and Parquet files take a JSON column as a string, so the
+    overflow is encoded by default; with encode_overflow=False it stays a
+    dict, which an NDJSON load job stores as a JSON object (a string would be
+    stored as a JSON string scalar).
+    """
+    if table_name not in REGISTRY:
+        return record
+
+    metadata = metadata or {}
+    row = {name: metadata.get(name) for name, _ in METADATA_COLUMNS}
+    row["synced_at"] = row["synced_at"] or datetime.datetime.now(datetime.timezone.utc).isoformat()
+    overflow = copy.deepcopy(record)
+    for name, bq_type, path in REGISTRY[table_name]:
+        try:
+            row[name] = _coerce(_get_path(record, path), bq_type)
+        except (TypeError, ValueError):
+            row[name] = None  # An untypable value stays available in the overflow column.
+            continue
+        _pop_path(overflow, path)
+
+    if not overflow:
+        row[OVERFLOW_COLUMN] = None
+    else:
+        row[OVERFLOW_COLUMN] = json.dumps(overflow, default=str) if encode_overflow else overflow
+    return row
+
+
+# ===================================================================
+#           3. ROW IDENTITY
+# ===================================================================
+
+def _first_present(row, fields):
+    return next((row[field] for field in fields if row.get(field) not in (None, "")), None)
+
+
+def row_id(table_name, row, metadata=None):
+    """
+    Returns a deterministic insert ID for a (flattened) row:
+        sha256(tenant | source | record id | version)
+    so a redelivered message or a re-run sync produces the same IDs and
+    BigQuery drops the duplicates. Returns None if the row has no record id.
+    """
+    metadata = metadata or {}
+    tenant = metadata.get("user_id") or metadata.get("tenant_id")
+
+    if table_name in ROW_KEYS:
+        key_columns, version_column = ROW_KEYS[table_name]
+        record_id = [row.get(column) for column in key_columns]
+        version = row.get(version_column) if version_column else None
+    else:
+        record_id = [_first_present(row, FALLBACK_ID_FIELDS)]
+        version = _first_present(row, FALLBACK_VERSION_FIELDS)
+
+    if any(part in (None, "") for part in record_id):
+        return None
+
+    parts = [tenant, metadata.get("source"), *record_id, version]
+    key = "|".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
@@ -0,0 +1,225 @@
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+from shared import clients, envelope, schema_registry
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# Where staged files go: a "gs://bucket/prefix" URI in production, or a
+# local directory (e.g. for tests and local runs).
+STAGING_URI = os.getenv("STAGING_URI", "")
+STAGING_FORMAT = os.getenv("STAGING_FORMAT", "ndjson")
+DEFAULT_ROWS_PER_FILE = 100_000
+FILE_FORMATS = {"ndjson": ".ndjson.gz", "parquet": ".parquet"}
+
+
+def is_gcs_uri(uri):
+    return uri.startswith("gs://")
+
+
+def split_gcs_uri(uri):
+    bucket, _, path = uri[len("gs://"):].partition("/")
+    return bucket, path
+
+
+# ===================================================================
+#           2. WRITING STAGED FILES
+# ===================================================================
+
+def _parse_timestamp(value):
+    """An ISO 8601 string as an aware datetime (UTC if it has no offset); None if unparseable."""
+    if not isinstance(value, str):
+        return value
+    try:
+        parsed = datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+def _arrow_schema(pa, table_name):
+    """The Arrow schema of a registered table's columns; None lets pyarrow infer one."""
+    if not schema_registry.is_registered(table_name):
+        return None
+    arrow_types = {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "FLOAT": pa.float64(),
+        "BOOLEAN": pa.bool_(),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+        # Written with Parquet's JSON logical type, which BigQuery loads into JSON columns.
+        "JSON": pa.json_(pa.string()),
+    }
+    return pa.schema([(name, arrow_types[bq_type]) for name, bq_type in schema_registry.columns(table_name)])
+
+
+def _write_parquet(path, records, table_name):
+    """
+    Writes records to a Parquet file. Registered tables' rows are written
+    with their column types, so a load job can put them into TIMESTAMP and
+    JSON columns; flattened rows hold timestamps as ISO strings.
+    """
+    # pyarrow is only needed when Parquet staging is actually used.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(pa, table_name)
+    if schema is not None:
+        timestamps = [field.name for field in schema if pa.types.is_timestamp(field.type)]
+        records = [dict(record, **{name: _parse_timestamp(record.get(name)) for name in timestamps})
+                   for record in records]
+    pq.write_table(pa.Table.from_pylist(records, schema=schema), path, compression="zstd")
+
+
+def _store(local_path, uri):
+    """Moves a finished local file to its staging URI."""
+    if is_gcs_uri(uri):
+        bucket, path = split_gcs_uri(uri)
+        clients.storage_client().bucket(bucket).blob(path).upload_from_filename(local_path)
+        os.remove(local_path)
+    else:
+        os.makedirs(os.path.dirname(uri), exist_ok=True)
+        shutil.move(local_path, uri)
+
+
+class StagedPublisher:
+    """
+    Bulk-load alternative to EnvelopePublisher with the same interface.
+
+    Records are written to compressed newline-delimited JSON (or Parquet)
+    files under staging_uri. close() uploads the last file and publishes a
+    single manifest message listing every file, so the loader can run one
+    BigQuery load job per table per sync. The listed files are then dropped
+    from the resume state, so a sync that carries on after a close (e.g.
+    after a failed fetch) only lists the files it stages from then on:
+        {..metadata.., "load_mode": "bulk", "file_format": "ndjson", "uris": [...], "sync_id": ...}
+
+    Records of tables in the schema registry are written already flattened,
+    since the load job hands the files to BigQuery untouched.
+    """
+
+    def __init__(self, client, topic_path, metadata, staging_uri, sync_id,
+                 file_format="ndjson", rows_per_file=DEFAULT_ROWS_PER_FILE, attributes=None, resume=None):
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f"Unsupported staging format '{file_format}'.")
+        if not staging_uri:
+            raise ValueError("Bulk loads need a staging URI (set STAGING_URI).")
+
+        self.client = client
+        self.topic_path = topic_path
+        self.metadata = dict(metadata)
+        self.attributes = dict(attributes or {})
+        self.sync_id = sync_id
+        self.file_format = file_format
+        self.rows_per_file = rows_per_file
+        tenant = metadata.get("user_id") or metadata.get("tenant_id") or "unknown"
+        self.table_name = metadata.get("table_name") or metadata.get("data_type") or "unknown"
+        self.prefix = "/".join([staging_uri.rstrip("/"), metadata.get("source", "unknown"),
+                                str(tenant), self.table_name, sync_id])
+
+        # A resumed sync keeps the files staged by its earlier invocations.
+        resume = resume or {}
+        self.records_published = resume.get("records_published", 0)
+        self.messages_published = 0
+        self.bytes_published = 0
+        self.uris = list(resume.get("uris", []))  # staged, not in a published manifest yet
+        self.files_written = resume.get("files_written", len(self.uris))
+        self.records_in_manifests = resume.get("records_in_manifests", 0)
+        self._file = None
+        self._local_path = None
+        self._parquet_rows = []
+        self._rows_in_file = 0
+
+    def publish(self, record):
+        if self._rows_in_file == 0:
+            self._open_file()
+
+        # NDJSON rows keep the overflow as an object for the load job's JSON column.
+        record = schema_registry.flatten(self.table_name, record, self.metadata,
+                                         encode_overflow=self.file_format != "ndjson")
+
+        if self.file_format == "ndjson":
+            self._file.write(envelope.dumps(record) + b"\n")
+        else:
+            self._parquet_rows.append(record)
+
+        self._rows_in_file += 1
+        self.records_published += 1
+        if self._rows_in_file >= self.rows_per_file:
+            self._close_file()
+
+    def publish_many(self, records):
+        for record in records:
+            self.publish(record)
+
+    def commit(self):
+        """Stores the current file early; returns the state to resume from."""
+        if self._rows_in_file:
+            self._close_file()
+        return {"records_published": self.records_published, "uris": list(self.uris),
+                "files_written": self.files_written, "records_in_manifests": self.records_in_manifests}
+
+    def close(self):
+        """Stores the last file and publishes the load manifest."""
+        self.commit()
+        if not self.uris:
+            return self.records_published
+
+        manifest = dict(self.metadata, load_mode="bulk", file_format=self.file_format,
+                        uris=self.uris, record_count=self.records_published - self.records_in_manifests,
+                        sync_id=self.sync_id)
+        data, attributes = envelope.encode(manifest)
+        self.client.publish(self.topic_path, data, **self.attributes, **attributes).result()
+        self.messages_published += 1
+        self.uris = []
+        self.records_in_manifests = self.records_published
+        return self.records_published
+
+    def _open_file(self):
+        fd, self._local_path = tempfile.mkstemp(suffix=FILE_FORMATS[self.file_format])
+        os.close(fd)
+        if self.file_format == "ndjson":
+            self._file = gzip.open(self._local_path, "wb")
+
+    def _close_file(self):
+        if self.file_format == "ndjson":
+            self._file.close()
+        else:
+            _write_parquet(self._local_path, self._parquet_rows, self.table_name)
+            self._parquet_rows = []
+
+        uri = f"{self.prefix}/part-{self.files_written:05d}{FILE_FORMATS[self.file_format]}"
+        self.bytes_published += os.path.getsize(self._local_path)
+        _store(self._local_path, uri)
+        self.uris.append(uri)
+        self.files_written += 1
+        self._file = None
+        self._rows_in_file = 0
+
+
+# ===================================================================
+#           3. READING STAGED FILES
+# ===================================================================
+
+def local_load_sources(uris, file_format):
+    """
+    Yields open binary files for loading staged files from a local directory.
+    NDJSON chunks are decompressed into one temporary file so the whole sync
+    still goes through a single load job; Parquet files are yielded one by one.
+    """
+    if file_format == "parquet":
+        for uri in uris:
+            with open(uri, "rb") as source:
+                yield source
+        return
+
+    with tempfile.TemporaryFile() as combined:
+        for uri in uris:
+            with gzip.open(uri, "rb") as chunk:
+                shutil.copyfileobj(chunk, combined)
+        combined.seek(0)
+        yield combined
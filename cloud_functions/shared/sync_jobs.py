@@ -0,0 +1,311 @@
+import datetime
+import os
+import random
+
+from shared import clients, envelope, telemetry
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# A bulk sync job is spread over several documents so that concurrent
+# extractors and loaders don't contend for one (Firestore sustains about one
+# write per second per document):
+#   sync_jobs/{job_id} = {
+#       "status": "running" | "done", "sources": [...], "options": {...},
+#       "max_concurrency": {"mailchimp": 10, ...}, "total": n,
+#       "created_at": ..., "finished_at": ..., "duration_seconds": ...}
+#   sync_jobs/{job_id}/items/{user_id}__{source} = {
+#       "user_id": ..., "source": ...,
+#       "status": "queued" | "dispatched" | "running" | "done" | "failed" | "skipped",
+#       "records_extracted": n, "records_loaded": n, "records_failed": n, "invocations": n,
+#       "dispatched_at": ..., "started_at": ..., "finished_at": ..., "duration_seconds": ..., "error": ...}
+#   sync_jobs/{job_id}/queues/{source} = {"users": [...], "next_index": n, "finished": n}
+#   sync_jobs/{job_id}/counters/{shard} = {"done": n, "failed": n, "skipped": n,
+#       "records_extracted": n, "records_loaded": n, "records_failed": n}
+# read_job() assembles them into one summary, which the dashboard polls.
+JOB_COLLECTION = "sync_jobs"
+# Syncs of one source that may run at once within a job; the provider's API
+# limits apply per account, but every sync also shares our function instances.
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("BULK_SYNC_MAX_CONCURRENCY", "10"))
+# Job-wide totals are incremented on one of this many counter documents, picked at random.
+COUNTER_SHARDS = int(os.getenv("JOB_COUNTER_SHARDS", "10"))
+# Attempts of a finish transaction; they only contend on the source's queue document.
+TRANSACTION_ATTEMPTS = int(os.getenv("JOB_TRANSACTION_ATTEMPTS", "10"))
+# Firestore's limit of writes per batch.
+WRITE_BATCH_SIZE = 500
+
+FINISHED_STATUSES = ("done", "failed", "skipped")
+COUNTER_FIELDS = FINISHED_STATUSES + ("records_extracted", "records_loaded", "records_failed")
+
+
+class JobUpdateError(Exception):
+    """Raised when a sync's outcome can't be recorded on its job; the triggering message should be redelivered."""
+
+
+def _job_ref(db, job_id):
+    return db.collection(JOB_COLLECTION).document(job_id)
+
+
+def _item_ref(job_ref, user_id, source):
+    return job_ref.collection("items").document(f"{user_id}__{source}")
+
+
+def _queue_ref(job_ref, source):
+    return job_ref.collection("queues").document(source)
+
+
+def _counter_ref(job_ref):
+    return job_ref.collection("counters").document(str(random.randrange(COUNTER_SHARDS)))
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _seconds_between(start, end):
+    return round((end - start).total_seconds(), 1) if start else None
+
+
+def _write_all(db, writes):
+    """Writes (ref, data) pairs in as few batched writes as Firestore allows."""
+    for start in range(0, len(writes), WRITE_BATCH_SIZE):
+        batch = db.batch()
+        for ref, data in writes[start:start + WRITE_BATCH_SIZE]:
+            batch.set(ref, data)
+        batch.commit()
+
+
+# ===================================================================
+#           2. CREATE AND DISPATCH
+# ===================================================================
+
+def create_job(db, job_id, users, sources, options=None, max_concurrency=None):
+    """
+    Writes the documents of a new job with every (user, source) sync
+    queued, except the first max_concurrency users of each source, which
+    are marked "dispatched". Returns those (user_id, source) pairs in user
+    order, so every source's first syncs start together, for dispatch();
+    the rest are dispatched as earlier syncs of the same source finish
+    (finish_item()).
+    """
+    now = _now()
+    limits = {source: int((max_concurrency or {}).get(source, DEFAULT_MAX_CONCURRENCY)) for source in sources}
+    job_ref = _job_ref(db, job_id)
+    writes = [(_queue_ref(job_ref, source), {"users": list(users), "next_index": min(limits[source], len(users)),
+                                             "finished": 0})
+              for source in sources]
+    first = []
+    for index, user_id in enumerate(users):
+        for source in sources:
+            item = {"user_id": user_id, "source": source, "status": "queued",
+                    "records_extracted": 0, "records_loaded": 0, "records_failed": 0}
+            if index < limits[source]:
+                item.update(status="dispatched", dispatched_at=now)
+                first.append((user_id, source))
+            writes.append((_item_ref(job_ref, user_id, source), item))
+    # The job document goes last: once it exists, the whole job does.
+    writes.append((job_ref, {
+        "status": "running",
+        "sources": list(sources),
+        "options": dict(options or {}),
+        "max_concurrency": limits,
+        "total": len(users) * len(sources),
+        "created_at": now,
+    }))
+    _write_all(db, writes)
+    return first
+
+
+def dispatch(topic_path, job_id, items, options=None):
+    """
+    Publishes a sync request per (user_id, source) to the router topic in
+    one batch. Each sync gets its own trace and carries the job id as an
+    attribute through the router, extractor and loader.
+    Returns the pairs whose publish failed.
+    """
+    publisher = clients.batch_publisher_client()
+    futures = []
+    for user_id, source in items:
+        with telemetry.trace(job_id=job_id):
+            data, attributes = envelope.encode(dict(options or {}, source=source, user=user_id))
+            futures.append(((user_id, source), publisher.publish(topic_path, data, **attributes,
+                                                                 **telemetry.message_attributes())))
+    failed = []
+    for item, future in futures:
+        try:
+            future.result()
+        except Exception as e:
+            print(f"!!! Error dispatching '{item[1]}' sync for user {item[0]} of job {job_id}: {e}")
+            failed.append(item)
+    return failed
+
+
+# ===================================================================
+#           3. PER-SYNC PROGRESS
+# ===================================================================
+
+def start_item(db, job_id, user_id, source):
+    """
+    Marks a dispatched sync as running; later invocations of a chained sync
+    only count themselves. Syncs outside a job (job_id None) are ignored.
+    Errors are only logged: the start time is informational.
+    """
+    if not job_id:
+        return
+    try:
+        from google.cloud import firestore
+        item_ref = _item_ref(_job_ref(db, job_id), user_id, source)
+        snapshot = item_ref.get()
+        item = snapshot.to_dict() if snapshot.exists else None
+        if not item or item.get("status") in FINISHED_STATUSES:
+            return
+        updates = {"invocations": firestore.Increment(1)}
+        if item.get("status") != "running":
+            updates.update(status="running", started_at=_now())
+        item_ref.set(updates, merge=True)
+    except Exception as e:
+        print(f"!!! Error updating job {job_id} for {user_id}/{source}: {e}")
+
+
+def _finish_in_transaction(transaction, job_ref, user_id, source, status, fields):
+    from google.cloud import firestore
+    item_ref, queue_ref = _item_ref(job_ref, user_id, source), _queue_ref(job_ref, source)
+    # Transactions read everything before they write.
+    item_snapshot = item_ref.get(transaction=transaction)
+    item = item_snapshot.to_dict() if item_snapshot.exists else None
+    # Unknown, or already recorded by an earlier delivery of the same message.
+    if not item or item.get("status") in FINISHED_STATUSES:
+        return None, False
+    queue = queue_ref.get(transaction=transaction).to_dict()
+
+    now = _now()
+    # Syncs that never started (skipped, or failed early) count from their dispatch.
+    started_at = item.get("started_at") or item.get("dispatched_at")
+    transaction.set(item_ref, dict(fields, status=status, finished_at=now,
+                                   duration_seconds=_seconds_between(started_at, now)), merge=True)
+    transaction.set(_counter_ref(job_ref), {
+        status: firestore.Increment(1),
+        "records_extracted": firestore.Increment(fields.get("records_extracted", 0)),
+    }, merge=True)
+
+    # Hand the freed slot to the next queued user of the same source.
+    next_user = None
+    updates = {"finished": queue["finished"] + 1}
+    if queue["next_index"] < len(queue["users"]):
+        next_user = queue["users"][queue["next_index"]]
+        updates["next_index"] = queue["next_index"] + 1
+        transaction.set(_item_ref(job_ref, next_user, source), {"status": "dispatched", "dispatched_at": now},
+                        merge=True)
+    transaction.set(queue_ref, updates, merge=True)
+    return next_user, updates["finished"] >= len(queue["users"])
+
+
+def _complete_if_finished(job_ref):
+    """Marks the job done once every source's queue has finished."""
+    job = job_ref.get().to_dict()
+    for source in job["sources"]:
+        queue = _queue_ref(job_ref, source).get().to_dict()
+        if queue["finished"] < len(queue["users"]):
+            return
+    now = _now()
+    job_ref.set({"status": "done", "finished_at": now,
+                 "duration_seconds": _seconds_between(job.get("created_at"), now)}, merge=True)
+
+
+def finish_item(db, job_id, user_id, source, status, **fields):
+    """
+    Records the outcome of one (user, source) sync of a job: "done",
+    "failed" or "skipped" (suppressed by the router), plus fields such as
+    records_extracted or error. Returns the user whose sync of the same
+    source should be dispatched next, or None.
+    Syncs outside a job (job_id None) are ignored. Contention is retried;
+    if the outcome still can't be recorded, JobUpdateError is raised so the
+    triggering message is redelivered instead of the job stalling.
+    """
+    if not job_id:
+        return None
+    from google.cloud import firestore
+    job_ref = _job_ref(db, job_id)
+    try:
+        finish = firestore.transactional(_finish_in_transaction)
+        next_user, source_finished = finish(db.transaction(max_attempts=TRANSACTION_ATTEMPTS),
+                                            job_ref, user_id, source, status, fields)
+        if source_finished:
+            _complete_if_finished(job_ref)
+    except Exception as e:
+        raise JobUpdateError(f"Could not record the '{source}' sync of {user_id} on job {job_id}: {e}") from e
+    return next_user
+
+
+def finish_and_dispatch(db, topic_path, job_id, user_id, source, status, **fields):
+    """finish_item(), then dispatches the next queued sync of the source, if any."""
+    next_user = finish_item(db, job_id, user_id, source, status, **fields)
+    if next_user:
+        options = (_job_ref(db, job_id).get().to_dict() or {}).get("options")
+        if not dispatch(topic_path, job_id, [(next_user, source)], options):
+            print(f"Dispatched the next '{source}' sync of job {job_id} (user {next_user}).")
+        else:
+            # Keep the job from waiting on a sync that was never sent.
+            finish_and_dispatch(db, topic_path, job_id, next_user, source, "failed",
+                                error="Could not publish the sync request.")
+
+
+def record_load(db, job_id, user_id, source, loaded=0, failed=0):
+    """
+    Adds the rows one loader message loaded and rejected to its sync and to
+    the job's totals, in one batched write. Messages outside a job are ignored.
+    """
+    if not job_id or not user_id or not source:
+        return
+    from google.cloud import firestore
+    job_ref = _job_ref(db, job_id)
+    batch = db.batch()
+    batch.set(_item_ref(job_ref, user_id, source), {
+        "records_loaded": firestore.Increment(loaded),
+        "records_failed": firestore.Increment(failed),
+    }, merge=True)
+    batch.set(_counter_ref(job_ref), {
+        "records_loaded": firestore.Increment(loaded),
+        "records_failed": firestore.Increment(failed),
+    }, merge=True)
+    batch.commit()
+
+
+# ===================================================================
+#           4. READING A JOB
+# ===================================================================
+
+def read_job(db, job_id, include_items=False):
+    """
+    Returns a job's document with its live totals, or None if it doesn't exist:
+        {..., "counts": {"queued": n, "running": n, "done": n, "failed": n, "skipped": n},
+         "records": {"extracted": n, "loaded": n, "failed": n}}
+    With include_items, "tenants" maps user_id -> source -> that sync's document.
+    """
+    job_ref = _job_ref(db, job_id)
+    snapshot = job_ref.get()
+    if not snapshot.exists:
+        return None
+    job = snapshot.to_dict()
+
+    totals = dict.fromkeys(COUNTER_FIELDS, 0)
+    for shard in job_ref.collection("counters").stream():
+        for field, value in (shard.to_dict() or {}).items():
+            totals[field] = totals.get(field, 0) + value
+    queued = running = 0
+    for source in job["sources"]:
+        queue = _queue_ref(job_ref, source).get().to_dict()
+        queued += len(queue["users"]) - queue["next_index"]
+        running += queue["next_index"] - queue["finished"]
+
+    job["counts"] = dict({"queued": queued, "running": running},
+                         **{status: totals[status] for status in FINISHED_STATUSES})
+    job["records"] = {"extracted": totals["records_extracted"], "loaded": totals["records_loaded"],
+                      "failed": totals["records_failed"]}
+    if include_items:
+        job["tenants"] = {}
+        for item in job_ref.collection("items").stream():
+            item = item.to_dict()
+            job["tenants"].setdefault(item["user_id"], {})[item["source"]] = item
+    return job
@@ -0,0 +1,57 @@
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+# One document per user, next to 'user_credentials':
+#   sync_state/{user_id} = {"mailchimp": {"campaigns": {"watermark": ..., "updated_at": ...}}}
+SYNC_STATE_COLLECTION = "sync_state"
+
+
+# ===================================================================
+#           2. HIGH-WATER MARKS
+# ===================================================================
+
+def get_watermark(db, user_id, source, resource):
+    """Returns the stored high-water mark for a user's resource, or None."""
+    doc = db.collection(SYNC_STATE_COLLECTION).document(user_id).get()
+    if not doc.exists:
+        return None
+    state = (doc.to_dict() or {}).get(source, {}).get(resource, {})
+    return state.get("watermark")
+
+
+def set_watermark(db, user_id, source, resource, watermark):
+    """Stores a new high-water mark without touching other sources or resources."""
+    from google.cloud import firestore
+    db.collection(SYNC_STATE_COLLECTION).document(user_id).set({
+        source: {
+            resource: {
+                "watermark": watermark,
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }
+        }
+    }, merge=True)
+
+
+class WatermarkTracker:
+    """
+    Tracks the largest value of one field across a stream of records.
+    Values are compared as strings, which orders Mailchimp's ISO 8601
+    timestamps correctly.
+    """
+
+    def __init__(self, field, start=None):
+        self.field = field
+        self.start = start
+        self.value = start
+
+    def track(self, records):
+        for record in records:
+            value = record.get(self.field)
+            if value and (self.value is None or value > self.value):
+                self.value = value
+            yield record
+
+    @property
+    def advanced(self):
+        return self.value is not None and self.value != self.start
@@ -0,0 +1,150 @@
+import contextlib
+import contextvars
+import json
+import os
+import time
+import uuid
+
+# ===================================================================
+#                      1. CONFIGURATION
+# ===================================================================
+
+PROJECT_ID = os.getenv("GCP_PROJECT_ID") or os.getenv("GCP_PROJECT", "")
+# Cloud Functions sets K_SERVICE (2nd gen) or FUNCTION_NAME (1st gen).
+COMPONENT = os.getenv("K_SERVICE") or os.getenv("FUNCTION_NAME") or "local"
+
+# Pub/Sub message attributes that carry the trace from function to function.
+TRACE_ATTRIBUTE = "trace_id"
+SYNC_ATTRIBUTE = "sync_id"
+# Set on every message of a sync started by a bulk request (shared/sync_jobs.py).
+JOB_ATTRIBUTE = "job_id"
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_sync_id = contextvars.ContextVar("sync_id", default=None)
+_job_id = contextvars.ContextVar("job_id", default=None)
+
+
+# ===================================================================
+#           2. TRACE CONTEXT
+# ===================================================================
+
+def new_trace_id():
+    # 32 hex characters, the trace id format Cloud Logging groups entries by.
+    return uuid.uuid4().hex
+
+
+def event_attributes(cloud_event):
+    """Returns the Pub/Sub message attributes of a CloudEvent, or {}."""
+    try:
+        return cloud_event.data["message"].get("attributes") or {}
+    except (AttributeError, KeyError, TypeError):
+        return {}
+
+
+@contextlib.contextmanager
+def trace(cloud_event=None, trace_id=None, sync_id=None, job_id=None):
+    """
+    Sets the trace, sync and job ids for everything logged or published
+    inside the block. Explicit ids win; otherwise they are read from the
+    triggering message's attributes, and a new trace id is started if there
+    is none.
+    """
+    attributes = event_attributes(cloud_event) if cloud_event is not None else {}
+    trace_token = _trace_id.set(trace_id or attributes.get(TRACE_ATTRIBUTE) or new_trace_id())
+    sync_token = _sync_id.set(sync_id or attributes.get(SYNC_ATTRIBUTE))
+    job_token = _job_id.set(job_id or attributes.get(JOB_ATTRIBUTE))
+    try:
+        yield
+    finally:
+        _job_id.reset(job_token)
+        _sync_id.reset(sync_token)
+        _trace_id.reset(trace_token)
+
+
+def set_sync_id(sync_id):
+    """Attaches a sync id to the current trace once it is known."""
+    _sync_id.set(sync_id)
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def current_sync_id():
+    return _sync_id.get()
+
+
+def current_job_id():
+    return _job_id.get()
+
+
+def message_attributes():
+    """Attributes to publish with every Pub/Sub message so the next function joins the trace."""
+    attributes = {TRACE_ATTRIBUTE: _trace_id.get(), SYNC_ATTRIBUTE: _sync_id.get(), JOB_ATTRIBUTE: _job_id.get()}
+    return {key: value for key, value in attributes.items() if value}
+
+
+# ===================================================================
+#           3. STRUCTURED LOGS AND SPANS
+# ===================================================================
+
+def log(message, severity="INFO", **fields):
+    """
+    Prints one JSON log record. Cloud Logging parses JSON lines written to
+    stdout, uses 'severity' and 'message', and groups entries that share a
+    'logging.googleapis.com/trace' value into one trace.
+    """
+    entry = {"severity": severity, "message": message, "component": COMPONENT}
+    trace_id, sync_id, job_id = _trace_id.get(), _sync_id.get(), _job_id.get()
+    if trace_id:
+        entry["trace_id"] = trace_id
+        if PROJECT_ID:
+            entry["logging.googleapis.com/trace"] = f"projects/{PROJECT_ID}/traces/{trace_id}"
+    if sync_id:
+        entry["sync_id"] = sync_id
+    if job_id:
+        entry["job_id"] = job_id
+    entry.update(fields)
+    print(json.dumps(entry, default=str))
+
+
+class Span:
+    """Counts what one stage processed; see span()."""
+
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+        self.records = 0
+        self.bytes = 0
+
+    def add(self, records=0, num_bytes=0):
+        self.records += records
+        self.bytes += num_bytes
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+@contextlib.contextmanager
+def span(stage, **fields):
+    """
+    Times a stage and logs it as one record when the block exits:
+        {"message": "span", "stage": ..., "start_time": ..., "duration_ms": ...,
+         "records": ..., "bytes": ..., ...fields}
+    Exceptions are logged on the span with severity ERROR and re-raised.
+    """
+    current = Span(stage, dict(fields))
+    start_time = time.time()
+    started = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        extra = {"error": error} if error else {}
+        log("span", severity="ERROR" if error else "INFO", stage=stage,
+            start_time=round(start_time, 3),
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+            records=current.records, bytes=current.bytes, **extra, **current.fields)
@@ -0,0 +1,241 @@
+"""
+Tests for extractors/mailchimp-sync/batch_operations.py against a local HTTP
+stand-in for Mailchimp's /lists and /batches endpoints and the batch result
+archive.
+
+    python -m unittest discover -s cloud_functions/tests
+"""
+import io
+import json
+import os
+import sys
+import tarfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "extractors", "mailchimp-sync")]
+
+import batch_operations  # noqa: E402
+
+
+def result_archive(files):
+    """A tar.gz holding a directory and one JSON file per list of operation results."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        directory = tarfile.TarInfo("results")
+        directory.type = tarfile.DIRTYPE
+        archive.addfile(directory)
+        for index, results in enumerate(files):
+            data = json.dumps(results).encode("utf-8")
+            info = tarfile.TarInfo(f"results/{index}.json")
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def ok(operation_id, members):
+    return {"status_code": 200, "operation_id": operation_id, "response": json.dumps({"members": members})}
+
+
+class FakeMailchimp:
+    """
+    Serves /3.0/lists, /3.0/batches and the batch archive on localhost.
+    'lists' is returned as-is; the batch reports each status in 'statuses'
+    in turn (the last one repeats) and then serves 'archive'.
+    """
+
+    def __init__(self, lists=(), statuses=("finished",), archive=b""):
+        self.lists = list(lists)
+        self.statuses = list(statuses)
+        self.archive = archive
+        self.requests = []  # (method, path, query, body)
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.handle(self, "GET")
+
+            def do_POST(self):
+                fake.handle(self, "POST")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, handler, method):
+        url = urlparse(handler.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(handler.headers.get("Content-Length") or 0)
+        body = json.loads(handler.rfile.read(length)) if length else None
+        self.requests.append((method, url.path, query, body))
+
+        if method == "GET" and url.path == "/3.0/lists":
+            offset, count = int(query.get("offset", 0)), int(query.get("count", 10))
+            self.respond(handler, 200, {"lists": self.lists[offset:offset + count], "total_items": len(self.lists)})
+        elif method == "POST" and url.path == "/3.0/batches":
+            self.respond(handler, 200, {"id": "batch1", "status": "pending"})
+        elif method == "GET" and url.path == "/3.0/batches/batch1":
+            status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+            self.respond(handler, 200, {
+                "id": "batch1", "status": status, "total_operations": 2, "finished_operations": 1,
+                "errored_operations": 1, "response_body_url": f"{self.base_url}/results/batch1.tar.gz",
+            })
+        elif method == "GET" and url.path == "/results/batch1.tar.gz":
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/x-gzip")
+            handler.send_header("Content-Length", str(len(self.archive)))
+            handler.end_headers()
+            handler.wfile.write(self.archive)
+        else:
+            self.respond(handler, 404, {"status": 404, "detail": f"{method} {url.path} is not served"})
+
+    @staticmethod
+    def respond(handler, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def requests_to(self, method, path):
+        return [request for request in self.requests if request[0] == method and request[1] == path]
+
+
+class BatchOperationsTest(unittest.TestCase):
+
+    def serve(self, **kwargs):
+        fake = FakeMailchimp(**kwargs)
+        self.addCleanup(fake.close)
+        return fake, f"{fake.base_url}/3.0"
+
+    def test_list_sizes_counts_every_member_status(self):
+        fake, base_url = self.serve(lists=[
+            {"id": "a", "stats": {"member_count": 3, "unsubscribe_count": 1, "cleaned_count": 1,
+                                  "total_contacts": 9}},
+            {"id": "b", "stats": {"total_contacts": 0}},
+        ])
+
+        self.assertEqual(batch_operations.list_sizes(base_url, {}), {"a": 9, "b": 0})
+        (_, _, query, _), = fake.requests_to("GET", "/3.0/lists")
+        self.assertEqual(query["include_total_contacts"], "true")
+        self.assertIn("lists.stats.total_contacts", query["fields"])
+
+    def test_member_operations_page_each_list(self):
+        operations = batch_operations.member_operations({"a": 2500, "b": 0, "c": 1}, {"status": "x"})
+
+        self.assertEqual([op["operation_id"] for op in operations], ["a:0", "a:1000", "a:2000", "c:0"])
+        self.assertEqual(operations[1]["path"], "/lists/a/members")
+        self.assertEqual(operations[1]["params"], {"status": "x", "count": 1000, "offset": 1000})
+
+    def test_submit_batch_posts_operations(self):
+        fake, base_url = self.serve()
+        operations = batch_operations.member_operations({"a": 1})
+
+        self.assertEqual(batch_operations.submit_batch(base_url, {}, operations), "batch1")
+        (_, _, _, body), = fake.requests_to("POST", "/3.0/batches")
+        self.assertEqual(body, {"operations": operations})
+
+    def test_wait_for_batch_polls_until_finished(self):
+        fake, base_url = self.serve(statuses=["pending", "started", "finished"])
+
+        status = batch_operations.wait_for_batch(base_url, {}, "batch1", poll_interval=0)
+        self.assertEqual(status["status"], "finished")
+        self.assertEqual(len(fake.requests_to("GET", "/3.0/batches/batch1")), 3)
+
+    def test_wait_for_batch_gives_up_after_timeout(self):
+        _, base_url = self.serve(statuses=["started"])
+
+        with self.assertRaises(batch_operations.BatchOperationError):
+            batch_operations.wait_for_batch(base_url, {}, "batch1", poll_interval=0, timeout=0)
+
+    def test_batch_results_skip_failed_operations(self):
+        fake, _ = self.serve(archive=result_archive([
+            [ok("a:0", [{"id": 1}, {"id": 2}]),
+             {"status_code": 404, "operation_id": "a:1000", "response": json.dumps({"detail": "gone"})}],
+            [ok("b:0", [{"id": 3}])],
+        ]))
+        url = f"{fake.base_url}/results/batch1.tar.gz"
+
+        results = list(batch_operations.iter_batch_results(url, "members"))
+        self.assertEqual(results, [([{"id": 1}, {"id": 2}], 1), ([{"id": 3}], 2)])
+        # A resumed run skips the files it already read.
+        self.assertEqual(list(batch_operations.iter_batch_results(url, "members", skip_files=1)),
+                         [([{"id": 3}], 2)])
+
+    def test_iter_members_submits_polls_and_yields_positions(self):
+        fake, base_url = self.serve(
+            lists=[{"id": "a", "stats": {"total_contacts": 1500}}],
+            statuses=["started", "finished"],
+            archive=result_archive([[ok("a:0", [{"id": 1}])], [ok("a:1000", [{"id": 2}])]]),
+        )
+        with mock.patch.object(batch_operations.time, "sleep") as sleep, \
+                mock.patch.object(batch_operations.time, "time", return_value=100.0):
+            pages = list(batch_operations.iter_members(base_url, {}, params={"since_last_changed": "t"}))
+        sleep.assert_called_once_with(batch_operations.POLL_INTERVAL_SECONDS)
+        self.assertEqual(pages, [
+            ([], {"batch_id": "batch1", "files": 0, "submitted_at": 100.0}),
+            ([], {"batch_id": "batch1", "files": 0, "submitted_at": 100.0}),  # still 'started'
+            ([{"id": 1}], {"batch_id": "batch1", "files": 1, "submitted_at": 100.0}),
+            ([{"id": 2}], {"batch_id": "batch1", "files": 2, "submitted_at": 100.0}),
+        ])
+        (_, _, _, body), = fake.requests_to("POST", "/3.0/batches")
+        self.assertEqual([op["params"]["offset"] for op in body["operations"]], [0, 1000])
+        self.assertEqual(body["operations"][0]["params"]["since_last_changed"], "t")
+
+    def test_iter_members_resumes_the_same_batch(self):
+        fake, base_url = self.serve(archive=result_archive([[ok("a:0", [{"id": 1}])], [ok("a:1000", [{"id": 2}])]]))
+
+        position = {"batch_id": "batch1", "files": 1, "submitted_at": 100.0}
+        pages = list(batch_operations.iter_members(base_url, {}, position=position))
+        self.assertEqual(pages, [([{"id": 2}], dict(position, files=2))])
+        self.assertEqual(fake.requests_to("POST", "/3.0/batches"), [])
+
+    def test_iter_members_polls_across_a_suspend_and_resume(self):
+        fake, base_url = self.serve(
+            lists=[{"id": "a", "stats": {"total_contacts": 1500}}],
+            statuses=["started", "started", "finished"],
+            archive=result_archive([[ok("a:0", [{"id": 1}])], [ok("a:1000", [{"id": 2}])]]),
+        )
+        # First invocation: submit, poll once, then run out of time at the
+        # empty page yielded while the job is still running.
+        with mock.patch.object(batch_operations.time, "sleep"):
+            pages = batch_operations.iter_members(base_url, {})
+            _, submitted = next(pages)
+            records, saved = next(pages)
+            pages.close()
+        self.assertEqual(records, [])
+        self.assertEqual(saved, submitted)
+
+        # The chained invocation polls the same job until it finishes.
+        with mock.patch.object(batch_operations.time, "sleep"):
+            resumed = list(batch_operations.iter_members(base_url, {}, position=saved))
+        self.assertEqual(resumed, [
+            ([], saved),
+            ([{"id": 1}], dict(saved, files=1)),
+            ([{"id": 2}], dict(saved, files=2)),
+        ])
+        self.assertEqual(len(fake.requests_to("POST", "/3.0/batches")), 1)
+        self.assertEqual(len(fake.requests_to("GET", "/3.0/batches/batch1")), 3)
+
+    def test_iter_members_times_out_from_the_submission(self):
+        _, base_url = self.serve(statuses=["started"])
+        position = {"batch_id": "batch1", "files": 0, "submitted_at": 0.0}
+
+        with self.assertRaises(batch_operations.BatchOperationError):
+            list(batch_operations.iter_members(base_url, {}, position=position))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""
+Tests for shared/staging.py: what the staged files of a registered table
+hold in the overflow JSON column, next to the streamed rows of the same
+record.
+
+    python -m unittest discover -s cloud_functions/tests
+"""
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from shared import envelope, schema_registry, staging  # noqa: E402
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+CAMPAIGN = {"id": "c1", "send_time": "2024-05-01T10:00:00+00:00", "settings": {"subject_line": "Hi"},
+            "tracking": {"opens": True}}
+METADATA = {"source": "mailchimp", "user_id": "u1", "table_name": "mailchimp_campaigns", "sync_id": "s1"}
+
+
+class _Future:
+    def result(self, timeout=None):
+        return "1"
+
+
+class FakePublisher:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, topic_path, data, **attributes):
+        self.messages.append(data)
+        return _Future()
+
+
+class StagedOverflowTest(unittest.TestCase):
+
+    def stage(self, file_format):
+        """Stages CAMPAIGN and returns the one file its load manifest lists."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        client = FakePublisher()
+        publisher = staging.StagedPublisher(client, "topic", METADATA, directory, "s1", file_format=file_format)
+        publisher.publish(CAMPAIGN)
+        publisher.close()
+        (manifest,) = [envelope.decode(data) for data in client.messages]
+        (uri,) = manifest["uris"]
+        return uri
+
+    def test_streamed_rows_encode_the_overflow(self):
+        row = schema_registry.flatten("mailchimp_campaigns", CAMPAIGN, METADATA)
+        self.assertEqual(json.loads(row["extra_fields"]), {"tracking": {"opens": True}})
+
+    def test_ndjson_rows_keep_the_overflow_as_an_object(self):
+        with gzip.open(self.stage("ndjson"), "rt") as staged:
+            (row,) = [json.loads(line) for line in staged]
+        self.assertEqual(row["campaign_id"], "c1")
+        self.assertEqual(row["extra_fields"], {"tracking": {"opens": True}})
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_parquet_rows_write_the_overflow_as_json(self):
+        table = pq.read_table(self.stage("parquet"))
+        self.assertIn("json", str(table.schema.field("extra_fields").type))
+        (value,) = table.column("extra_fields").to_pylist()
+        self.assertEqual(json.loads(value), {"tracking": {"opens": True}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -23,9 +23,13 @@ def get_secret(project_id: str, secret_id: str, version_id: str = "latest") -> s
         raise
 
 
-def load_data_to_bigquery(project_id: str, table_id: str, data: list) -> None:
+def load_data_to_bigquery(project_id: str, table_id: str, data: list, streaming: bool = False) -> None:
     """
     Loads a list of dictionaries into a specified BigQuery table.
+
+    By default the rows go through one load job, which is free and leaves
+    them in table storage where DML can reach them right away. streaming=True
+    uses streaming inserts instead, for small trickle updates.
     """
     if not data:
         print("No data provided to load. Skipping BigQuery load.")
@@ -34,15 +38,34 @@ def load_data_to_bigquery(project_id: str, table_id: str, data: list) -> None:
     client = bigquery.Client(project=project_id)
     full_table_id = f"{project_id}.{table_id}" # e.g., mis581-capstone-data.raw_data.peer1_contacts_raw
 
+    if streaming:
+        print(f"Attempting to stream {len(data)} rows into BigQuery table: {full_table_id}")
+        try:
+            errors = client.insert_rows_json(full_table_id, data)
+            if not errors:
+                print("Data loaded successfully to BigQuery.")
+            else:
+                print("Encountered errors while inserting rows to BigQuery:")
+                for error in errors:
+                    print(error)
+        except Exception as e:
+            print(f"An unexpected error occurred during BigQuery load: {e}")
+            raise
+        return
+
     print(f"Attempting to load {len(data)} rows into BigQuery table: {full_table_id}")
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        # A new table gets its schema from the rows; an existing one keeps its own.
+        autodetect=True,
+    )
+    job = client.load_table_from_json(data, full_table_id, job_config=job_config)
     try:
-        errors = client.insert_rows_json(full_table_id, data)
-        if not errors:
-            print("Data loaded successfully to BigQuery.")
-        else:
-            print("Encountered errors while inserting rows to BigQuery:")
-            for error in errors:
-                print(error)
+        job.result()
+        print(f"Data loaded successfully to BigQuery ({job.output_rows} rows).")
     except Exception as e:
-        print(f"An unexpected error occurred during BigQuery load: {e}")
-        raise
\ No newline at end of file
+        print(f"Encountered errors while loading rows to BigQuery: {e}")
+        for error in job.errors or []:
+            print(error)
+        raise
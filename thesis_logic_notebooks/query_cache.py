@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+
+DEFAULT_CACHE_DIR = os.path.expanduser("~/.cache/insightiq/query_results")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# String literals and quoted identifiers are kept verbatim; comments and runs
+# of whitespace outside them are not part of a query's identity.
+_SQL_TOKENS = re.compile(
+    r"""('(?:\\.|[^'\\])*'|"(?:\\.|[^"\\])*"|`[^`]*`)"""
+    r"""|(--[^\n]*|#[^\n]*|/\*.*?\*/)"""
+    r"""|(\s+)""",
+    re.DOTALL,
+)
+
+# Cached Arrow types read back with the nullable dtypes to_dataframe() gives
+# BigQuery INT64 and BOOL columns, so a hit matches the miss it replays.
+_PANDAS_TYPES = {
+    pa.int64(): pd.Int64Dtype(),
+    pa.bool_(): pd.BooleanDtype(),
+}
+
+# Results of these functions change between runs, so such queries are never cached.
+_NON_DETERMINISTIC = re.compile(
+    r"\b(CURRENT_(DATE|DATETIME|TIME|TIMESTAMP)|RAND|GENERATE_UUID|SESSION_USER)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """Strips comments, collapses whitespace and drops a trailing semicolon."""
+    def replace(match):
+        return match.group(1) or " "
+    # The second pass merges the whitespace left on both sides of a removed comment.
+    normalized = _SQL_TOKENS.sub(replace, _SQL_TOKENS.sub(replace, sql))
+    return normalized.strip().rstrip(";").strip()
+
+
+class QueryCache:
+    """
+    Caches SELECT results from BigQuery as Parquet files on local disk.
+
+    An entry's key is the normalized SQL, its query parameters, and the
+    last-modified time of every table the query reads (found with a free dry
+    run), so a cached result is never served once the underlying data has
+    changed. The least recently used entries are evicted once the cache grows
+    past max_bytes. Misses are downloaded through the BigQuery Storage Read
+    API with to_dataframe(), so NULLable INT64/BOOL columns keep their
+    "Int64"/"boolean" dtypes, and hits are read back with the same dtypes.
+    """
+
+    def __init__(self, client: bigquery.Client, cache_dir: str = DEFAULT_CACHE_DIR,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def query(self, sql: str, job_config: bigquery.QueryJobConfig = None) -> pd.DataFrame:
+        """Returns the query result as a DataFrame, from disk when it is still current."""
+        key = None if _NON_DETERMINISTIC.search(sql) else self._cache_key(sql, job_config)
+        if key is None:
+            return self._run(sql, job_config)
+
+        path = os.path.join(self.cache_dir, f"{key}.parquet")
+        if os.path.exists(path):
+            os.utime(path)  # Mark as recently used for eviction
+            print(f"Query cache hit: {key[:12]}")
+            return pq.read_table(path).to_pandas(types_mapper=_PANDAS_TYPES.get)
+
+        print(f"Query cache miss: {key[:12]}; running query in BigQuery.")
+        result = self._run(sql, job_config)
+        pq.write_table(pa.Table.from_pandas(result, preserve_index=False), path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._evict()
+        return result
+
+    def clear(self) -> None:
+        for name in os.listdir(self.cache_dir):
+            os.remove(os.path.join(self.cache_dir, name))
+
+    def _run(self, sql, job_config):
+        rows = self.client.query(sql, job_config=job_config).result()
+        return rows.to_dataframe(create_bqstorage_client=True)
+
+    def _cache_key(self, sql, job_config):
+        """
+        Builds the cache key, or returns None for queries that must not be
+        cached: anything but a SELECT, or reads of tables we can't inspect.
+        """
+        dry_run_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        if job_config is not None and job_config.query_parameters:
+            dry_run_config.query_parameters = job_config.query_parameters
+        try:
+            dry_run = self.client.query(sql, job_config=dry_run_config)
+            if dry_run.statement_type != "SELECT":
+                return None
+            modified = sorted(
+                f"{ref.project}.{ref.dataset_id}.{ref.table_id}@{self.client.get_table(ref).modified.isoformat()}"
+                for ref in dry_run.referenced_tables
+            )
+        except Exception as e:
+            print(f"Query cache bypassed: {e}")
+            return None
+
+        parameters = [p.to_api_repr() for p in (job_config.query_parameters if job_config else [])]
+        identity = json.dumps([normalize_sql(sql), parameters, modified], sort_keys=True, default=str)
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".parquet"):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            print(f"Query cache evicted {name[:12]} ({size / 1024 ** 2:.1f} MiB)")